@@ -1,11 +1,16 @@
 import streamlit as st
-import json
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-from utils.broker_logic import AustralianMortgageBroker
-from config import MODEL_NAME, validate_environment, is_streamlit_cloud
-import re
+from utils.session_store import get_session_manager
+from utils.metrics import start_metrics_server
+from utils.generation_jobs import submit_generation
+from utils.export import EXPORT_FORMATS, export_filename, render_export
+from utils.rich_text import parse_rich_text
+from utils.mortgage_calc import REPAYMENT_TYPES, amortisation_schedule, parse_values, scenario_grid
+from config import CHAT_RENDER_PAGE_SIZE, CHAT_RENDER_WINDOW, GENERATION_POLL_SECONDS, MODEL_NAME, validate_environment, is_streamlit_cloud
+import time
+import uuid
 
 # 加载环境变量
 load_dotenv()
@@ -56,15 +61,16 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 可选：METRICS_PORT 配置时在后台暴露 Prometheus /metrics（进程内只启动一次）
+start_metrics_server()
+
 # 初始化会话状态
 def initialize_session_state():
     """快速初始化会话状态（不初始化重量级组件）"""
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    if "broker" not in st.session_state:
-        # 快速创建broker实例，数据库组件将在首次使用时懒加载
-        with st.spinner("🚀 正在初始化AI助手..."):
-            st.session_state.broker = AustralianMortgageBroker()
+    if "session_id" not in st.session_state:
+        # broker 由进程级会话表按 session_id 持有（空闲时换出到磁盘），session_state 只保存编号；
+        # broker 仅持有会话私有状态（含唯一的对话记录 broker.store），API 客户端与连接池为进程级共享
+        st.session_state.session_id = uuid.uuid4().hex
     if "current_model" not in st.session_state:
         st.session_state.current_model = MODEL_NAME
     if "use_web_search" not in st.session_state:
@@ -90,8 +96,17 @@ def _t(key: str) -> str:
         "test_conn": "🔍 测试连接 / Test Connection",
         "clear_history": "🗑️ 清除对话历史",
         "undo": "↩️ 撤销上一轮",
+        "history_older": "📜 更早的 {n} 条消息",
+        "history_page": "显示第 {start}–{end} 条",
         "export": "📥 导出对话",
-        "download_json": "下载 JSON",
+        "export_format": "导出格式",
+        "export_json": "JSON",
+        "export_json_compact": "JSON（紧凑）",
+        "export_jsonl": "JSONL",
+        "export_markdown": "Markdown",
+        "export_pdf": "PDF",
+        "download": "下载",
+        "session_memory": "会话内存：{turns} 条消息 · 约 {kb:.1f} KB",
         "about_title": "关于本应用 / About",
         "about_lines": "澳大利亚房贷专业AI助手\n- 🏦 专业房贷知识\n- 💬 多轮对话\n- 🌏 双语输出 (ZH / EN)\n- 🤖 AI驱动分析",
         "mode_search_on": "模式：模型 + 网络搜索",
@@ -104,9 +119,25 @@ def _t(key: str) -> str:
         "help": "🆘 使用帮助 / Help",
         "help_text": "- 侧边栏可开启网络搜索与推理模式\n- 搜索开启时将引用权威来源（RBA/政府/银行）\n- 公式自动渲染，避免出现原始 LaTeX 代码\n- 如需英文界面，请切换 UI Language",
         "chat_placeholder": "请输入您的房贷相关问题（支持中文/English）…",
+        "thinking": "正在思考 ...",
+        "generation_error": "抱歉，生成回复时出现错误 / Error: {error}",
+        "stop": "⏹️ 停止生成",
         "search_sources": "🌐 网络搜索来源：",
         "unknown_title": "未知标题",
         "unknown_link": "未知链接",
+        "scenario_title": "📊 情景对比（本地计算）",
+        "scenario_prices": "房价（AUD，逗号分隔或区间）",
+        "scenario_deposits": "首付比例 %",
+        "scenario_rates": "年利率 %（如 5.8-6.6:0.2）",
+        "scenario_terms": "期限（年）",
+        "scenario_types": "还款方式",
+        "scenario_io_years": "只还利息年数",
+        "scenario_run": "计算",
+        "scenario_cells": "共 {n} 个情景，耗时 {ms:.1f} ms",
+        "scenario_pick": "查看还款计划",
+        "scenario_monthly": "按月显示",
+        "type_principal_and_interest": "本息等额",
+        "type_interest_only": "只还利息",
     }
     en = {
         "settings": "⚙️ Settings",
@@ -119,8 +150,17 @@ def _t(key: str) -> str:
         "test_conn": "🔍 Test Connection",
         "clear_history": "🗑️ Clear History",
         "undo": "↩️ Undo Last",
+        "history_older": "📜 {n} earlier messages",
+        "history_page": "Show messages {start}–{end}",
         "export": "📥 Export Chat",
-        "download_json": "Download JSON",
+        "export_format": "Format",
+        "export_json": "JSON",
+        "export_json_compact": "JSON (compact)",
+        "export_jsonl": "JSONL",
+        "export_markdown": "Markdown",
+        "export_pdf": "PDF",
+        "download": "Download",
+        "session_memory": "Session memory: {turns} messages · ~{kb:.1f} KB",
         "about_title": "About",
         "about_lines": "Australian Mortgage Broker AI\n- 🏦 Mortgage expertise\n- 💬 Multi-turn chat\n- 🌏 Bilingual UI (ZH / EN)\n- 🤖 AI-powered analysis",
         "mode_search_on": "Mode: Model + Web Search",
@@ -133,73 +173,334 @@ def _t(key: str) -> str:
         "help": "🆘 Help",
         "help_text": "- Use sidebar to toggle search and reasoning\n- With search on, cites authoritative AU sources (RBA/gov/banks)\n- Formulas are auto-rendered (no raw LaTeX)\n- Switch UI Language for English labels",
         "chat_placeholder": "Ask your mortgage question (中文/English)…",
+        "thinking": "Thinking ...",
+        "generation_error": "Error generating reply: {error}",
+        "stop": "⏹️ Stop",
         "search_sources": "🌐 Sources:",
         "unknown_title": "Untitled",
         "unknown_link": "Unknown link",
+        "scenario_title": "📊 Scenario Comparison (local)",
+        "scenario_prices": "Property price (AUD, list or range)",
+        "scenario_deposits": "Deposit %",
+        "scenario_rates": "Interest rate % (e.g. 5.8-6.6:0.2)",
+        "scenario_terms": "Term (years)",
+        "scenario_types": "Repayment type",
+        "scenario_io_years": "Interest-only years",
+        "scenario_run": "Calculate",
+        "scenario_cells": "{n} scenarios in {ms:.1f} ms",
+        "scenario_pick": "Amortisation schedule",
+        "scenario_monthly": "Show monthly",
+        "type_principal_and_interest": "P&I",
+        "type_interest_only": "Interest-only",
     }
     lang = st.session_state.get("ui_lang", "zh")
     return (en if lang == "en" else zh).get(key, key)
 
 
+@st.fragment
+def render_scenario_panel():
+    """情景对比：房价 × 首付 × 利率 × 期限 × 还款方式 一次向量化计算，不调用模型。"""
+    with st.expander(_t("scenario_title")):
+        with st.form("scenario_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                prices = st.text_input(_t("scenario_prices"), "800000")
+                rates = st.text_input(_t("scenario_rates"), "5.8-6.6:0.2")
+                types = st.multiselect(
+                    _t("scenario_types"),
+                    REPAYMENT_TYPES,
+                    default=["principal_and_interest"],
+                    format_func=lambda t: _t(f"type_{t}"),
+                )
+            with col2:
+                deposits = st.text_input(_t("scenario_deposits"), "10, 20")
+                terms = st.text_input(_t("scenario_terms"), "25, 30")
+                io_years = st.number_input(_t("scenario_io_years"), min_value=1, max_value=15, value=5)
+            submitted = st.form_submit_button(_t("scenario_run"))
+        if submitted:
+            try:
+                start = time.perf_counter()
+                grid = scenario_grid(
+                    parse_values(prices, default_step=50000),
+                    parse_values(deposits, default_step=5),
+                    parse_values(rates, default_step=0.1),
+                    parse_values(terms, default_step=5),
+                    types,
+                    interest_only_years=io_years,
+                )
+                st.session_state.scenario_result = (grid, (time.perf_counter() - start) * 1000, io_years)
+            except ValueError as exc:
+                st.session_state.scenario_result = None
+                st.error(str(exc))
+
+        result = st.session_state.get("scenario_result")
+        if not result:
+            return
+        grid, elapsed_ms, io_years = result
+        rows = len(grid["repayment"])
+        st.caption(_t("scenario_cells").format(n=rows, ms=elapsed_ms))
+        table = dict(grid)
+        table["repayment_type"] = [_t(f"type_{t}") for t in grid["repayment_type"]]
+        money = st.column_config.NumberColumn(format="%.0f")
+        st.dataframe(
+            table,
+            hide_index=True,
+            column_config={
+                "property_price": money,
+                "loan_amount": money,
+                "repayment": st.column_config.NumberColumn(format="%.2f"),
+                "repayment_after_io": st.column_config.NumberColumn(format="%.2f"),
+                "total_interest": money,
+                "total_repayments": money,
+                "lvr_percent": st.column_config.NumberColumn(format="%.1f"),
+            },
+        )
+
+        # 按需生成单个情景的完整还款计划
+        labels = [
+            f"#{i + 1} · AUD {grid['property_price'][i]:,.0f} · {grid['deposit_percent'][i]:g}% · "
+            f"{grid['annual_rate_percent'][i]:g}% · {grid['term_years'][i]:g}y · {table['repayment_type'][i]}"
+            for i in range(rows)
+        ]
+        pick = st.selectbox(_t("scenario_pick"), range(rows), format_func=lambda i: labels[i])
+        monthly = st.toggle(_t("scenario_monthly"), value=False)
+        try:
+            schedule = amortisation_schedule(
+                float(grid["loan_amount"][pick]),
+                float(grid["annual_rate_percent"][pick]),
+                float(grid["term_years"][pick]),
+                interest_only_years=io_years if grid["repayment_type"][pick] == "interest_only" else 0.0,
+                yearly=not monthly,
+            )
+        except ValueError as exc:
+            st.error(str(exc))
+            return
+        st.dataframe(
+            schedule,
+            hide_index=True,
+            column_config={k: st.column_config.NumberColumn(format="%.2f") for k in ("payment", "interest", "principal", "balance")},
+        )
+
+
 def render_rich_text(text: str):
     """Render Markdown with basic LaTeX support: ```latex``` blocks and $$...$$ blocks.
-    Falls back to markdown for other content.
+    Falls back to markdown for other content. Parsing is memoised per content.
     """
     if not text:
         return
+    render_segments(parse_rich_text(str(text)))
+
 
-    content = str(text)
-
-    # Handle fenced latex blocks: ```latex ... ```
-    parts = []
-    idx = 0
-    fence_pat = re.compile(r"```latex\n(.*?)\n```", re.DOTALL | re.IGNORECASE)
-    for m in fence_pat.finditer(content):
-        if m.start() > idx:
-            parts.append(("md", content[idx:m.start()]))
-        parts.append(("latex", m.group(1).strip()))
-        idx = m.end()
-    if idx < len(content):
-        parts.append(("md", content[idx:]))
-
-    # Now split md parts further by $$...$$ blocks
-    final_parts = []
-    for kind, chunk in parts:
-        if kind == "latex":
-            final_parts.append(("latex", chunk))
-            continue
-        # split by $$...$$
-        s = chunk
-        pos = 0
-        while True:
-            start = s.find("$$", pos)
-            if start == -1:
-                final_parts.append(("md", s[pos:]))
-                break
-            end = s.find("$$", start + 2)
-            if end == -1:
-                # unmatched, treat as md
-                final_parts.append(("md", s[pos:]))
-                break
-            if start > pos:
-                final_parts.append(("md", s[pos:start]))
-            expr = s[start + 2 : end].strip()
-            final_parts.append(("latex", expr))
-            pos = end + 2
-
-    # Render
-    for kind, chunk in final_parts:
-        if not chunk:
-            continue
-        if kind == "latex":
+def render_segments(segments):
+    """渲染解析后的分段；"pending" 为流式中尚未闭合的公式，按代码显示。"""
+    for kind, chunk in segments:
+        if kind == "pending":
+            st.code(chunk, language="latex")
+        elif kind == "latex":
             try:
                 st.latex(chunk)
             except Exception:
                 st.markdown(f"``{chunk}``")
         else:
-            # Replace '$' with 'AUD' to avoid inline-math rendering issues
-            safe_chunk = chunk.replace("$", "AUD")
-            st.markdown(safe_chunk)
+            # '$' 已在解析时替换为 'AUD'，避免行内公式渲染问题
+            st.markdown(chunk)
+
+
+def render_turn(turn):
+    avatar = "👤" if turn.role == "user" else "🏦"
+    with st.chat_message(turn.role, avatar=avatar):
+        if turn.role == "assistant":
+            render_rich_text(turn.content)
+        else:
+            st.markdown(turn.content)
+        meta = f"{turn.ts_text} · {turn.meta}" if turn.meta else turn.ts_text
+        st.markdown(f"<div class='chat-ts'>{meta}</div>", unsafe_allow_html=True)
+
+
+def render_history(turns):
+    """最近 CHAT_RENDER_WINDOW 条消息直接渲染；更早的消息按页折叠，勾选后才渲染该页。
+
+    分页从最早的消息起算，新消息到来时已有页的范围不变，已展开的页保持展开。
+    """
+    older = max(0, len(turns) - CHAT_RENDER_WINDOW)
+    if older:
+        with st.expander(_t("history_older").format(n=older)):
+            for start in range(0, older, CHAT_RENDER_PAGE_SIZE):
+                end = min(start + CHAT_RENDER_PAGE_SIZE, older)
+                if st.toggle(_t("history_page").format(start=start + 1, end=end), key=f"history_page_{start}"):
+                    for turn in turns[start:end]:
+                        render_turn(turn)
+    for turn in turns[older:]:
+        render_turn(turn)
+
+
+def _session_broker():
+    """片段重跑时不经过 main()，各自从会话表持有当前会话的 broker。"""
+    return get_session_manager().lease(st.session_state.session_id)
+
+
+@st.fragment
+def sidebar_pane():
+    """侧边栏设置：开关只重跑本片段；语言切换、清除/撤销需要整页重跑。"""
+    with _session_broker() as broker:
+        _sidebar(broker)
+
+
+def _sidebar(broker):
+    st.title(_t("settings"))
+
+    # UI language selector
+    st.selectbox(
+        _t("ui_lang"),
+        options=["zh", "en"],
+        format_func=lambda v: _t("lang_zh") if v == "zh" else _t("lang_en"),
+        key="ui_lang",
+    )
+    if st.session_state.ui_lang != st.session_state.get("page_lang"):
+        # 界面语言影响整页文案
+        st.rerun(scope="app")
+
+    # 显示当前模型信息（只读）
+    current_model = getattr(broker.api_client, 'model', MODEL_NAME)
+    st.info(f"{_t('current_model')}：{current_model}")
+
+    # 对话选项（统一放置在侧边栏）
+    st.subheader(_t("conversation_options"))
+    st.session_state.use_web_search = st.toggle(
+        _t("toggle_search"),
+        value=st.session_state.use_web_search,
+        help=_t("toggle_search_help"),
+    )
+    st.session_state.reasoning_mode = st.toggle(
+        _t("toggle_reasoning"),
+        value=st.session_state.reasoning_mode,
+        help=_t("toggle_reasoning_help"),
+    )
+
+    # Status indicators
+    if st.session_state.use_web_search:
+        st.success(_t("mode_search_on"))
+    else:
+        st.info(_t("mode_search_off"))
+    st.caption(_t("reasoning_on") if st.session_state.reasoning_mode else _t("reasoning_off"))
+
+    # 健康检查按钮
+    if st.button(_t("test_conn")):
+        ok = broker.test_provider_connection()
+        if ok:
+            st.success("模型调用成功✔️" if st.session_state.ui_lang=="zh" else "API connection OK ✔️")
+        else:
+            st.error("连接或调用失败，请检查网络 / API Key" if st.session_state.ui_lang=="zh" else "Connection or call failed. Check network/API key.")
+
+    store = broker.store
+    # 生成进行中时禁止修改对话记录（后台线程正在写入）
+    busy = st.session_state.get("generation_job") is not None
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button(_t("clear_history"), disabled=busy):
+            broker.clear_history()
+            st.rerun(scope="app")
+    with col2:
+        if st.button(_t("undo"), disabled=busy):
+            if broker.undo_last():
+                st.rerun(scope="app")
+
+    # 导出对话：点击下载时才生成（包含本片段渲染之后新增的问答），重跑时不序列化
+    if len(store):
+        st.subheader(_t("export"))
+        fmt = st.selectbox(
+            _t("export_format"),
+            options=list(EXPORT_FORMATS),
+            format_func=lambda f: _t(f"export_{f}"),
+            key="export_format",
+        )
+        session_id = st.session_state.session_id
+        st.download_button(
+            label=_t("download"),
+            data=lambda: _export_bytes(session_id, fmt),
+            file_name=export_filename(fmt),
+            mime=EXPORT_FORMATS[fmt][1],
+        )
+        report = store.memory_report()
+        st.caption(_t("session_memory").format(turns=report["turns"], kb=report["approx_bytes"] / 1024))
+
+    st.markdown("---")
+    st.markdown(f"**{_t('about_title')}**")
+    st.markdown(_t("about_lines"))
+
+    with st.expander(_t("help")):
+        st.markdown(_t("help_text"))
+
+
+def _export_bytes(session_id: str, fmt: str) -> bytes:
+    with get_session_manager().lease(session_id) as broker:
+        turns = list(broker.store.turns)
+    return render_export(turns, fmt)
+
+
+@st.fragment
+def history_pane():
+    with _session_broker() as broker:
+        render_history(broker.store.turns[: st.session_state.get("history_upto", 0)])
+
+
+@st.fragment
+def input_pane():
+    """输入与回答：提问只重跑本片段（侧边栏与历史区不重建）。"""
+    with _session_broker() as broker:
+        _chat_input(broker)
+
+
+def _chat_input(broker):
+    for turn in broker.store.turns[st.session_state.get("history_upto", 0):]:
+        render_turn(turn)
+
+    # 上一次后台生成失败：提示一次（错误文本已作为仅展示的回答记录在历史中）
+    error = st.session_state.get("last_error")
+    if error:
+        st.session_state.last_error = None
+        st.error(_t("generation_error").format(error=error))
+
+    # 用户输入：提交到后台线程池生成，整页重跑一次以挂载进度片段
+    job = st.session_state.get("generation_job")
+    if prompt := st.chat_input(_t("chat_placeholder"), disabled=job is not None):
+        st.session_state.generation_job = submit_generation(
+            st.session_state.session_id,
+            prompt,
+            reasoning=st.session_state.reasoning_mode,
+            use_web_search=st.session_state.get("use_web_search", False),
+        )
+        st.rerun(scope="app")
+
+
+@st.fragment(run_every=GENERATION_POLL_SECONDS)
+def generation_pane():
+    """轮询后台生成任务：展示已生成的部分与停止按钮；完成后整页重跑，回答进入历史区。"""
+    job = st.session_state.get("generation_job")
+    if job is None:
+        return
+    if job.done:
+        st.session_state.generation_job = None
+        if job.error:
+            st.session_state.last_error = job.error
+        st.rerun(scope="app")
+
+    with st.chat_message("user", avatar="👤"):
+        st.markdown(job.prompt)
+        st.markdown(f"<div class='chat-ts'>{datetime.fromtimestamp(job.started).strftime('%Y-%m-%d %H:%M:%S')}</div>", unsafe_allow_html=True)
+    with st.chat_message("assistant", avatar="🏦"):
+        # 已完成的分段只解析一次、每次轮询输出相同元素（前端复用），只有尾部变化
+        rich = job.rich_text()
+        segments = rich.segments + list(rich.tail())
+        if segments:
+            if segments[-1][0] == "md":
+                segments[-1] = ("md", segments[-1][1] + "▌")
+            render_segments(segments)
+        else:
+            search_indicator = "🌐 " if job.use_web_search else ""
+            st.caption(f"{search_indicator}{_t('thinking')}")
+        if st.button(_t("stop"), key="stop_generation", disabled=job.token.cancelled):
+            job.cancel()
 
 
 def main():
@@ -209,7 +510,14 @@ def main():
     # 初始化会话状态
     initialize_session_state()
 
-    provider = getattr(getattr(st.session_state, "broker", None), "api_client", None)
+    # 本次运行期间持有会话的 broker（不会被换出）；运行结束后按空闲/上限策略换出其他会话
+    with get_session_manager().lease(st.session_state.session_id) as broker:
+        render_page(broker)
+
+
+def render_page(broker):
+    st.session_state.page_lang = st.session_state.ui_lang
+    provider = getattr(broker, "api_client", None)
     provider_name = getattr(provider, "provider", "openai") if provider else "openai"
     if provider_name == "azure":
         # 强制关闭 Azure 当前不支持的功能
@@ -291,76 +599,7 @@ def main():
     # 侧边栏配置（OpenAI 模式可用）
     if provider_name != "azure":
         with st.sidebar:
-            st.title(_t("settings"))
-
-            # UI language selector
-            st.selectbox(
-                _t("ui_lang"),
-                options=["zh", "en"],
-                format_func=lambda v: _t("lang_zh") if v == "zh" else _t("lang_en"),
-                key="ui_lang",
-            )
-
-            # 显示当前模型信息（只读）
-            current_model = getattr(st.session_state.broker.api_client, 'model', MODEL_NAME)
-            st.info(f"{_t('current_model')}：{current_model}")
-
-            # 对话选项（统一放置在侧边栏）
-            st.subheader(_t("conversation_options"))
-            st.session_state.use_web_search = st.toggle(
-                _t("toggle_search"),
-                value=st.session_state.use_web_search,
-                help=_t("toggle_search_help"),
-            )
-            st.session_state.reasoning_mode = st.toggle(
-                _t("toggle_reasoning"),
-                value=st.session_state.reasoning_mode,
-                help=_t("toggle_reasoning_help"),
-            )
-
-            # Status indicators
-            if st.session_state.use_web_search:
-                st.success(_t("mode_search_on"))
-            else:
-                st.info(_t("mode_search_off"))
-            st.caption(_t("reasoning_on") if st.session_state.reasoning_mode else _t("reasoning_off"))
-
-            # 健康检查按钮
-            if st.button(_t("test_conn")):
-                ok = st.session_state.broker.test_provider_connection()
-                if ok:
-                    st.success("模型调用成功✔️" if st.session_state.ui_lang=="zh" else "API connection OK ✔️")
-                else:
-                    st.error("连接或调用失败，请检查网络 / API Key" if st.session_state.ui_lang=="zh" else "Connection or call failed. Check network/API key.")
-
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button(_t("clear_history")):
-                    st.session_state.messages = []
-                    st.rerun()
-            with col2:
-                if st.button(_t("undo")):
-                    if len(st.session_state.messages) >= 2:
-                        st.session_state.messages = st.session_state.messages[:-2]
-                        st.rerun()
-
-            # 导出对话
-            if st.session_state.messages:
-                st.subheader(_t("export"))
-                export_json = json.dumps(st.session_state.messages, ensure_ascii=False, indent=2)
-                st.download_button(
-                    label=_t("download_json"),
-                    data=export_json.encode("utf-8"),
-                    file_name=f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
-
-            st.markdown("---")
-            st.markdown(f"**{_t('about_title')}**")
-            st.markdown(_t("about_lines"))
-
-            with st.expander(_t("help")):
-                st.markdown(_t("help_text"))
+            sidebar_pane()
     else:
         st.session_state.ui_lang = st.session_state.get("ui_lang", "zh")
         st.info("当前使用 Azure OpenAI 部署，已为你启用精简界面。" if st.session_state.ui_lang == "zh" else "Running with Azure OpenAI deployment; sidebar controls are hidden.")
@@ -378,57 +617,16 @@ def main():
         unsafe_allow_html=True,
     )
 
-    # 聊天区域下方的快捷设置（紧邻输入框）
-
-    # 显示对话历史
-    for message in st.session_state.messages:
-        role = message.get("role", "assistant")
-        ts = message.get("ts")
-        avatar = "👤" if role == "user" else "🏦"
-        with st.chat_message(role, avatar=avatar):
-            if role == "assistant":
-                render_rich_text(message["content"])
-            else:
-                st.markdown(message["content"])
-            if ts:
-                st.markdown(f"<div class='chat-ts'>{ts}</div>", unsafe_allow_html=True)
-    
-    # 对话框下方设置（已迁移至侧边栏，这里移除）
-
-    # 用户输入
-    if prompt := st.chat_input(_t("chat_placeholder")):
-        # 添加用户消息
-        now_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        st.session_state.messages.append({"role": "user", "content": prompt, "ts": now_ts})
-        with st.chat_message("user", avatar="👤"):
-            st.markdown(prompt)
-            st.markdown(f"<div class='chat-ts'>{now_ts}</div>", unsafe_allow_html=True)
-        
-        # 生成AI回复
-        with st.chat_message("assistant", avatar="🏦"):
-            search_indicator = "🌐 " if st.session_state.get("use_web_search", False) else ""
-            thinking_text = (
-                f"{search_indicator}正在思考 ..." if st.session_state.ui_lang=="zh" else f"{search_indicator}Thinking ..."
-            )
-            with st.spinner(thinking_text):
-                try:
-                    # 统一由模型侧处理（Responses API 工具启用/禁用）
-                    response = st.session_state.broker.generate_response(
-                        prompt,
-                        reasoning=st.session_state.reasoning_mode,
-                        use_web_search=st.session_state.get("use_web_search", False),
-                    )
-                    now_ts2 = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    render_rich_text(response)
-                    st.markdown(f"<div class='chat-ts'>{now_ts2}</div>", unsafe_allow_html=True)
-                    st.session_state.messages.append({"role": "assistant", "content": response, "ts": now_ts2})
-                except Exception as e:
-                    error_msg = (
-                        f"抱歉，生成回复时出现错误 / Error: {str(e)}" if st.session_state.ui_lang=="zh" else f"Error generating reply: {str(e)}"
-                    )
-                    st.session_state.last_error = str(e)
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg, "ts": datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+    # 情景对比（本地 NumPy 计算，不调用模型）
+    render_scenario_panel()
+
+    # 历史区与输入区各自独立重跑：历史区渲染到本次整页运行时的消息数，
+    # 之后新增的问答由输入区渲染，两者互不重复
+    st.session_state.history_upto = len(broker.store)
+    history_pane()
+    if st.session_state.get("generation_job") is not None:
+        generation_pane()
+    input_pane()
 
 
 if __name__ == "__main__":
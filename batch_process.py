@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+批量处理 JSONL 问题（夜间跑批）
+
+输入每行一个 JSON 对象：问题取 question / body / content / text 字段，编号取
+request_id / id / custom_id 字段（缺省为行号）。结果逐条追加写入输出 JSONL，
+输出文件同时充当断点：--resume 时跳过已成功的编号，失败的会重新处理。
+
+同步模式：有界线程池并发调用 AustralianMortgageBroker（共享客户端与限流器），
+可用 --rpm 额外限定每分钟请求数：
+    python batch_process.py questions.jsonl -o answers.jsonl --workers 8 --rpm 300
+    python batch_process.py questions.jsonl -o answers.jsonl --resume
+
+OpenAI Batch API 模式（异步、价格更低，24 小时内完成）：纯计算问题仍在本地作答，
+其余问题写成 Batch 请求文件并提交；之后用 --collect 轮询并收取结果。输出中已成功
+的编号总是跳过；尚未收取的 Batch 不会被新的提交覆盖（除非加 --force）：
+    python batch_process.py questions.jsonl -o answers.jsonl --openai-batch
+    python batch_process.py questions.jsonl -o answers.jsonl --collect --wait
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+ERROR_PREFIX = "生成回复时出现错误"
+
+
+def read_questions(path: str) -> Iterator[Tuple[str, str]]:
+    """逐行读取 (编号, 问题)；空行与无问题文本的行跳过。"""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"⚠️ 第 {lineno} 行不是合法 JSON，已跳过")
+                continue
+            text = next((item.get(k) for k in ("question", "body", "content", "text") if item.get(k)), None)
+            text = text or item.get("title")
+            if not text:
+                continue
+            qid = str(next((item[k] for k in ("request_id", "id", "custom_id") if item.get(k)), lineno))
+            yield qid, str(text)
+
+
+def load_done(output_path: str) -> Set[str]:
+    """输出文件中已成功的编号（断点续跑）。"""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # 上次中断时可能留下半行
+            if row.get("status") == "ok":
+                done.add(str(row.get("id")))
+    return done
+
+
+class ResultWriter:
+    """线程安全的 JSONL 追加写入，每条立即落盘。"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.ok = 0
+        self.failed = 0
+
+    def write(self, row: Dict[str, Any]) -> None:
+        line = json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if row.get("status") == "ok":
+                self.ok += 1
+            else:
+                self.failed += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _row(qid: str, question: str, answer: Optional[str], status: str, error: Optional[str] = None, **extra) -> Dict[str, Any]:
+    row = {
+        "id": qid,
+        "question": question,
+        "answer": answer,
+        "status": status,
+        "error": error,
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    row.update(extra)
+    return row
+
+
+def answer_one(qid: str, question: str, reasoning: bool, use_web_search: bool, client=None) -> Dict[str, Any]:
+    """独立问题：每题一个 broker（无共享对话历史），客户端与连接池进程级共享。"""
+    from utils.broker_logic import AustralianMortgageBroker
+
+    broker = AustralianMortgageBroker(api_client=client)
+    start = time.perf_counter()
+    answer = broker.generate_response(question, reasoning=reasoning, use_web_search=use_web_search)
+    elapsed = (time.perf_counter() - start) * 1000
+    metrics = broker.last_metrics
+    route = broker.last_route.route if broker.last_route is not None else None
+    extra = {
+        "route": route,
+        "latency_ms": round(elapsed, 1),
+        "input_tokens": metrics.input_tokens if metrics else 0,
+        "output_tokens": metrics.output_tokens if metrics else 0,
+    }
+    if answer.startswith(ERROR_PREFIX):
+        return _row(qid, question, None, "error", answer, **extra)
+    return _row(qid, question, answer, "ok", **extra)
+
+
+def run_sync(args: argparse.Namespace, client=None) -> None:
+    from utils.rate_limit import TokenBucketLimiter
+
+    done = load_done(args.output) if args.resume else set()
+    limiter = None
+    if args.rpm:
+        limiter = TokenBucketLimiter(burst=args.workers)
+        limiter.rate = args.rpm / 60.0
+    writer = ResultWriter(args.output)
+    skipped = 0
+    start = time.perf_counter()
+
+    def _task(qid: str, question: str) -> Dict[str, Any]:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return answer_one(qid, question, args.reasoning, args.web_search, client)
+        except Exception as exc:  # 单题失败不影响整批
+            return _row(qid, question, None, "error", str(exc))
+
+    # 有界提交：最多 2×workers 个任务在途，输入文件不必整体读入内存
+    pending: Set[Future] = set()
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch") as pool:
+        for qid, question in read_questions(args.input):
+            if qid in done:
+                skipped += 1
+                continue
+            if len(pending) >= args.workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    writer.write(fut.result())
+            pending.add(pool.submit(_task, qid, question))
+        for fut in pending:
+            writer.write(fut.result())
+    writer.close()
+    wall = time.perf_counter() - start
+    total = writer.ok + writer.failed
+    print(
+        f"✅ 完成 {total} 题（成功 {writer.ok}，失败 {writer.failed}，跳过 {skipped}），"
+        f"耗时 {wall:.1f}s，{total / wall if wall else 0:.2f} 题/秒 → {args.output}"
+    )
+
+
+# ---------------------------------------------------------------------------
+# OpenAI Batch API
+# ---------------------------------------------------------------------------
+
+def _state_path(output_path: str) -> str:
+    return output_path + ".batch.json"
+
+
+def _batch_client(client=None):
+    from utils.unified_client import get_shared_client
+
+    client = client or get_shared_client()
+    # 配置了故障转移时取其中的 OpenAI 后端（Batch API 仅 OpenAI 提供）
+    for backend in getattr(client, "backends", None) or []:
+        if backend.provider == "openai":
+            client = backend
+            break
+    if getattr(client, "provider", None) != "openai" or client.session is None:
+        raise SystemExit("❌ Batch 模式仅支持 MODEL_PROVIDER=openai")
+    return client
+
+
+def submit_batch(args: argparse.Namespace, client=None) -> None:
+    """本地可答的问题直接写结果，其余问题写成 Batch 请求文件并提交。"""
+    from utils.broker_logic import AustralianMortgageBroker
+    from utils.intent_router import route_query
+    from config import INTENT_ROUTER_ENABLED
+
+    client = _batch_client(client)
+    state_path = _state_path(args.output)
+    if os.path.exists(state_path) and not getattr(args, "force", False):
+        with open(state_path, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+        raise SystemExit(
+            f"❌ Batch {pending.get('batch_id')} 尚未收取（{state_path}）；"
+            "请先运行 --collect，或加 --force 放弃跟踪并重新提交"
+        )
+    # Batch 的结果要等收取时才写出：无论是否 --resume，已成功的编号都不再提交，避免重复行
+    done = load_done(args.output)
+    endpoint = client.request_endpoint
+    writer = ResultWriter(args.output)
+    requests_path = args.output + ".batch_input.jsonl"
+    questions: Dict[str, str] = {}
+    with open(requests_path, "w", encoding="utf-8") as f:
+        for qid, question in read_questions(args.input):
+            if qid in done:
+                continue
+            broker = AustralianMortgageBroker(api_client=client)
+            decision = route_query(question, args.web_search) if INTENT_ROUTER_ENABLED else None
+            if decision is not None and decision.route == "calc":
+                answer = broker.answer_locally(question, decision)
+                if answer is not None:
+                    writer.write(_row(qid, question, answer, "ok", route="calc"))
+                    continue
+                decision.route = "model"
+            use_search = args.web_search if decision is None else decision.route == "model_search"
+            messages = broker.build_request_messages(question, args.reasoning, decision)
+            # Batch 请求无法在中途执行本地函数工具，请求体不附带计算器工具
+            body = client.build_request_body(messages, 1500, use_search)
+            f.write(json.dumps({"custom_id": qid, "method": "POST", "url": endpoint, "body": body}, ensure_ascii=False) + "\n")
+            questions[qid] = question
+    writer.close()
+    if not questions:
+        print(f"✅ 没有需要提交的问题（本地作答 {writer.ok} 题）")
+        return
+
+    with open(requests_path, "rb") as f:
+        resp = client.session.post(
+            f"{client.base_url}/files",
+            headers=client.auth_headers(json_body=False),
+            files={"file": (os.path.basename(requests_path), f, "application/jsonl")},
+            data={"purpose": "batch"},
+            timeout=120,
+        )
+    resp.raise_for_status()
+    file_id = resp.json()["id"]
+    resp = client.session.post(
+        f"{client.base_url}/batches",
+        headers=client.auth_headers(),
+        json={"input_file_id": file_id, "endpoint": endpoint, "completion_window": "24h"},
+        timeout=60,
+    )
+    resp.raise_for_status()
+    batch = resp.json()
+    state = {"batch_id": batch["id"], "input_file_id": file_id, "endpoint": endpoint, "questions": questions}
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    print(f"📤 已提交 Batch {batch['id']}（{len(questions)} 题，本地作答 {writer.ok} 题）；稍后运行 --collect 收取结果")
+
+
+def collect_batch(args: argparse.Namespace, client=None) -> None:
+    """查询 Batch 状态；完成后下载结果并追加到输出 JSONL。"""
+    client = _batch_client(client)
+    path = _state_path(args.output)
+    if not os.path.exists(path):
+        raise SystemExit(f"❌ 未找到 Batch 状态文件：{path}")
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+
+    while True:
+        resp = client.session.get(f"{client.base_url}/batches/{state['batch_id']}", headers=client.auth_headers(), timeout=60)
+        resp.raise_for_status()
+        batch = resp.json()
+        status = batch.get("status")
+        if status in ("completed", "failed", "expired", "cancelled") or not args.wait:
+            break
+        print(f"⏳ Batch {state['batch_id']} 状态 {status}，{args.poll_seconds}s 后重试")
+        time.sleep(args.poll_seconds)
+    if status != "completed":
+        print(f"ℹ️ Batch {state['batch_id']} 状态：{status}")
+        if status not in ("failed", "expired", "cancelled"):
+            return
+
+    questions: Dict[str, str] = state.get("questions", {})
+    # 输出中已成功的编号（如 --force 重新提交前已收取过）不再重复写出
+    done = load_done(args.output)
+    writer = ResultWriter(args.output)
+    seen: Set[str] = set()
+    for file_key in ("output_file_id", "error_file_id"):
+        file_id = batch.get(file_key)
+        if not file_id:
+            continue
+        resp = client.session.get(f"{client.base_url}/files/{file_id}/content", headers=client.auth_headers(json_body=False), timeout=300)
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            qid = str(item.get("custom_id"))
+            seen.add(qid)
+            if qid in done:
+                continue
+            body = (item.get("response") or {}).get("body") or {}
+            error = item.get("error") or body.get("error")
+            text = None
+            if not error:
+                text = client.extract_text(body)
+            usage = body.get("usage") or {}
+            extra = {
+                "route": "batch",
+                "input_tokens": usage.get("input_tokens") or usage.get("prompt_tokens") or 0,
+                "output_tokens": usage.get("output_tokens") or usage.get("completion_tokens") or 0,
+            }
+            if text:
+                writer.write(_row(qid, questions.get(qid, ""), text.strip(), "ok", **extra))
+            else:
+                writer.write(_row(qid, questions.get(qid, ""), None, "error", json.dumps(error or body, ensure_ascii=False), **extra))
+    for qid in set(questions) - seen - done:
+        writer.write(_row(qid, questions[qid], None, "error", f"batch {status}: no result", route="batch"))
+    writer.close()
+    os.replace(path, path + ".done")
+    print(f"📥 Batch {state['batch_id']} 已收取：成功 {writer.ok}，失败 {writer.failed} → {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量处理 JSONL 房贷问题")
+    parser.add_argument("input", help="输入 JSONL（每行一个问题对象）")
+    parser.add_argument("-o", "--output", required=True, help="输出 JSONL（逐条追加，兼作断点）")
+    parser.add_argument("--workers", type=int, default=4, help="并发线程数")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟最多请求数（0 表示只依赖服务端限流头）")
+    parser.add_argument("--resume", action="store_true", help="跳过输出文件中已成功的编号")
+    parser.add_argument("--reasoning", action="store_true", help="推理模式")
+    parser.add_argument("--web-search", action="store_true", help="允许联网搜索（仍受意图路由约束）")
+    parser.add_argument("--openai-batch", action="store_true", help="通过 OpenAI Batch API 异步提交")
+    parser.add_argument("--collect", action="store_true", help="收取已提交 Batch 的结果")
+    parser.add_argument("--force", action="store_true", help="--openai-batch 时覆盖尚未收取的 Batch 状态文件")
+    parser.add_argument("--wait", action="store_true", help="--collect 时轮询直至 Batch 结束")
+    parser.add_argument("--poll-seconds", type=int, default=60)
+    args = parser.parse_args()
+
+    if args.collect:
+        collect_batch(args)
+    elif args.openai_batch:
+        submit_batch(args)
+    else:
+        run_sync(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,9 @@ load_dotenv()
 
 # OpenAI配置（主要提供商）
 OPENAI_API_KEY_VAR = "OPENAI_API_KEY"
-OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+# 可指向兼容服务（如本地 mock_openai_server.py）进行离线压测
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENAI_CHAT_URL = f"{OPENAI_BASE_URL}/chat/completions"
 
 # Azure OpenAI 配置
 AZURE_OPENAI_API_KEY_VAR = "AZURE_OPENAI_API_KEY"
@@ -25,6 +27,81 @@ AZURE_OPENAI_DEPLOYMENT_VAR = "AZURE_OPENAI_DEPLOYMENT"
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-5-mini")
 MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")
 
+# 多提供商故障转移：逗号分隔的后端列表（如 "openai,azure"），首个为主；为空则只用 MODEL_PROVIDER
+FAILOVER_PROVIDERS = [p.strip().lower() for p in os.getenv("FAILOVER_PROVIDERS", "").split(",") if p.strip()]
+# 连续失败次数 / p95 延迟（毫秒）超过阈值即降级，冷却时间（秒）后恢复
+FAILOVER_ERROR_THRESHOLD = int(os.getenv("FAILOVER_ERROR_THRESHOLD", "2"))
+FAILOVER_LATENCY_MS = float(os.getenv("FAILOVER_LATENCY_MS", "30000"))
+FAILOVER_COOLDOWN = float(os.getenv("FAILOVER_COOLDOWN", "60"))
+# 对冲请求：首选后端超过 max(p95, 最小延迟) 未返回时向下一个后端并发请求
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "3000"))
+
+# HTTP 连接池（进程内所有会话共享同一客户端与连接池）
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "64"))
+
+# 重试退避（指数退避 + full jitter，单位：秒）与进程级限流突发容量
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+
+# 上游提示缓存路由键（同一部署的请求共享前缀缓存）；留空则不发送
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY") or None
+
+# 本地房贷计算器作为函数工具提供给模型；单次回答内最多的工具往返轮数
+MORTGAGE_TOOLS_ENABLED = os.getenv("MORTGAGE_TOOLS_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+
+# 本地意图路由：纯计算本地作答、术语问答走共享缓存、非时效问题跳过联网搜索
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+ROUTER_SEARCH_THRESHOLD = float(os.getenv("ROUTER_SEARCH_THRESHOLD", "0.5"))
+
+# 对话上下文的输入 token 预算（系统提示 + 历史 + 本轮输入）；边界消息剩余空间不足该值时直接丢弃。
+# tiktoken 不可用时按保守估算计数，预算为近似值
+CONTEXT_INPUT_TOKEN_BUDGET = int(os.getenv("CONTEXT_INPUT_TOKEN_BUDGET", "6000"))
+CONTEXT_MIN_TRIM_TOKENS = int(os.getenv("CONTEXT_MIN_TRIM_TOKENS", "64"))
+
+# 滚动摘要：超出历史窗口的旧轮次在后台增量折叠为一条摘要消息
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_MAX_PENDING = int(os.getenv("SUMMARY_MAX_PENDING", "40"))
+
+# 会话换出：活跃会话数 / 对话记录估算内存（MB）超限或空闲超时后，会话写入 SQLite 并移出内存，
+# 下次访问时恢复；超过保留天数未访问的会话从磁盘删除
+SESSION_MAX_LIVE = int(os.getenv("SESSION_MAX_LIVE", "200"))
+SESSION_MAX_BYTES = int(float(os.getenv("SESSION_MAX_MB", "64")) * 1024 * 1024)
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "900"))
+SESSION_RETENTION_DAYS = float(os.getenv("SESSION_RETENTION_DAYS", "7"))
+# 后台空闲清扫间隔（秒，0 表示只在会话释放时检查）
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", "60"))
+
+# 回答富文本（Markdown/LaTeX）解析结果的进程级缓存条数
+RICH_TEXT_CACHE_SIZE = int(os.getenv("RICH_TEXT_CACHE_SIZE", "4096"))
+
+# 后台生成：共享工作线程数与界面轮询间隔（秒）
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "16"))
+GENERATION_POLL_SECONDS = float(os.getenv("GENERATION_POLL_SECONDS", "0.3"))
+
+# 聊天记录窗口化渲染：完整渲染最近的消息条数；更早的消息按页折叠、展开时才渲染
+CHAT_RENDER_WINDOW = int(os.getenv("CHAT_RENDER_WINDOW", "20"))
+CHAT_RENDER_PAGE_SIZE = max(1, int(os.getenv("CHAT_RENDER_PAGE_SIZE", "20")))
+
+# 请求级指标：JSONL 落盘路径与 Prometheus /metrics 端口（留空则不启用）
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH") or None
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+
+# 本地缓存目录（模型探测结果等）
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+# 精确匹配回答缓存（内存 LRU + SQLite）；联网搜索回答时效性强，TTL 更短
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_SEARCH_TTL = int(os.getenv("RESPONSE_CACHE_SEARCH_TTL", "900"))
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "512"))
+
+# 模型能力探测结果的有效期（秒），过期后在后台线程刷新
+MODEL_PROBE_TTL = int(os.getenv("MODEL_PROBE_TTL", str(6 * 3600)))
+
 # =============================================================================
 # 可选功能配置
 # =============================================================================
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+并发压测：以 N 个会话驱动 AustralianMortgageBroker.generate_response
+
+每个会话拥有独立的 broker（共享进程级客户端），报告吞吐量、延迟
+p50/p95/p99、流式首字延迟以及错误数。默认在进程内启动本地模拟服务，
+无需 API Key：
+    python load_test.py --sessions 50 --turns 4 --stream
+    python load_test.py --base-url http://127.0.0.1:8765/v1 --sessions 200
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+QUESTIONS = [
+    "固定利率房贷有什么特点？",
+    "首次购房者在新州可以申请哪些补助？",
+    "房价 AUD 800,000，首付 20%，利率 6.2%，30 年的月供是多少？",
+    "What is LVR and why does it matter?",
+    "浮动利率和固定利率如何选择？",
+    "Interest-only loans: pros and cons for investors?",
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_session(session_id: int, turns: int, stream: bool, unique: bool) -> List[Dict[str, Any]]:
+    from utils.broker_logic import AustralianMortgageBroker
+
+    broker = AustralianMortgageBroker()
+    results = []
+    for turn in range(turns):
+        question = QUESTIONS[(session_id + turn) % len(QUESTIONS)]
+        if unique:
+            # 避免回答缓存与 single-flight 合并，测量真实上游吞吐
+            question = f"{question} [s{session_id}-t{turn}]"
+        start = time.perf_counter()
+        first_token = None
+        if stream:
+            chunks = []
+            for delta in broker.generate_response(question, stream=True):
+                if first_token is None:
+                    first_token = (time.perf_counter() - start) * 1000
+                chunks.append(delta)
+            answer = "".join(chunks)
+        else:
+            answer = broker.generate_response(question)
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics = broker.last_metrics
+        ok = metrics is not None and metrics.status == "ok" and not answer.startswith("生成回复时出现错误")
+        results.append(
+            {
+                "latency_ms": elapsed,
+                "first_token_ms": first_token,
+                "ok": ok,
+                "cache_hit": bool(metrics and metrics.cache_hit),
+                "retries": metrics.retries if metrics else 0,
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AustralianMortgageBroker 并发压测")
+    parser.add_argument("--sessions", type=int, default=20, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的提问轮数")
+    parser.add_argument("--stream", action="store_true", help="使用流式接口并统计首字延迟")
+    parser.add_argument("--unique", action="store_true", help="每个问题加唯一后缀，绕过缓存与合并")
+    parser.add_argument("--base-url", default=None, help="OpenAI 兼容服务地址；缺省时在进程内启动模拟服务")
+    parser.add_argument("--mock-latency-ms", type=float, default=300.0)
+    parser.add_argument("--mock-rpm", type=int, default=0)
+    parser.add_argument("--mock-429-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        from mock_openai_server import MockOptions, start_mock_server
+
+        _, base_url, _ = start_mock_server(
+            options=MockOptions(
+                latency_ms=args.mock_latency_ms,
+                rpm=args.mock_rpm,
+                error_rate_429=args.mock_429_rate,
+            )
+        )
+        print(f"🧪 已启动进程内模拟服务: {base_url}")
+    # 需在导入客户端模块之前设置
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("MODEL_PROVIDER", "openai")
+
+    from utils.metrics import METRICS
+
+    print(f"⏱️ 压测开始：{args.sessions} 会话 × {args.turns} 轮，stream={args.stream}")
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [
+            pool.submit(run_session, i, args.turns, args.stream, args.unique)
+            for i in range(args.sessions)
+        ]
+        for fut in futures:
+            session_results = fut.result()
+            with lock:
+                results.extend(session_results)
+    wall = time.perf_counter() - start
+
+    latencies = [r["latency_ms"] for r in results if r["ok"]]
+    ttft = [r["first_token_ms"] for r in results if r["ok"] and r["first_token_ms"] is not None]
+    errors = sum(1 for r in results if not r["ok"])
+    print("\n" + "=" * 50)
+    print(f"📦 请求总数: {len(results)}（失败 {errors}，缓存命中 {sum(r['cache_hit'] for r in results)}）")
+    print(f"⚡ 吞吐量: {len(results) / wall:.1f} req/s（总耗时 {wall:.2f}s）")
+    print(
+        f"📈 延迟 p50/p95/p99: {_percentile(latencies, 0.5):.0f} / "
+        f"{_percentile(latencies, 0.95):.0f} / {_percentile(latencies, 0.99):.0f} ms"
+    )
+    if ttft:
+        print(
+            f"🚀 首字延迟 p50/p95/p99: {_percentile(ttft, 0.5):.0f} / "
+            f"{_percentile(ttft, 0.95):.0f} / {_percentile(ttft, 0.99):.0f} ms"
+        )
+    print(f"🔁 重试次数: {sum(r['retries'] for r in results)}")
+    print("\n📊 按功能标签汇总（客户端侧）:")
+    for row in METRICS.summary():
+        print(f"   {row}")
+    print("\n🧭 按路由的端到端延迟:")
+    for row in METRICS.summary("broker_route_latency_ms"):
+        print(f"   {row}")
+    print(f"\n🧊 上游提示缓存: {METRICS.prompt_cache_report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容模拟服务（离线压测用）
+
+支持 UnifiedAIClient 解析的接口形状：
+- GET  /v1/models、/v1/models/{id}
+- POST /v1/responses（含 stream=True 的 SSE 事件）
+- POST /v1/chat/completions（含 stream=True 与 stream_options.include_usage）
+- Batch API：POST /v1/files（multipart 上传）、POST /v1/batches（提交即完成）、
+  GET /v1/batches/{id}、GET /v1/files/{id}/content
+- 函数工具：提供 mortgage_calculator 且问题涉及月供时，先返回一次工具调用，
+  收到工具结果后在回答中引用计算结果
+
+可配置延迟、首字延迟、流式分块间隔、429 注入（随机或前 N 个请求）以及按 RPM
+配额返回的 x-ratelimit-* 响应头。用法：
+    python mock_openai_server.py --port 8765 --latency-ms 300 --rpm 600
+    # 故障转移演练：前 1000 个请求全部返回 429
+    python mock_openai_server.py --port 8766 --fail-first 1000
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+DEFAULT_ANSWER = (
+    "结论：\n"
+    "- 固定利率房贷在锁定期内月供不变，便于预算；\n"
+    "- 提前还款或转贷可能产生 break cost，需要向贷方确认；\n"
+    "- 锁定期结束后通常转为浮动利率，建议提前比较再融资方案。\n"
+    "参考示例：贷款额 AUD 520,000，年利率 6.2%，30 年，月供约 AUD 3,185。"
+)
+# 触发工具调用的关键词与固定参数
+CALC_KEYWORDS = ("月供", "repayment")
+CALC_ARGUMENTS = {"property_price": 800000, "deposit_percent": 20, "annual_rate_percent": 6.2, "term_years": 30}
+
+
+class MockOptions:
+    """模拟服务的行为参数。"""
+
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        ttft_ms: float = 150.0,
+        chunk_delay_ms: float = 15.0,
+        chunk_chars: int = 8,
+        error_rate_429: float = 0.0,
+        rpm: int = 0,
+        fail_first: int = 0,
+        answer: str = DEFAULT_ANSWER,
+        models: Tuple[str, ...] = ("gpt-5-mini", "gpt-4o-mini"),
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.ttft_ms = ttft_ms
+        self.chunk_delay_ms = chunk_delay_ms
+        self.chunk_chars = max(1, chunk_chars)
+        self.error_rate_429 = error_rate_429
+        self.rpm = rpm
+        # 前 N 个 POST 固定返回 429（便于确定性地测试重试）
+        self.fail_first = fail_first
+        self.answer = answer
+        self.models = models
+
+
+class _Quota:
+    """60 秒滑动窗口的请求配额，用于生成 x-ratelimit-* 头与真实 429。"""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.window: Deque[float] = deque()
+        self.lock = threading.Lock()
+
+    def take(self) -> Tuple[bool, Dict[str, str]]:
+        if not self.rpm:
+            return True, {}
+        with self.lock:
+            now = time.time()
+            while self.window and now - self.window[0] >= 60:
+                self.window.popleft()
+            allowed = len(self.window) < self.rpm
+            if allowed:
+                self.window.append(now)
+            remaining = max(0, self.rpm - len(self.window))
+            reset = (60 - (now - self.window[0])) if self.window else 0.0
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers["retry-after"] = f"{max(reset, 0.05):.3f}"
+        return allowed, headers
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected_429 = 0
+        # 收到的 prompt_cache_key（验证客户端是否携带路由键）
+        self.prompt_cache_keys = set()
+        # Batch API：已上传文件内容与批次对象
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, rejected: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            if rejected:
+                self.rejected_429 += 1
+
+
+def _usage(input_text: str, output_text: str, chat: bool) -> Dict[str, Any]:
+    # 粗略估算：约 4 个字符一个 token
+    prompt = max(1, len(input_text) // 4)
+    completion = max(1, len(output_text) // 4)
+    cached = (prompt // 1024) * 1024
+    if chat:
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": cached},
+            "completion_tokens_details": {"reasoning_tokens": 0},
+        }
+    return {
+        "input_tokens": prompt,
+        "output_tokens": completion,
+        "total_tokens": prompt + completion,
+        "input_tokens_details": {"cached_tokens": cached},
+        "output_tokens_details": {"reasoning_tokens": 0},
+    }
+
+
+def _blocking_body(model: str, answer: str, usage: Dict[str, Any], chat: bool) -> Dict[str, Any]:
+    if chat:
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+    return {
+        "id": "resp-mock",
+        "object": "response",
+        "model": model,
+        "output": [
+            {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": answer}],
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def _multipart_file(content_type: str, raw: bytes) -> Optional[bytes]:
+    """取出 multipart/form-data 中名为 file 的部分。"""
+    msg = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + raw)
+    for part in msg.get_payload() if msg.is_multipart() else []:
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True)
+    return None
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # 默认 backlog 只有 5，高并发建连会触发 SYN 重传（约 1 秒尾延迟）
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _tool_offered(payload: Dict[str, Any]) -> bool:
+    for tool in payload.get("tools") or []:
+        name = tool.get("name") or (tool.get("function") or {}).get("name")
+        if name == "mortgage_calculator":
+            return True
+    return False
+
+
+def _tool_output(messages: List[Any]) -> Optional[Dict[str, Any]]:
+    """返回已回传的工具结果（Responses 的 function_call_output 或 Chat 的 tool 消息）。"""
+    for m in messages:
+        if not isinstance(m, dict):
+            continue
+        raw = m.get("output") if m.get("type") == "function_call_output" else m.get("content") if m.get("role") == "tool" else None
+        if raw is not None:
+            try:
+                return json.loads(raw)
+            except ValueError:
+                return {}
+    return None
+
+
+def _make_handler(opts: MockOptions, quota: _Quota, stats: MockStats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _sleep(self, ms: float) -> None:
+            if ms > 0:
+                time.sleep(ms / 1000.0)
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/v1/models":
+                self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in opts.models]})
+            elif path.startswith("/v1/batches/"):
+                batch = stats.batches.get(path.rsplit("/", 1)[-1])
+                if batch is None:
+                    self._send_json(404, {"error": {"message": "batch not found"}})
+                else:
+                    self._send_json(200, batch)
+            elif path.startswith("/v1/files/") and path.endswith("/content"):
+                raw = stats.files.get(path.split("/")[-2])
+                if raw is None:
+                    self._send_json(404, {"error": {"message": "file not found"}})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+            elif path.startswith("/v1/models/"):
+                model = path.rsplit("/", 1)[-1]
+                if model in opts.models:
+                    self._send_json(200, {"id": model, "object": "model"})
+                else:
+                    self._send_json(404, {"error": {"message": f"model {model} not found"}})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length)
+            if self.path.rstrip("/") == "/v1/files":
+                self._upload(raw)
+                return
+            try:
+                payload = json.loads(raw or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": {"message": "invalid json"}})
+                return
+
+            allowed, rl_headers = quota.take()
+            injected = random.random() < opts.error_rate_429 or stats.requests < opts.fail_first
+            if not allowed or injected:
+                stats.add(rejected=True)
+                headers = dict(rl_headers)
+                headers.setdefault("retry-after", "0.2")
+                self._send_json(429, {"error": {"message": "Rate limit reached (mock)"}}, headers)
+                return
+            stats.add(rejected=False)
+            if payload.get("prompt_cache_key"):
+                with stats.lock:
+                    stats.prompt_cache_keys.add(payload["prompt_cache_key"])
+
+            path = self.path.rstrip("/")
+            if path == "/v1/responses":
+                self._handle(payload, rl_headers, chat=False)
+            elif path == "/v1/chat/completions":
+                self._handle(payload, rl_headers, chat=True)
+            elif path == "/v1/batches":
+                self._create_batch(payload)
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def _handle(self, payload: Dict[str, Any], headers: Dict[str, str], chat: bool) -> None:
+            messages = payload.get("messages" if chat else "input") or []
+            input_text = "".join(str(m.get("content", "")) for m in messages if isinstance(m, dict))
+            answer = opts.answer
+            model = payload.get("model", opts.models[0])
+            tool_result = _tool_output(messages)
+            user_texts = [str(m.get("content", "")) for m in messages if isinstance(m, dict) and m.get("role") == "user"]
+            if tool_result is None and _tool_offered(payload) and user_texts and any(k in user_texts[-1] for k in CALC_KEYWORDS):
+                self._tool_call(payload, headers, chat, _usage(input_text, "", chat))
+                return
+            if tool_result and "pi_repayment" in tool_result:
+                answer = f"按本地计算器结果，月供约 AUD {tool_result['pi_repayment']:,.2f}。\n{answer}"
+            usage = _usage(input_text, answer, chat)
+            if not payload.get("stream"):
+                self._sleep(opts.latency_ms + random.uniform(0, opts.jitter_ms))
+                self._send_json(200, _blocking_body(model, answer, usage, chat), headers)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.close_connection = True
+            self._sleep(opts.ttft_ms + random.uniform(0, opts.jitter_ms))
+            pieces = [answer[i:i + opts.chunk_chars] for i in range(0, len(answer), opts.chunk_chars)]
+            events: List[Dict[str, Any]] = []
+            for piece in pieces:
+                if chat:
+                    events.append({"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]})
+                else:
+                    events.append({"type": "response.output_text.delta", "delta": piece})
+            if chat:
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    events.append({"object": "chat.completion.chunk", "choices": [], "usage": usage})
+            else:
+                events.append({"type": "response.completed", "response": {"id": "resp-mock", "usage": usage}})
+            try:
+                for i, event in enumerate(events):
+                    if i:
+                        self._sleep(opts.chunk_delay_ms)
+                    self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端取消：直接结束
+                pass
+
+        def _upload(self, raw: bytes) -> None:
+            content = _multipart_file(self.headers.get("Content-Type", ""), raw)
+            if content is None:
+                self._send_json(400, {"error": {"message": "missing file"}})
+                return
+            file_id = f"file-{uuid.uuid4().hex[:12]}"
+            with stats.lock:
+                stats.files[file_id] = content
+            self._send_json(200, {"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch"})
+
+        def _create_batch(self, payload: Dict[str, Any]) -> None:
+            """逐行生成回答并立即完成批次（不模拟 24 小时窗口）。"""
+            content = stats.files.get(payload.get("input_file_id", ""))
+            if content is None:
+                self._send_json(400, {"error": {"message": "input file not found"}})
+                return
+            lines = []
+            for line in content.decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                body = item.get("body") or {}
+                chat = item.get("url") == "/v1/chat/completions"
+                messages = body.get("messages" if chat else "input") or []
+                input_text = "".join(str(m.get("content", "")) for m in messages if isinstance(m, dict))
+                usage = _usage(input_text, opts.answer, chat)
+                result = _blocking_body(body.get("model", opts.models[0]), opts.answer, usage, chat)
+                lines.append(json.dumps(
+                    {"id": f"batch_req_{len(lines)}", "custom_id": item.get("custom_id"), "response": {"status_code": 200, "body": result}, "error": None},
+                    ensure_ascii=False,
+                ))
+            output_id = f"file-{uuid.uuid4().hex[:12]}"
+            batch = {
+                "id": f"batch_{uuid.uuid4().hex[:12]}",
+                "object": "batch",
+                "endpoint": payload.get("endpoint"),
+                "input_file_id": payload.get("input_file_id"),
+                "status": "completed",
+                "output_file_id": output_id,
+                "error_file_id": None,
+                "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+            }
+            with stats.lock:
+                stats.files[output_id] = ("\n".join(lines) + "\n").encode("utf-8")
+                stats.batches[batch["id"]] = batch
+            self._send_json(200, batch)
+
+        def _tool_call(self, payload: Dict[str, Any], headers: Dict[str, str], chat: bool, usage: Dict[str, Any]) -> None:
+            """返回一次 mortgage_calculator 调用（阻塞与流式两种形状）。"""
+            self._sleep(opts.ttft_ms + random.uniform(0, opts.jitter_ms))
+            arguments = json.dumps(CALC_ARGUMENTS)
+            if chat:
+                call = {"id": "call_mock", "type": "function", "function": {"name": "mortgage_calculator", "arguments": arguments}}
+            else:
+                call = {
+                    "type": "function_call",
+                    "id": "fc_mock",
+                    "call_id": "call_mock",
+                    "name": "mortgage_calculator",
+                    "arguments": arguments,
+                    "status": "completed",
+                }
+            if not payload.get("stream"):
+                if chat:
+                    body = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": None, "tool_calls": [call]},
+                                "finish_reason": "tool_calls",
+                            }
+                        ],
+                        "usage": usage,
+                    }
+                else:
+                    body = {"id": "resp-mock", "object": "response", "output": [call], "usage": usage}
+                self._send_json(200, body, headers)
+                return
+            if chat:
+                # 参数分两段下发，模拟真实的增量拼接
+                half = len(arguments) // 2
+                first = {"index": 0, "id": "call_mock", "type": "function", "function": {"name": "mortgage_calculator", "arguments": arguments[:half]}}
+                events = [
+                    {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"tool_calls": [first]}}]},
+                    {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"tool_calls": [{"index": 0, "function": {"arguments": arguments[half:]}}]}}]},
+                    {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]},
+                ]
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    events.append({"object": "chat.completion.chunk", "choices": [], "usage": usage})
+            else:
+                events = [
+                    {"type": "response.output_item.done", "item": call},
+                    {"type": "response.completed", "response": {"id": "resp-mock", "output": [call], "usage": usage}},
+                ]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.close_connection = True
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, options: Optional[MockOptions] = None):
+    """在后台线程启动模拟服务；返回 (server, base_url, stats)。port=0 时自动分配。"""
+    opts = options or MockOptions()
+    stats = MockStats()
+    server = _MockHTTPServer((host, port), _make_handler(opts, _Quota(opts.rpm), stats))
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    base_url = f"http://{host}:{server.server_port}/v1"
+    return server, base_url, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="非流式响应延迟")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="随机附加延迟上限")
+    parser.add_argument("--ttft-ms", type=float, default=150.0, help="流式首个增量前的延迟")
+    parser.add_argument("--chunk-delay-ms", type=float, default=15.0, help="流式增量之间的间隔")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="每个流式增量的字符数")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="随机注入 429 的比例（0~1）")
+    parser.add_argument("--fail-first", type=int, default=0, help="前 N 个请求返回 429（故障转移/重试演练）")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求配额（0 表示不限）")
+    args = parser.parse_args()
+
+    opts = MockOptions(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        ttft_ms=args.ttft_ms,
+        chunk_delay_ms=args.chunk_delay_ms,
+        chunk_chars=args.chunk_chars,
+        error_rate_429=args.error_rate_429,
+        fail_first=args.fail_first,
+        rpm=args.rpm,
+    )
+    server, base_url, stats = start_mock_server(args.host, args.port, opts)
+    print(f"🧪 Mock OpenAI 服务已启动: {base_url}")
+    print(f"   OPENAI_BASE_URL={base_url} OPENAI_API_KEY=mock")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"📊 请求 {stats.requests}，429 拒绝 {stats.rejected_429}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
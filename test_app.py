@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+使用 Streamlit AppTest 测试聊天界面渲染（无需 API Key）
+"""
+import os
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from config import CHAT_RENDER_PAGE_SIZE, CHAT_RENDER_WINDOW
+from mock_openai_server import MockOptions, start_mock_server
+from utils.session_store import get_session_manager
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def _start_app() -> AppTest:
+    return AppTest.from_file(APP_PATH, default_timeout=30).run()
+
+
+def _seed(at: AppTest, exchanges: int) -> None:
+    with get_session_manager().lease(at.session_state.session_id) as broker:
+        for i in range(exchanges):
+            broker.store.append("user", f"问题 {i}")
+            broker.store.append("assistant", f"回答 {i}")
+
+
+def test_long_history_renders_window_only():
+    """长会话每次只渲染最近窗口内的消息，更早的消息按页勾选后才渲染"""
+    at = _start_app()
+    _seed(at, 150)
+    at.run()
+    assert not at.exception
+    assert len(at.chat_message) == CHAT_RENDER_WINDOW
+    assert len(at.toggle) >= (300 - CHAT_RENDER_WINDOW) // CHAT_RENDER_PAGE_SIZE
+
+    at.toggle(key="history_page_0").set_value(True).run()
+    assert len(at.chat_message) == CHAT_RENDER_WINDOW + CHAT_RENDER_PAGE_SIZE
+    assert at.chat_message[0].markdown[0].value == "问题 0"
+    print(f"✅ 300 条消息只渲染 {CHAT_RENDER_WINDOW} 条，展开一页后 {len(at.chat_message)} 条")
+
+
+def _messages(at: AppTest):
+    return [m.markdown[0].value for m in at.chat_message]
+
+
+def test_fragment_reruns_show_each_message_once():
+    """侧边栏开关与提问只重跑各自片段；历史区与输入区合起来每条消息只出现一次"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=5, chunk_delay_ms=0))
+    try:
+        at = _start_app()
+        _seed(at, 2)
+        with get_session_manager().lease(at.session_state.session_id) as broker:
+            broker.api_client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+            broker.api_client.response_cache = None
+        at.run()
+        before = _messages(at)
+        assert before == ["问题 0", "回答 0", "问题 1", "回答 1"]
+
+        # 侧边栏第一个开关为网页搜索
+        at.sidebar.toggle[0].set_value(True).run()
+        assert not at.exception and at.session_state.use_web_search
+        assert _messages(at) == before
+
+        prompt = f"固定利率房贷有什么特点？{time.time_ns()}"
+        at.chat_input[0].set_value(prompt).run()
+        deadline = time.time() + 10
+        while at.session_state.generation_job is not None and time.time() < deadline:
+            time.sleep(0.1)
+            at.run()
+        assert not at.exception and at.session_state.generation_job is None
+        after = _messages(at)
+        assert after[:4] == before and after[4] == prompt and len(after) == 6
+        assert "固定利率" in after[5]
+
+        # 再切换一次开关：新回答已进入历史区，不重复、不丢失
+        at.sidebar.toggle[0].set_value(False).run()
+        assert not at.session_state.use_web_search
+        assert _messages(at) == after
+        print("✅ 片段重跑后每条消息只渲染一次")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_long_history_renders_window_only()
+    test_fragment_reruns_show_each_message_once()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+批量处理脚本测试（本地模拟服务，无需 API Key）
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from batch_process import collect_batch, load_done, run_sync, submit_batch
+from mock_openai_server import MockOptions, start_mock_server
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+QUESTIONS = [
+    {"request_id": "q1", "title": "固定利率", "body": "固定利率房贷有什么特点？"},
+    {"request_id": "q2", "question": "房价 80万，首付 20%，利率 6.2%，30年，月供多少？"},
+    {"id": "q3", "text": "What is LMI?"},
+]
+
+
+def _setup(tmp: str, base_url: str, model: str = "gpt-5-mini"):
+    src = os.path.join(tmp, "questions.jsonl")
+    with open(src, "w", encoding="utf-8") as f:
+        for q in QUESTIONS:
+            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    args = argparse.Namespace(
+        input=src, output=os.path.join(tmp, "answers.jsonl"), workers=2, rpm=0, resume=True,
+        reasoning=False, web_search=False, wait=False, poll_seconds=1, force=False,
+    )
+    client = UnifiedAIClient(model=model, provider="openai", base_url=base_url)
+    client.response_cache = None
+    return args, client
+
+
+def _rows(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sync_with_resume():
+    """并发处理并逐条写出；再次 --resume 时跳过已成功的编号"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            args, client = _setup(tmp, base_url)
+            run_sync(args, client)
+            rows = _rows(args.output)
+            assert {r["id"] for r in rows} == {"q1", "q2", "q3"}
+            assert all(r["status"] == "ok" and r["answer"] for r in rows)
+            assert next(r for r in rows if r["id"] == "q2")["route"] == "calc"
+            assert load_done(args.output) == {"q1", "q2", "q3"}
+            before = stats.requests
+            run_sync(args, client)
+            assert len(_rows(args.output)) == 3 and stats.requests == before
+            print(f"✅ 同步批处理完成，模拟服务收到 {before} 次请求；续跑无新增请求")
+    finally:
+        server.shutdown()
+
+
+def test_openai_batch_submit_and_collect():
+    """计算题本地作答，其余问题经 Batch API 提交后收取"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=0))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            args, client = _setup(tmp, base_url)
+            submit_batch(args, client)
+            assert len(stats.batches) == 1
+            assert [r["id"] for r in _rows(args.output)] == ["q2"]
+            # 尚未收取：不覆盖状态文件，也不重复写出本地作答的行
+            args.resume = False
+            try:
+                submit_batch(args, client)
+                raise AssertionError("pending batch should not be overwritten")
+            except SystemExit:
+                pass
+            assert len(stats.batches) == 1 and len(_rows(args.output)) == 1
+            collect_batch(args, client)
+            rows = {r["id"]: r for r in _rows(args.output)}
+            assert set(rows) == {"q1", "q2", "q3"}
+            assert rows["q1"]["route"] == "batch" and "固定利率" in rows["q1"]["answer"]
+            assert rows["q1"]["input_tokens"] > 0
+            assert not os.path.exists(args.output + ".batch.json")
+            # 再次提交（不带 --resume）：全部已成功，不再提交也不追加重复行
+            submit_batch(args, client)
+            assert len(stats.batches) == 1 and len(_rows(args.output)) == 3
+            print("✅ Batch API 提交与收取完成")
+    finally:
+        server.shutdown()
+
+
+def test_batch_via_chat_completions():
+    """Chat Completions 模型的 Batch 请求同样经客户端公开接口构造与解析"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=0))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            args, client = _setup(tmp, base_url, model="gpt-4o-mini")
+            submit_batch(args, client)
+            batch = next(iter(stats.batches.values()))
+            assert batch["endpoint"] == "/v1/chat/completions"
+            collect_batch(args, client)
+            rows = {r["id"]: r for r in _rows(args.output)}
+            assert set(rows) == {"q1", "q2", "q3"} and all(r["status"] == "ok" for r in rows.values())
+            assert "固定利率" in rows["q1"]["answer"]
+            print("✅ Chat Completions Batch 提交与收取完成")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_sync_with_resume()
+    test_openai_batch_submit_and_collect()
+    test_batch_via_chat_completions()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+测试按 token 预算装配对话上下文（无需 API Key）
+"""
+from utils.context_window import count_message_tokens, pack_messages
+
+
+def _history(turns: int, answer_len: int):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"问题 {i}：月供怎么算？"})
+        history.append({"role": "assistant", "content": "还款计划表 " * answer_len})
+    return history
+
+
+def test_short_history_kept_whole():
+    """预算充足时保留全部历史"""
+    packed = pack_messages("system prompt", _history(3, 5), "新问题", budget=5000)
+    assert packed.history_kept == 6 and packed.history_dropped == 0
+    assert packed.messages[0]["role"] == "system"
+    assert packed.messages[-1] == {"role": "user", "content": "新问题"}
+    print(f"✅ 短对话完整保留：{packed.to_dict()}")
+
+
+def test_long_history_trimmed_from_oldest():
+    """超出预算时从最旧的消息开始丢弃，且总量不超过预算"""
+    history = _history(10, 300)
+    packed = pack_messages("system prompt", history, "新问题", budget=2000)
+    assert packed.input_tokens <= 2000
+    assert sum(count_message_tokens(m) for m in packed.messages) == packed.input_tokens
+    assert packed.history_dropped > 0
+    # 保留的是最新的消息
+    assert packed.messages[-2] is history[-1]
+    print(f"✅ 长对话按预算裁剪：{packed.to_dict()}")
+
+
+if __name__ == "__main__":
+    test_short_history_kept_whole()
+    test_long_history_trimmed_from_oldest()
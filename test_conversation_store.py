@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试会话对话存储（单份记录、增量 API 视图、撤销与内存统计）
+"""
+import os
+
+from utils.broker_logic import CANCELLED_NOTE, AustralianMortgageBroker
+from utils.conversation_store import ConversationStore
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+class FakeClient:
+    provider = "openai"
+    model = "fake"
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.requests = []
+
+    def generate_response(self, messages, max_tokens=1500, **kwargs):
+        self.requests.append(messages)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return "好的。"
+
+
+def test_store_history_and_undo():
+    """失败轮次只展示不进上下文；撤销同步移出上下文；窗口外消息被移交"""
+    store = ConversationStore()
+    store.append("user", "问题一")
+    store.append("assistant", "回答一")
+    store.append("user", "问题二", in_context=False)
+    store.append("assistant", "出错了", in_context=False)
+    assert len(store) == 4 and len(store.history) == 2
+    assert store.history[0]["content"] is store.turns[0].content
+
+    assert store.pop_exchange() and len(store) == 2 and len(store.history) == 2
+    assert store.pop_exchange() and len(store) == 0 and store.history == []
+    assert not store.pop_exchange()
+
+    for i in range(12):
+        store.append("user", f"q{i}")
+        store.append("assistant", f"a{i}")
+    evicted = store.evict_overflow(20)
+    assert [m["content"] for m in evicted] == ["q0", "a0", "q1", "a1"]
+    assert len(store.history) == 20 and len(store) == 24
+    assert store.to_dicts()[0]["ts"] and store.memory_report()["approx_bytes"] > 0
+    print(f"✅ 会话存储：{store.memory_report()}")
+
+
+def test_broker_single_copy():
+    """broker 的上下文直接复用存储中的消息对象，客户端清洗时不再复制"""
+    broker = AustralianMortgageBroker(api_client=FakeClient())
+    broker.generate_response("固定利率有什么特点？")
+    broker.generate_response("浮动利率呢？")
+    messages = broker._build_messages("还有呢？", reasoning=False)
+    assert messages[1] is broker.store.history[0]
+    client = UnifiedAIClient(model="gpt-5-mini", provider="openai", base_url="http://127.0.0.1:9/v1")
+    assert client._sanitize_messages(messages)[1] is messages[1]
+
+    assert broker.undo_last() and len(broker.store) == 2 and len(broker.conversation_history) == 2
+
+    print("✅ broker 对话记录单份保存")
+
+
+class PartialStreamClient(FakeClient):
+    """流式输出一段后上游出错"""
+
+    def generate_response(self, messages, max_tokens=1500, stream=False, **kwargs):
+        def chunks():
+            yield "结论：固定利率"
+            raise RuntimeError("upstream down")
+
+        return chunks() if self.fail else iter(["结论：", "好的。"])
+
+
+def test_broker_stream_errors_and_reasoning_fallback():
+    """流式错误抛给调用方（不当作回答文本输出），记录仅展示；推理兜底写入展示文本"""
+    failing = AustralianMortgageBroker(api_client=PartialStreamClient(fail=True))
+    received = []
+    try:
+        for delta in failing.generate_response("固定利率有什么特点？", stream=True):
+            received.append(delta)
+        raise AssertionError("stream error should propagate")
+    except RuntimeError as exc:
+        assert "upstream down" in str(exc)
+    assert received == ["结论：固定利率"]
+    assert failing.store.turns[-1].content == "结论：固定利率\n\n生成回复时出现错误: upstream down"
+    assert len(failing.store) == 2 and failing.conversation_history == []
+
+    broker = AustralianMortgageBroker(api_client=PartialStreamClient())
+    streamed = "".join(broker.generate_response("固定利率有什么特点？", reasoning=True, stream=True))
+    assert streamed == "结论：好的。"
+    shown = broker.store.turns[-1].content
+    assert shown.startswith("推理过程") and shown.endswith("结论：好的。")
+    assert broker.conversation_history[-1]["content"] is shown
+
+
+def test_record_failed_turn():
+    """未完成的轮次（取消/出错）只作展示记录，不进入模型上下文"""
+    broker = AustralianMortgageBroker(api_client=FakeClient())
+    assert broker.record_failed_turn("问题一", "部分回答 ") == "部分回答" + CANCELLED_NOTE
+    shown = broker.record_failed_turn("问题二", error=RuntimeError("timeout"))
+    assert shown == "生成回复时出现错误: timeout"
+    assert [t.in_context for t in broker.store.turns] == [False] * 4
+    assert broker.conversation_history == []
+
+
+if __name__ == "__main__":
+    test_store_history_and_undo()
+    test_broker_single_copy()
+    test_broker_stream_errors_and_reasoning_fallback()
+    test_record_failed_turn()
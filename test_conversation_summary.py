@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试旧轮次滚动摘要（使用假客户端，无需 API Key）
+"""
+import os
+import threading
+
+from mock_openai_server import MockOptions, start_mock_server
+from utils.broker_logic import AustralianMortgageBroker
+from utils.conversation_summary import RollingSummarizer
+from utils.metrics import METRICS
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+class FakeClient:
+    """回答固定文本；摘要请求返回新轮次的用户发言，便于断言增量行为。"""
+
+    provider = "openai"
+    model = "fake"
+
+    def __init__(self):
+        self.summary_inputs = []
+        self.lock = threading.Lock()
+
+    def generate_response(self, messages, max_tokens=1500, **kwargs):
+        if "running memory" in messages[0]["content"]:
+            body = messages[-1]["content"]
+            with self.lock:
+                self.summary_inputs.append(body)
+            new_turns = body.split("New turns:\n", 1)[1]
+            previous = body.split("Previous summary:\n", 1)[1].split("\n\nNew turns:", 1)[0]
+            facts = [ln for ln in new_turns.splitlines() if ln.startswith("User:")]
+            return "\n".join(([] if previous == "(none)" else [previous]) + facts)
+        return "好的。"
+
+
+def test_evicted_turns_folded_incrementally():
+    """超过 20 条后，旧轮次在后台折叠进摘要，且每次只摘要新淘汰的部分"""
+    client = FakeClient()
+    broker = AustralianMortgageBroker(api_client=client)
+    broker.generate_response("我的年收入是 AUD 150,000，住在维州")
+    for i in range(12):
+        broker.generate_response(f"第 {i} 个问题")
+        broker.summarizer.wait_idle(5)
+
+    assert len(broker.conversation_history) == 20
+    assert "AUD 150,000" in broker.summarizer.summary
+    # 首轮只出现在第一次摘要的新轮次中
+    assert sum("AUD 150,000" in body.split("New turns:")[1] for body in client.summary_inputs) == 1
+
+    messages = broker._build_messages("首付需要多少？", reasoning=False)
+    assert messages[1]["role"] == "system" and "AUD 150,000" in messages[1]["content"]
+    print(f"✅ 摘要已注入上下文：{broker.summarizer.to_dict()}")
+
+    broker.clear_history()
+    assert broker.summarizer.summary == "" and broker.conversation_history == []
+
+
+class RecordingCache:
+    """只记录写入的回答缓存，用于断言摘要请求不入缓存。"""
+
+    def __init__(self):
+        self.keys = []
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        self.keys.append(key)
+
+    def ttl_for(self, use_web_search):
+        return 60
+
+
+def _summary_requests() -> float:
+    return sum(
+        v for (name, labels), v in METRICS._counters.items()
+        if name == "broker_requests_total" and ("purpose", "summary") in labels
+    )
+
+
+def test_summary_calls_bypass_cache_and_use_own_label():
+    """摘要请求走共享客户端时不写回答缓存，并以 purpose=summary 单独计入指标"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5))
+    try:
+        client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+        client.response_cache = RecordingCache()
+        summarizer = RollingSummarizer(client)
+        before = _summary_requests()
+        turns = [{"role": "user", "content": "我的年收入是 AUD 150,000"}, {"role": "assistant", "content": "好的。"}]
+        for _ in range(2):
+            assert summarizer._summarize("", turns)
+        assert client.response_cache.keys == []
+        assert stats.requests == 2
+        assert client.last_metrics.purpose == "summary"
+        assert _summary_requests() - before == 2
+
+        client.generate_response([{"role": "user", "content": "摘要之外的普通提问"}])
+        assert len(client.response_cache.keys) == 1 and client.last_metrics.purpose == "chat"
+        print("✅ 摘要请求未写入回答缓存，指标标签为 purpose=summary")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_evicted_turns_folded_incrementally()
+    test_summary_calls_bypass_cache_and_use_own_label()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试对话导出（JSON / 紧凑 JSON / JSONL / Markdown / PDF）
+"""
+import json
+import re
+
+from utils.conversation_store import ConversationStore
+from utils.export import EXPORT_FORMATS, iter_pdf, render_export
+
+
+def _store(n: int) -> ConversationStore:
+    store = ConversationStore()
+    for i in range(n):
+        store.append("user", f"第 {i} 个问题：首付 20% 够吗？")
+        store.append("assistant", "结论：\n- 贷款额 AUD 640,000，LVR 80%。\n" * 3 + "Emoji 👍 fallback")
+    return store
+
+
+def test_text_formats():
+    """缩进 JSON 与旧版导出逐字节相同；紧凑 JSON 字段一致；JSONL 逐行可解析"""
+    store = _store(3)
+    legacy = json.dumps(store.to_dicts(), ensure_ascii=False, indent=2).encode("utf-8")
+    assert render_export(store.turns, "json") == legacy
+    data = render_export(store.turns, "json_compact")
+    assert json.loads(data) == store.to_dicts() and b"\n" not in data.split(b'"content"')[0]
+    lines = render_export(store.turns, "jsonl").decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == store.to_dicts()
+    markdown = render_export(store.turns, "markdown").decode("utf-8")
+    assert markdown.startswith("# ") and markdown.count("### ") == 6
+    assert set(EXPORT_FORMATS) == {"json", "json_compact", "jsonl", "markdown", "pdf"}
+
+
+def test_pdf_structure():
+    """多页 PDF：xref 偏移指向对应对象，页数与 /Count 一致"""
+    store = _store(40)
+    pdf = b"".join(iter_pdf(store.turns))
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    xref_pos = int(pdf.rsplit(b"startxref\n", 1)[1].split(b"\n", 1)[0])
+    entries = pdf[xref_pos:].split(b"\n")[3:]
+    size = int(re.search(rb"/Size (\d+)", pdf).group(1))
+    for num in range(1, size):
+        offset = int(entries[num - 1][:10])
+        assert pdf[offset:].startswith(b"%d 0 obj" % num)
+    pages = int(re.search(rb"/Count (\d+)", pdf).group(1))
+    assert pages > 1 and pdf.count(b"/Type /Page ") == pages
+    assert b"STSong-Light" in pdf and b"<7B2C" in pdf  # “第”的 UCS-2 编码
+    print(f"✅ PDF {len(pdf) / 1024:.1f} KB，{pages} 页")
+
+
+if __name__ == "__main__":
+    test_text_formats()
+    test_pdf_structure()
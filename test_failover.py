@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+测试多后端故障转移与对冲（本地模拟服务，无需 API Key）
+"""
+import os
+import threading
+import time
+
+import utils.failover as failover
+from mock_openai_server import MockOptions, start_mock_server
+from utils.cancellation import CancelToken, GenerationCancelled, cancel_scope
+from utils.failover import MultiProviderClient
+from utils.metrics import METRICS
+from utils.unified_client import UnifiedAIClient, UpstreamHTTPError
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+MESSAGES = [{"role": "user", "content": "再融资有哪些步骤？"}]
+
+
+def _cancelled_requests() -> float:
+    return sum(
+        v for (name, labels), v in METRICS._counters.items()
+        if name == "broker_requests_total" and ("status", "cancelled") in labels
+    )
+
+
+def _backend(base_url: str) -> UnifiedAIClient:
+    client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+    client.response_cache = None
+    client.max_retries = 1  # 不在单个后端内重试，直接交给故障转移
+    return client
+
+
+def test_failover_when_primary_fails():
+    """首选后端返回 429（fail_first）时切换到备用后端，调用在调用方线程内完成"""
+    bad, bad_url, bad_stats = start_mock_server(options=MockOptions(latency_ms=5, fail_first=100))
+    good, good_url, good_stats = start_mock_server(options=MockOptions(latency_ms=5))
+    try:
+        primary, secondary = _backend(bad_url), _backend(good_url)
+        client = MultiProviderClient([primary, secondary], hedge=False)
+        text, backend = client.generate_with_backend(MESSAGES)
+        assert text and backend is secondary
+        assert bad_stats.rejected_429 == 1 and good_stats.requests == 1
+        assert client.last_metrics is not None and client.last_metrics.status == "ok"
+        print(f"✅ 故障转移：{client.health_report()}")
+    finally:
+        bad.shutdown()
+        good.shutdown()
+
+
+def test_failover_keeps_caller_cancel_scope():
+    """不对冲时取消标记对后端请求生效"""
+    slow, slow_url, _ = start_mock_server(options=MockOptions(latency_ms=3000, jitter_ms=0))
+    try:
+        client = MultiProviderClient([_backend(slow_url)], hedge=False)
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.time()
+        try:
+            with cancel_scope(token):
+                client.generate_response(MESSAGES)
+            raise AssertionError("request should be cancelled")
+        except GenerationCancelled:
+            pass
+        assert time.time() - start < 1.5
+    finally:
+        slow.shutdown()
+
+
+def test_hedge_wins_and_cancels_loser():
+    """首选后端过慢时对冲到备用后端，胜出后取消落后的请求"""
+    slow, slow_url, _ = start_mock_server(options=MockOptions(latency_ms=3000, jitter_ms=0))
+    fast, fast_url, _ = start_mock_server(options=MockOptions(latency_ms=5, jitter_ms=0))
+    saved = failover.HEDGE_MIN_DELAY_MS
+    failover.HEDGE_MIN_DELAY_MS = 200
+    try:
+        primary, secondary = _backend(slow_url), _backend(fast_url)
+        client = MultiProviderClient([primary, secondary], hedge=True)
+        cancelled = _cancelled_requests()
+        start = time.time()
+        text, backend = client.generate_with_backend(MESSAGES)
+        elapsed = time.time() - start
+        assert text and backend is secondary and elapsed < 1.5
+        # 落后的请求已被取消（关闭连接），不会等满 3 秒
+        deadline = time.time() + 1.0
+        while _cancelled_requests() == cancelled and time.time() < deadline:
+            time.sleep(0.02)
+        assert _cancelled_requests() == cancelled + 1 and time.time() - start < 2.5
+        print(f"✅ 对冲胜出：{elapsed * 1000:.0f}ms")
+    finally:
+        failover.HEDGE_MIN_DELAY_MS = saved
+        slow.shutdown()
+        fast.shutdown()
+
+
+def test_client_errors_are_not_failed_over():
+    """非 429 的 4xx（如路径/请求错误）直接抛出：不切换后端，也不计入后端错误"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5))
+    good, good_url, good_stats = start_mock_server(options=MockOptions(latency_ms=5))
+    try:
+        primary, secondary = _backend(f"{base_url}/bad"), _backend(good_url)
+        for hedge in (False, True):
+            client = MultiProviderClient([primary, secondary], hedge=hedge)
+            try:
+                client.generate_response(MESSAGES)
+                raise AssertionError("4xx should not fail over")
+            except UpstreamHTTPError as exc:
+                assert exc.status_code == 404 and not exc.retryable
+            assert client.health_report()[0]["consecutive_errors"] == 0
+        try:
+            list(MultiProviderClient([primary, secondary]).generate_response(MESSAGES, stream=True))
+            raise AssertionError("4xx should not fail over")
+        except UpstreamHTTPError:
+            pass
+        assert good_stats.requests == 0 and stats.requests == 3
+        print("✅ 4xx 未触发故障转移")
+    finally:
+        server.shutdown()
+        good.shutdown()
+
+
+def test_stream_first_token_and_total_latency_kept_apart():
+    """流式调用的首个增量耗时与完整耗时分开统计，p95 只反映完整响应耗时"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=5, chunk_delay_ms=20, jitter_ms=0))
+    try:
+        backend = _backend(base_url)
+        client = MultiProviderClient([backend], hedge=False)
+        chunks = list(client.generate_response([{"role": "user", "content": f"流式延迟统计 {time.time_ns()}"}], stream=True))
+        assert len(chunks) > 3
+        health = client._health[id(backend)]
+        assert len(health.latencies) == 1 and len(health.first_token_latencies) == 1
+        # 其后至少还有 3 个增量、每个间隔 20ms
+        assert health.latencies[0] >= health.first_token_latencies[0] + 60
+        report = client.health_report()[0]
+        assert report["p95_ms"] > report["p95_first_token_ms"]
+        print(f"✅ 首字/完整延迟分开统计：{report}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_failover_when_primary_fails()
+    test_failover_keeps_caller_cancel_scope()
+    test_hedge_wins_and_cancels_loser()
+    test_client_errors_are_not_failed_over()
+    test_stream_first_token_and_total_latency_kept_apart()
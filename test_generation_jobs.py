@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试后台生成与取消（本地模拟服务，无需 API Key）
+"""
+import os
+import tempfile
+import time
+
+import utils.session_store as session_store
+from mock_openai_server import MockOptions, start_mock_server
+from utils.broker_logic import AustralianMortgageBroker
+from utils.generation_jobs import submit_generation
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+PROMPT = "请帮我分析一下在墨尔本买第一套自住房时，贷款结构应该怎样安排比较稳妥？"
+
+
+def _use_manager(tmp: str, base_url: str) -> None:
+    def factory():
+        client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+        client.response_cache = None
+        client.max_retries = 3
+        return AustralianMortgageBroker(api_client=client)
+
+    session_store._SHARED_MANAGER = session_store.SessionManager(factory, path=os.path.join(tmp, "sessions.sqlite3"))
+
+
+def _wait(job, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.02)
+    assert job.done
+
+
+def test_background_generation_completes():
+    """回答在后台线程生成；完成后已写入会话存储，并附带展示用的 meta"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=10, chunk_delay_ms=1))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _use_manager(tmp, base_url)
+            job = submit_generation("s1", PROMPT)
+            _wait(job)
+            assert job.status == "done" and job.text
+            with session_store.get_session_manager().lease("s1") as broker:
+                turns = broker.store.turns
+                assert [t.role for t in turns] == ["user", "assistant"]
+                assert turns[-1].content == job.text and turns[-1].meta
+                assert len(broker.conversation_history) == 2
+            print(f"✅ 后台生成完成：{len(job.text)} 字，{turns[-1].meta}")
+    finally:
+        session_store._SHARED_MANAGER = None
+        server.shutdown()
+
+
+def test_cancel_interrupts_blocked_stream():
+    """首字前长时间阻塞时取消：立即结束，不重试，部分回答只展示不进入上下文"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=5000, chunk_delay_ms=1))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _use_manager(tmp, base_url)
+            job = submit_generation("s2", PROMPT)
+            time.sleep(0.3)
+            start = time.time()
+            job.cancel()
+            _wait(job, timeout=3.0)
+            elapsed = time.time() - start
+            assert job.status == "cancelled" and elapsed < 1.5
+            assert stats.requests == 1
+            with session_store.get_session_manager().lease("s2") as broker:
+                turns = broker.store.turns
+                assert [t.role for t in turns] == ["user", "assistant"]
+                assert not turns[-1].in_context and "Cancelled" in turns[-1].content
+                assert broker.conversation_history == []
+            print(f"✅ 取消生效：{elapsed * 1000:.0f}ms")
+    finally:
+        session_store._SHARED_MANAGER = None
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_background_generation_completes()
+    test_cancel_interrupts_blocked_stream()
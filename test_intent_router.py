@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试本地意图路由（无需 API Key）
+"""
+from utils.broker_logic import AustralianMortgageBroker
+from utils.intent_router import extract_calc_args, route_query
+
+
+class NoCallClient:
+    """路由到本地计算时不应调用模型"""
+
+    provider = "openai"
+    model = "fake"
+
+    def generate_response(self, *args, **kwargs):
+        raise AssertionError("model should not be called")
+
+
+def test_routes():
+    """计算/术语/仅模型/模型+搜索 四种路由"""
+    cases = [
+        ("房价 AUD 800,000，首付 20%，利率 6.2%，30 年的月供是多少？", True, "calc"),
+        ("monthly repayments on a $650k loan at 6.1% over 25 years", True, "calc"),
+        ("什么是LVR？", True, "faq"),
+        ("What is an offset account?", True, "faq"),
+        ("现在RBA的现金利率是多少", True, "model_search"),
+        ("现在RBA的现金利率是多少", False, "model"),
+        ("我是自雇人士，贷款需要准备什么材料？", True, "model"),
+    ]
+    for text, search, expected in cases:
+        decision = route_query(text, use_web_search=search)
+        assert decision.route == expected, (text, decision.to_dict())
+        print(f"✅ {expected:12s} {decision.elapsed_ms:.3f}ms  {text}")
+    args = route_query("house 900k deposit 20% rate 6% 30 years repayments").calc_args
+    assert args == {"annual_rate_percent": 6.0, "term_years": 30.0, "property_price": 900000.0, "deposit_percent": 20.0}
+
+
+def test_year_and_interest_only_parsing():
+    """“2025年”不是期限且属于时效措辞；只还利息期单独抽取，抽不出时交给模型"""
+    assert extract_calc_args("2025年房价80万首付20%利率6%月供多少") is None
+    assert route_query("2025年房价80万首付20%利率6%月供多少", use_web_search=True).route == "model_search"
+    assert route_query("2025年维州首次购房补助", use_web_search=True).reason == "rule: time-sensitive wording"
+    for text in (
+        "贷款60万利率6% 30年，只还利息5年，月供多少",
+        "前5年只还利息，贷款60万，利率6%，30年，月供多少",
+        "monthly repayments on a 600k loan at 6% over 30 years, interest-only for 5 years",
+    ):
+        args = route_query(text).calc_args
+        assert args is not None, text
+        assert (args["term_years"], args["interest_only_years"], args["repayment_type"]) == (30.0, 5.0, "interest_only")
+    assert route_query("贷款60万利率6% 30年只还利息，月供多少").route == "model"
+
+
+def test_faq_and_opinion_go_to_model():
+    """带数字/附加从句/已有对话的术语问题，以及计算 + 判断的混合问题都交给模型"""
+    for text in (
+        "What is the LVR if I borrow 720k on an 800k house?",
+        "什么是只还利息贷款，对我这种投资者合适吗",
+        "贷款60万利率6% 30年月供多少，我能承受吗？",
+        "can I afford repayments on a 600k loan at 6% over 30 years",
+    ):
+        assert route_query(text, use_web_search=True).route == "model", text
+    assert route_query("什么是只还利息贷款？").route == "faq"
+    assert route_query("什么是LVR？", has_history=True).route == "model"
+
+
+def test_broker_answers_calc_locally():
+    """纯计算问题由本地计算器作答并写入历史"""
+    broker = AustralianMortgageBroker(api_client=NoCallClient())
+    answer = broker.generate_response("贷款 60万，利率 6%，30年，月供多少", use_web_search=True)
+    assert "AUD 3,597.30" in answer
+    assert broker.last_route.route == "calc" and broker.last_metrics.provider == "local"
+    streamed = "".join(broker.generate_response("贷款 60万，利率 6%，30年，月供多少", stream=True))
+    assert streamed == answer and len(broker.conversation_history) == 4
+    print(f"✅ 本地计算作答：{answer.splitlines()[2]}")
+
+
+if __name__ == "__main__":
+    test_routes()
+    test_year_and_interest_only_parsing()
+    test_faq_and_opinion_go_to_model()
+    test_broker_answers_calc_locally()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试请求级延迟与用量指标（本地模拟服务，无需 API Key）
+"""
+import json
+import os
+import tempfile
+
+from mock_openai_server import MockOptions, start_mock_server
+from utils.metrics import MetricsRegistry
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def test_request_metrics_are_structured_and_aggregated():
+    """阻塞与流式调用各生成一条结构化记录，汇总为直方图、计数器与 JSONL"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=20, ttft_ms=10, chunk_delay_ms=1))
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = MetricsRegistry(jsonl_path=os.path.join(tmp, "metrics.jsonl"))
+        try:
+            client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+            client.response_cache = None
+            messages = [{"role": "user", "content": "指标测试：固定利率有什么特点？"}]
+
+            client.generate_response(messages, use_web_search=True)
+            blocking = client.last_metrics
+            assert blocking.status == "ok" and not blocking.stream and blocking.web_search
+            assert blocking.ttfb_ms is not None and blocking.total_ms >= blocking.ttfb_ms
+            assert blocking.input_tokens > 0 and blocking.output_tokens > 0
+            registry.record(blocking)
+
+            list(client.generate_response(messages, stream=True))
+            streamed = client.last_metrics
+            assert streamed.stream and streamed.first_token_ms is not None
+            registry.record(streamed)
+        finally:
+            server.shutdown()
+
+        text = registry.render_prometheus()
+        assert 'broker_request_latency_ms_bucket{provider="openai",model="gpt-4o-mini",web_search="on"' in text
+        assert "broker_request_first_token_ms_count" in text
+        assert 'broker_tokens_total{' in text and 'kind="output"' in text
+
+        rows = registry.summary()
+        assert sorted(row["web_search"] for row in rows) == ["off", "on"]
+        assert all(row["count"] == 1 and row["p50"] > 0 for row in rows)
+
+        with open(registry.jsonl_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert [r["stream"] for r in records] == [False, True]
+        assert records[0]["output_tokens"] == blocking.output_tokens
+        print(f"✅ 指标汇总：{rows}")
+
+
+if __name__ == "__main__":
+    test_request_metrics_are_structured_and_aggregated()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+使用本地模拟服务测试客户端（无需 API Key）
+"""
+import os
+from mock_openai_server import MockOptions, start_mock_server
+from utils.metrics import METRICS
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def _client(base_url: str, model: str = "gpt-5-mini") -> UnifiedAIClient:
+    client = UnifiedAIClient(model=model, provider="openai", base_url=base_url)
+    client.response_cache = None  # 每次都打到模拟服务
+    return client
+
+
+def test_blocking_and_streaming_paths():
+    """Responses 与 Chat Completions 两条路径的阻塞/流式调用"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=20, ttft_ms=10, chunk_delay_ms=1))
+    try:
+        for model in ("gpt-5-mini", "gpt-4o-mini"):
+            client = _client(base_url, model)
+            messages = [{"role": "user", "content": f"固定利率房贷有什么特点？({model})"}]
+            text = client.generate_response(messages)
+            assert "固定利率" in text
+            chunks = list(client.generate_response(messages, stream=True))
+            assert len(chunks) > 1 and "".join(chunks).strip() == text
+            metrics = client.last_metrics
+            assert metrics.first_token_ms is not None and metrics.output_tokens > 0
+            print(f"✅ {model} [{metrics.endpoint}] 首字 {metrics.first_token_ms:.0f}ms，总计 {metrics.total_ms:.0f}ms")
+    finally:
+        server.shutdown()
+
+
+def test_retries_after_429():
+    """前两次请求返回 429，客户端按 Retry-After 退避后成功"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5, fail_first=2))
+    try:
+        client = _client(base_url, "gpt-4o-mini")
+        client.max_retries = 3
+        text = client.generate_response([{"role": "user", "content": "429 重试测试"}])
+        assert text
+        assert client.last_metrics.retries == 2
+        assert stats.rejected_429 == 2
+        print(f"✅ 429 重试成功（共 {stats.requests} 次请求）")
+    finally:
+        server.shutdown()
+
+
+def test_prompt_cache_key_and_cached_tokens():
+    """携带 prompt_cache_key，并统计 usage 中的 cached_tokens 命中率"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5))
+    try:
+        client = _client(base_url, "gpt-5-mini")
+        client.prompt_cache_key = "test-deployment"
+        system = {"role": "system", "content": "Stable broker prompt. " * 400}
+        for i in range(3):
+            client.generate_response([system, {"role": "user", "content": f"问题 {i}"}])
+            assert client.last_metrics.cached_tokens > 0
+        assert stats.prompt_cache_keys == {"test-deployment"}
+        report = METRICS.prompt_cache_report()
+        assert report["hit_requests"] >= 3 and report["token_hit_rate"] > 0
+        print(f"✅ 提示缓存统计：{report}")
+    finally:
+        server.shutdown()
+
+
+def test_mortgage_tool_loop():
+    """模型请求 mortgage_calculator 时在本地计算，并把结果回传继续生成"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=5, chunk_delay_ms=0))
+    try:
+        for model in ("gpt-5-mini", "gpt-4o-mini"):
+            client = _client(base_url, model)
+            messages = [{"role": "user", "content": f"房价 AUD 800,000，首付 20%，月供是多少？({model})"}]
+            text = client.generate_response(messages, use_tools=True)
+            assert "AUD 3,919.80" in text and client.last_metrics.tool_calls == 1
+            streamed = "".join(client.generate_response(messages, use_tools=True, stream=True))
+            assert "AUD 3,919.80" in streamed and client.last_metrics.tool_calls == 1
+            print(f"✅ {model} 工具往返完成：{text.splitlines()[0]}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_blocking_and_streaming_paths()
+    test_retries_after_429()
+    test_prompt_cache_key_and_cached_tokens()
+    test_mortgage_tool_loop()
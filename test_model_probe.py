@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+测试模型能力探测缓存（本地模拟服务，无需 API Key）
+"""
+import os
+import tempfile
+import time
+
+import utils.model_probe as model_probe
+from mock_openai_server import MockOptions, start_mock_server
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def test_probe_runs_in_background_and_is_cached():
+    """构造客户端不等待探测；后台结果写入磁盘，TTL 内新客户端直接复用、不再探测"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=5))
+    original = model_probe._PROBE_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        model_probe._PROBE_FILE = os.path.join(tmp, "model_probe.json")
+        try:
+            model = f"no-such-model-{time.time_ns()}"
+            client = UnifiedAIClient(model=model, provider="openai", base_url=base_url)
+            # 尚无缓存：乐观假定可用，探测在后台线程进行
+            assert client.model_available and client._probe_thread is not None
+            client._probe_thread.join(5)
+            assert client.model_available is False
+
+            record = model_probe.load_probe("openai", model)
+            assert record and record["available"] is False and model_probe.is_fresh(record)
+
+            cached = UnifiedAIClient(model=model, provider="openai", base_url=base_url)
+            assert cached._probe_thread is None and cached.model_available is False
+            assert not model_probe.is_fresh(record, ttl=0)
+            print("✅ 探测结果已缓存，新客户端无需重新探测")
+        finally:
+            model_probe._PROBE_FILE = original
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    test_probe_runs_in_background_and_is_cached()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+测试本地房贷计算引擎与函数工具（无需 API Key）
+"""
+import json
+
+import numpy as np
+
+from utils.mortgage_calc import (
+    REPAYMENT_TYPES,
+    amortisation_schedule,
+    calculate,
+    loan_amount,
+    lvr,
+    offset_savings,
+    parse_values,
+    pi_repayment,
+    run_tool_call,
+    scenario_grid,
+    total_interest,
+)
+
+
+def _simulate(principal, rate, years, offset=0.0):
+    """逐月模拟还款，作为闭式公式的对照"""
+    r = rate / 100 / 12
+    payment = float(pi_repayment(principal, rate, years))
+    balance, interest, months = principal, 0.0, 0
+    while balance > 1e-6 and months < years * 12:
+        charged = max(balance - offset, 0.0) * r
+        balance = balance + charged - min(payment, balance + charged)
+        interest += charged
+        months += 1
+    return payment, interest, months
+
+
+def test_repayment_matches_simulation():
+    """本息等额月供与逐月模拟一致；支持数组广播"""
+    payment, interest, months = _simulate(520000, 6.2, 30)
+    assert abs(payment - 3184.84) < 0.01 and months == 360
+    result = calculate(loan_amount=520000, annual_rate_percent=6.2, term_years=30)
+    assert abs(result["total_interest"] - interest) < 1
+    grid = pi_repayment(np.array([[500000], [600000]]), np.array([5.8, 6.2, 6.6]), 30)
+    assert grid.shape == (2, 3) and np.all(np.diff(grid, axis=1) > 0)
+    print(f"✅ 月供 AUD {payment:,.2f}，总利息 AUD {interest:,.0f}")
+
+
+def test_loan_amount_lvr_and_offset():
+    """首付比例/补助、LVR 与对冲账户节省"""
+    assert float(loan_amount(800000, deposit_percent=20, grants=10000)) == 630000
+    assert float(lvr(640000, 800000)) == 80.0
+    _, base_interest, _ = _simulate(640000, 6.2, 30)
+    _, offset_interest, months = _simulate(640000, 6.2, 30, offset=50000)
+    saved = offset_savings(640000, 6.2, 30, 50000)
+    assert abs(float(saved["interest_saved"]) - (base_interest - offset_interest)) < 50
+    assert abs(float(saved["periods_saved"]) - (360 - months)) < 1
+    print(f"✅ 对冲 AUD 50,000 节省利息 AUD {float(saved['interest_saved']):,.0f}")
+
+
+def test_tool_call_round_trip():
+    """工具以 JSON 收发；参数错误以 error 字段回传"""
+    out = json.loads(run_tool_call("mortgage_calculator", json.dumps({
+        "property_price": 800000, "deposit_percent": 20, "annual_rate_percent": 6.2,
+        "term_years": 30, "repayment_type": "interest_only",
+    })))
+    assert out["loan_amount"] == 640000 and out["lvr_percent"] == 80 and out["io_repayment"] == 3306.67
+    assert "error" in json.loads(run_tool_call("mortgage_calculator", "{}"))
+    base = {"property_price": 800000, "deposit_percent": 20, "annual_rate_percent": 6.0, "term_years": 30}
+    for bad in ({"term_years": 0}, {"deposit_percent": 120}, {"deposit_percent": -5}, {"property_price": 0},
+                {"annual_rate_percent": -1}, {"deposit_amount": 900000, "deposit_percent": None},
+                {"interest_only_years": 40}, {"term_years": float("nan")}):
+        out_bad = json.loads(run_tool_call("mortgage_calculator", json.dumps({**base, **bad})))
+        assert "error" in out_bad, bad
+    print(f"✅ 工具输出：{out}")
+
+
+def test_scenario_grid_and_schedule():
+    """情景网格覆盖完整笛卡尔积；还款计划与总利息一致"""
+    rates = parse_values("5.8-6.6:0.2")
+    assert rates == [5.8, 6.0, 6.2, 6.4, 6.6]
+    grid = scenario_grid([800000], parse_values("10,20"), rates, [25, 30], REPAYMENT_TYPES)
+    assert len(grid["repayment"]) == 1 * 2 * 5 * 2 * 2
+    row = int(np.flatnonzero(
+        (grid["deposit_percent"] == 20) & (grid["annual_rate_percent"] == 6.2)
+        & (grid["term_years"] == 30) & (grid["repayment_type"] == "principal_and_interest")
+    )[0])
+    assert abs(grid["repayment"][row] - 3919.80) < 0.01
+
+    schedule = amortisation_schedule(520000, 6.2, 30, interest_only_years=5)
+    assert len(schedule["period"]) == 360 and schedule["balance"][-1] == 0
+    assert abs(schedule["interest"].sum() - float(total_interest(520000, 6.2, 30, 12, 5))) < 0.01
+    yearly = amortisation_schedule(520000, 6.2, 30, yearly=True)
+    assert len(yearly["year"]) == 30 and abs(yearly["principal"].sum() - 520000) < 0.01
+    print(f"✅ 情景网格 {len(grid['repayment'])} 个单元格，还款计划 360 期")
+
+
+def test_scenario_inputs_validated():
+    """期限为 0、首付越界、负利率或房价非正时抛出 ValueError，而不是崩溃或给出矛盾结果"""
+    bad_grids = (
+        ([800000], [20], [6.0], [0]),
+        ([800000], [100], [6.0], [30]),
+        ([800000], [-5], [6.0], [30]),
+        ([800000], [20], [-1.0], [30]),
+        ([0], [20], [6.0], [30]),
+    )
+    for prices, deposits, rates, terms in bad_grids:
+        try:
+            scenario_grid(prices, deposits, rates, terms)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {prices, deposits, rates, terms}")
+    for args in ((640000, 6.0, 0.0), (640000, -1.0, 30), (0, 6.0, 30)):
+        try:
+            amortisation_schedule(*args)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {args}")
+    try:
+        parse_values("nan, 30")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("accepted nan")
+    print("✅ 情景输入越界时报错")
+
+
+if __name__ == "__main__":
+    test_repayment_matches_simulation()
+    test_loan_amount_lvr_and_offset()
+    test_tool_call_round_trip()
+    test_scenario_grid_and_schedule()
+    test_scenario_inputs_validated()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试重试退避与限流器（无需 API Key）
+"""
+import os
+import time
+from mock_openai_server import MockOptions, start_mock_server
+from utils.rate_limit import (
+    TokenBucketLimiter,
+    parse_reset_duration,
+    retry_after_seconds,
+    retry_delay,
+)
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def test_parse_reset_duration():
+    """解析 OpenAI x-ratelimit-reset-* 时长格式"""
+    assert parse_reset_duration("1s") == 1.0
+    assert parse_reset_duration("6m0s") == 360.0
+    assert abs(parse_reset_duration("20ms") - 0.02) < 1e-9
+    assert parse_reset_duration("") is None
+    print("✅ 重置时长解析正确")
+
+
+def test_retry_delay_honours_server_hint():
+    """有 Retry-After 时不早于提示重试；无提示时使用 full jitter 上界"""
+    assert retry_after_seconds({"retry-after": "2"}) == 2.0
+    assert retry_delay(1, {"retry-after": "2"}, base=0.5, cap=20) >= 2.0
+    for attempt in range(1, 6):
+        assert 0 <= retry_delay(attempt, None, base=0.5, cap=4) <= 4
+    print("✅ 退避时间符合预期")
+
+
+def test_limiter_learns_from_headers():
+    """根据剩余配额把请求摊到重置窗口内"""
+    limiter = TokenBucketLimiter(burst=1)
+    limiter.observe({"x-ratelimit-remaining-requests": "10", "x-ratelimit-reset-requests": "1s"})
+    start = time.time()
+    for _ in range(3):
+        assert limiter.acquire(timeout=2)
+    elapsed = time.time() - start
+    print(f"⏱️ 3 次请求耗时 {elapsed:.2f}s（速率 {limiter.rate:.1f}/s）")
+    assert elapsed >= 0.15
+
+
+def test_bucket_refills_at_learned_rate():
+    """令牌按学到的速率补充、不超过 burst；429 惩罚期内不发放令牌（显式时间戳，结果确定）"""
+    limiter = TokenBucketLimiter(burst=3)
+    limiter.rate = 10.0
+    limiter.tokens = 0.0
+    t0 = limiter._last
+    limiter._refill(t0 + 0.05)
+    assert abs(limiter.tokens - 0.5) < 1e-9
+    limiter._refill(t0 + 0.15)
+    assert abs(limiter.tokens - 1.5) < 1e-9
+    limiter._refill(t0 + 10)
+    assert limiter.tokens == 3.0
+
+    limiter.penalize(0.2)
+    assert limiter.tokens == 0.0
+    assert not limiter.acquire(timeout=0.1)
+    assert limiter.acquire(timeout=1)
+    print("✅ 令牌桶按速率补充，惩罚期后恢复发放")
+
+
+def test_limiter_learns_from_mock_server_quota():
+    """模拟服务按 rpm 返回 x-ratelimit-* 头，客户端据此学到速率且未触发 429"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5, rpm=600))
+    try:
+        client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+        client.response_cache = None
+        client.rate_limiter = TokenBucketLimiter(burst=5)
+        for i in range(5):
+            client.generate_response([{"role": "user", "content": f"限流测试 {i}"}])
+        assert stats.rejected_429 == 0 and stats.requests == 5
+        # 剩余 595 次 / 约 60 秒窗口 ≈ 10 次/秒
+        assert 5 < client.rate_limiter.rate < 15
+        print(f"✅ 学到的速率 {client.rate_limiter.rate:.1f}/s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_parse_reset_duration()
+    test_retry_delay_honours_server_hint()
+    test_limiter_learns_from_headers()
+    test_bucket_refills_at_learned_rate()
+    test_limiter_learns_from_mock_server_quota()
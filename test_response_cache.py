@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试回答缓存（内存 LRU + SQLite 持久层，无需 API Key）
+"""
+import os
+import tempfile
+import time
+from utils.response_cache import ResponseCache, make_cache_key
+
+
+def test_cache_key_normalisation():
+    """空白差异不影响缓存键；搜索/推理/工具开关会区分缓存键"""
+    a = [{"role": "user", "content": "固定利率房贷有什么特点？"}]
+    b = [{"role": "user", "content": "  固定利率房贷有什么特点？\n", "ts": "2024-01-01"}]
+    key_a = make_cache_key(a, "gpt-5-mini", "openai")
+    assert key_a == make_cache_key(b, "gpt-5-mini", "openai")
+    assert key_a != make_cache_key(a, "gpt-5-mini", "openai", use_web_search=True)
+    assert key_a != make_cache_key(a, "gpt-5-mini", "openai", reasoning=True)
+    assert key_a != make_cache_key(a, "gpt-5-mini", "openai", use_tools=True)
+    print("✅ 缓存键规范化正确")
+
+
+def test_memory_and_disk_tiers():
+    """内存命中、过期失效以及重启后从 SQLite 命中"""
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+    cache = ResponseCache(path=path, max_items=2, default_ttl=60, search_ttl=1)
+    cache.set("k1", "回答一")
+    assert cache.get("k1") == "回答一"
+    cache.set("k2", "联网回答", ttl=cache.ttl_for(True))
+    time.sleep(1.1)
+    assert cache.get("k2") is None
+
+    reopened = ResponseCache(path=path, max_items=2, default_ttl=60)
+    assert reopened.get("k1") == "回答一"
+    stats = reopened.stats()
+    print(f"📊 缓存统计: {stats}")
+    assert stats["disk_hits"] == 1
+
+
+if __name__ == "__main__":
+    test_cache_key_normalisation()
+    test_memory_and_disk_tiers()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试回答富文本分段解析与缓存
+"""
+import time
+
+from utils.rich_text import IncrementalRichText, parse_rich_text
+
+
+def test_segments():
+    """```latex``` 围栏与 $$...$$ 解析为公式，Markdown 中的 $ 替换为 AUD"""
+    text = "月供约 $3,185。\n$$M = P \\frac{r}{1-(1+r)^{-n}}$$\n说明\n```latex\nLVR = L / V\n```\n未闭合 $$ x"
+    segments = parse_rich_text(text)
+    assert segments == (
+        ("md", "月供约 AUD3,185。\n"),
+        ("latex", "M = P \\frac{r}{1-(1+r)^{-n}}"),
+        ("md", "\n说明\n"),
+        ("latex", "LVR = L / V"),
+        ("md", "\n未闭合 AUDAUD x"),
+    )
+    assert parse_rich_text("") == ()
+
+
+def test_history_rerender_is_cached():
+    """同一内容重复解析直接命中缓存"""
+    history = [f"第 {i} 轮：贷款额 $500,000\n$$r = {i}\\%$$\n" * 20 for i in range(200)]
+    start = time.perf_counter()
+    first = [parse_rich_text(m) for m in history]
+    cold = time.perf_counter() - start
+    hits = parse_rich_text.cache_info().hits
+    start = time.perf_counter()
+    again = [parse_rich_text(m) for m in history]
+    warm = time.perf_counter() - start
+    assert all(a is b for a, b in zip(first, again))
+    assert parse_rich_text.cache_info().hits - hits == len(history)
+    print(f"✅ 200 条历史：首次解析 {cold * 1000:.1f}ms，重跑 {warm * 1000:.2f}ms")
+
+
+def _merge_md(segments):
+    merged = []
+    for kind, text in segments:
+        if merged and kind == "md" and merged[-1][0] == "md":
+            merged[-1] = ("md", merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+    return tuple(merged)
+
+
+def _render(rich):
+    """界面实际渲染的内容：已提交分段 + 尾部。"""
+    return _merge_md(rich.segments + list(rich.tail()))
+
+
+def test_incremental_matches_full_parse():
+    """任意切分的流式增量：提交的分段不回退，全部到达后与整段解析一致（相邻 Markdown 合并后）"""
+    text = "月供约 $3,185。\n$$M = P \\frac{r}{1-(1+r)^{-n}}$$\n说明\n\n第二段\n```latex\nLVR = L / V\n```\n```python\nx = 1\n\ny = 2\n```\n结束"
+    for size in range(1, 12):
+        rich = IncrementalRichText()
+        committed = []
+        for i in range(0, len(text), size):
+            rich.feed(text[i : i + size])
+            assert rich.segments[: len(committed)] == committed
+            committed = list(rich.segments)
+        assert _render(rich) == parse_rich_text(text)
+
+
+def test_incremental_open_formula_is_pending():
+    """未闭合的公式以 pending 显示，不会先按 Markdown 渲染；半个定界符暂不显示"""
+    rich = IncrementalRichText()
+    rich.feed("利率 $")
+    assert rich.tail() == (("md", "利率 "),)
+    rich.feed("$r = 6")
+    assert rich.segments == [("md", "利率 ")] and rich.tail() == (("pending", "r = 6"),)
+    rich.feed(".2\\%$$ 完")
+    assert rich.segments[-1] == ("latex", "r = 6.2\\%") and rich.tail() == (("md", " 完"),)
+
+
+def test_incremental_streaming_is_linear():
+    """长回答逐字流入：未提交的尾部长度有上界（不随回答变长），每段只提交一次"""
+    paragraph = "固定利率在锁定期内月供不变，贷款额 $500,000。\n$$r = 6.2\\%$$\n\n"
+    text = paragraph * 400
+    rich = IncrementalRichText()
+    peak = 0
+    for i in range(0, len(text), 8):
+        rich.feed(text[i : i + 8])
+        rich.tail()
+        peak = max(peak, rich.pending_chars)
+    assert peak <= len(paragraph)
+    assert len(rich.segments) == 3 * 400 and rich.pending_chars == 0
+    assert _render(rich) == parse_rich_text(text)
+    print(f"✅ {len(text)} 字流式解析：尾部峰值 {peak} 字，提交 {len(rich.segments)} 段")
+
+
+if __name__ == "__main__":
+    test_segments()
+    test_history_rerender_is_cached()
+    test_incremental_matches_full_parse()
+    test_incremental_open_formula_is_pending()
+    test_incremental_streaming_is_linear()
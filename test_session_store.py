@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+测试会话换出与恢复（临时 SQLite，假客户端，无需 API Key）
+"""
+import os
+import tempfile
+import threading
+import time
+
+from utils.broker_logic import AustralianMortgageBroker
+from utils.session_store import SessionManager
+
+
+class FakeClient:
+    provider = "openai"
+    model = "fake"
+
+    def generate_response(self, messages, max_tokens=1500, **kwargs):
+        return "好的。"
+
+
+def _manager(path: str, **kwargs) -> SessionManager:
+    return SessionManager(lambda: AustralianMortgageBroker(api_client=FakeClient()), path=path, **kwargs)
+
+
+def test_lru_spill_and_rehydrate():
+    """超过活跃会话上限时换出最久未用的会话，再次访问时恢复历史、摘要与撤销状态"""
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = _manager(os.path.join(tmp, "sessions.sqlite3"), max_live=1, idle_seconds=3600)
+        with manager.lease("a") as broker:
+            broker.generate_response("我的年收入是 AUD 150,000")
+            broker.generate_response("首付需要多少？")
+            broker.summarizer.summary = "- 年收入 AUD 150,000"
+        with manager.lease("b") as other:
+            # a 不再被持有，b 接入后 a 被换出
+            other.generate_response("固定利率有什么特点？")
+        assert manager.stats()["live_sessions"] == 1 and manager.spilled == 1
+
+        with manager.lease("a") as restored:
+            assert restored is not broker
+            assert [t.content for t in restored.store][:1] == ["我的年收入是 AUD 150,000"]
+            assert len(restored.store) == 4 and len(restored.conversation_history) == 4
+            assert restored.summarizer.summary == "- 年收入 AUD 150,000"
+            assert restored.undo_last() and len(restored.conversation_history) == 2
+        assert manager.rehydrated == 1
+
+        # 进程重启后同样可以恢复（b 已被换出）
+        fresh = _manager(os.path.join(tmp, "sessions.sqlite3"), max_live=10)
+        with fresh.lease("b") as b:
+            assert [t.role for t in b.store] == ["user", "assistant"]
+        print(f"✅ 会话换出/恢复：{manager.stats()}")
+
+
+def test_leased_session_not_spilled():
+    """正在运行的会话即使空闲超时也不会被换出"""
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = _manager(os.path.join(tmp, "sessions.sqlite3"), idle_seconds=0)
+        with manager.lease("a") as broker:
+            broker.generate_response("问题")
+            manager.spill_idle()
+            assert manager.stats()["live_sessions"] == 1
+        assert manager.stats()["live_sessions"] == 0 and manager.spilled == 1
+
+
+def test_loading_does_not_block_other_sessions():
+    """某个会话加载（构建 broker / 读盘）期间，其他会话照常可用；同一会话的并发访问等待加载完成"""
+    with tempfile.TemporaryDirectory() as tmp:
+        gate = threading.Event()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) == 2:
+                gate.wait(5)  # 第二个会话的加载被卡住
+            return AustralianMortgageBroker(api_client=FakeClient())
+
+        manager = SessionManager(factory, path=os.path.join(tmp, "sessions.sqlite3"), sweep_seconds=0)
+        with manager.lease("a") as a:
+            a.generate_response("问题")
+        brokers = []
+        slow = [threading.Thread(target=lambda: brokers.append(manager.lease("b").__enter__())) for _ in range(2)]
+        for t in slow:
+            t.start()
+        time.sleep(0.1)
+        start = time.time()
+        with manager.lease("a") as again:
+            assert again is a
+        assert time.time() - start < 0.5
+        gate.set()
+        for t in slow:
+            t.join(5)
+        assert len(calls) == 2 and brokers[0] is brokers[1]
+
+
+def test_idle_sessions_swept_in_background():
+    """空闲会话由后台清扫线程换出，不依赖其他会话的访问"""
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = _manager(os.path.join(tmp, "sessions.sqlite3"), idle_seconds=0.1, sweep_seconds=0.05)
+        with manager.lease("a") as broker:
+            broker.generate_response("问题")
+        deadline = time.time() + 2
+        while manager.spilled == 0 and time.time() < deadline:
+            time.sleep(0.02)
+        assert manager.spilled == 1 and manager.stats()["live_sessions"] == 0
+
+
+if __name__ == "__main__":
+    test_lru_spill_and_rehydrate()
+    test_leased_session_not_spilled()
+    test_loading_does_not_block_other_sessions()
+    test_idle_sessions_swept_in_background()
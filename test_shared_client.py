@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+测试进程级共享客户端与连接池（本地模拟服务，无需 API Key）
+"""
+import os
+import threading
+
+from mock_openai_server import MockOptions, start_mock_server
+from utils.broker_logic import AustralianMortgageBroker
+from utils.unified_client import UnifiedAIClient, get_shared_client
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def test_sessions_share_one_client():
+    """多个 Broker（对应多个 Streamlit 会话）复用同一客户端与 HTTP 连接池，对话历史互不影响"""
+    client = get_shared_client("gpt-4o-mini", "openai")
+    assert get_shared_client("gpt-4o-mini", "openai") is client
+    a, b = AustralianMortgageBroker(), AustralianMortgageBroker()
+    assert a.api_client is b.api_client
+    assert a.store is not b.store
+    print("✅ 会话共享客户端，各自持有对话记录")
+
+
+def test_concurrent_callers_keep_own_metrics_and_reuse_connections():
+    """并发线程共用一个客户端：各线程的 last_metrics 独立，复用已建立的长连接"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=20))
+    try:
+        client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+        client.response_cache = None
+        seen = {}
+
+        def _session(i: int) -> None:
+            client.generate_response([{"role": "user", "content": f"共享客户端会话 {i}"}])
+            seen[i] = client.last_metrics
+
+        threads = [threading.Thread(target=_session, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert stats.requests == 4
+        assert len({id(m) for m in seen.values()}) == 4
+        assert all(m.status == "ok" for m in seen.values())
+
+        # 连接池中已有空闲连接，后续请求不再新建 TCP 连接
+        client.generate_response([{"role": "user", "content": "共享客户端复用连接"}])
+        assert client.last_metrics.connect_ms == 0
+        print("✅ 并发调用指标互不干扰，长连接被复用")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_sessions_share_one_client()
+    test_concurrent_callers_keep_own_metrics_and_reuse_connections()
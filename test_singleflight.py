@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试相同请求的合并（本地模拟服务，无需 API Key）
+"""
+import os
+import threading
+import time
+
+from mock_openai_server import MockOptions, start_mock_server
+from utils.cancellation import CancelToken, GenerationCancelled, cancel_scope
+from utils.unified_client import UnifiedAIClient
+
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+def _client(base_url: str) -> UnifiedAIClient:
+    client = UnifiedAIClient(model="gpt-4o-mini", provider="openai", base_url=base_url)
+    client.response_cache = None  # 只验证进行中请求的合并
+    return client
+
+
+def _messages(tag: str):
+    return [{"role": "user", "content": f"固定利率与浮动利率怎么选？({tag})"}]
+
+
+def test_followers_share_leader_result():
+    """并发的相同请求只打一次上游"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=300, jitter_ms=0))
+    try:
+        client = _client(base_url)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.generate_response(_messages("share"))))
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(results)) == 1 and stats.requests == 1
+        print(f"✅ 4 个并发请求合并为 {stats.requests} 次上游调用")
+    finally:
+        server.shutdown()
+
+
+def test_follower_retries_when_leader_cancelled():
+    """leader 被取消时，follower 不收到取消/错误，而是自行请求上游"""
+    server, base_url, stats = start_mock_server(options=MockOptions(latency_ms=5, ttft_ms=600, jitter_ms=0, chunk_delay_ms=1))
+    try:
+        client = _client(base_url)
+        token = CancelToken()
+        outcome = {}
+
+        def leader():
+            try:
+                with cancel_scope(token):
+                    outcome["leader"] = "".join(client.generate_response(_messages("abort"), stream=True))
+            except GenerationCancelled:
+                outcome["leader"] = "cancelled"
+
+        def follower():
+            try:
+                outcome["follower"] = client.generate_response(_messages("abort"))
+            except Exception as exc:  # 不应发生
+                outcome["follower"] = exc
+
+        t1 = threading.Thread(target=leader)
+        t1.start()
+        time.sleep(0.2)
+        t2 = threading.Thread(target=follower)
+        t2.start()
+        time.sleep(0.1)
+        assert client._inflight.coalesced == 1
+        token.cancel()
+        t1.join(5)
+        t2.join(5)
+        assert outcome["leader"] == "cancelled"
+        assert isinstance(outcome["follower"], str) and outcome["follower"]
+        assert stats.requests == 2
+        print("✅ leader 取消后 follower 自行完成请求")
+    finally:
+        server.shutdown()
+
+
+def test_cancelled_follower_stops_waiting():
+    """合并等待中的 follower 被取消时立即返回，不等 leader 完成"""
+    server, base_url, _ = start_mock_server(options=MockOptions(latency_ms=2000, jitter_ms=0))
+    try:
+        client = _client(base_url)
+        leader = threading.Thread(target=lambda: client.generate_response(_messages("wait")))
+        leader.start()
+        time.sleep(0.2)
+        token = CancelToken()
+        timer = threading.Timer(0.2, token.cancel)
+        timer.start()
+        start = time.time()
+        try:
+            with cancel_scope(token):
+                client.generate_response(_messages("wait"))
+            raise AssertionError("follower should be cancelled")
+        except GenerationCancelled:
+            elapsed = time.time() - start
+        assert elapsed < 1.0
+        leader.join(5)
+        print(f"✅ 等待中的 follower 取消耗时 {elapsed * 1000:.0f}ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_followers_share_leader_result()
+    test_follower_retries_when_leader_cancelled()
+    test_cancelled_follower_stops_waiting()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+测试系统提示编译缓存（无需 API Key）
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import utils.broker_logic as broker_logic
+from utils.broker_logic import AustralianMortgageBroker, _load_prompt
+
+
+class FakeClient:
+    provider = "openai"
+    model = "fake"
+
+    def generate_response(self, messages, max_tokens=1500, **kwargs):
+        return "好的。"
+
+
+def test_prompt_memoised_until_file_changes():
+    """提示文件未变时复用同一编译结果；两种模式共用前缀；文件 mtime 变化后重新编译"""
+    original = broker_logic._PROMPT_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "broker_system.en.md"
+        path.write_text("You are a mortgage broker.\nOutput strictly in two sections:\n1. A\n2. B\n", encoding="utf-8")
+        broker_logic._PROMPT_PATH = path
+        broker_logic._PROMPT_CACHE.clear()
+        try:
+            plain = _load_prompt(False)
+            assert _load_prompt(False) is plain
+            reasoning = _load_prompt(True)
+            assert reasoning.startswith(plain) and reasoning != plain
+
+            broker = AustralianMortgageBroker(api_client=FakeClient())
+            assert broker._build_messages("你好", reasoning=False)[0]["content"] is plain
+
+            path.write_text("You are a cautious mortgage broker.\n", encoding="utf-8")
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            updated = _load_prompt(False)
+            assert updated != plain and "cautious" in updated
+            print("✅ 系统提示按文件 mtime 失效重建")
+        finally:
+            broker_logic._PROMPT_PATH = original
+            broker_logic._PROMPT_CACHE.clear()
+
+
+if __name__ == "__main__":
+    test_prompt_memoised_until_file_changes()
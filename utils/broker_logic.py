@@ -1,51 +1,70 @@
-from utils.unified_client import UnifiedAIClient
+from utils.unified_client import UnifiedAIClient, get_shared_client
 from pathlib import Path
-from typing import List, Dict, Any
-import datetime as _dt
-from config import MODEL_NAME, MODEL_PROVIDER
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
+import threading
+from utils.cancellation import GenerationCancelled
+from utils.context_window import pack_messages
+from utils.conversation_store import ConversationStore
+from utils.conversation_summary import RollingSummarizer
+from utils.intent_router import RouteDecision, route_query
+from utils.metrics import METRICS, RequestMetrics
+from utils.mortgage_calc import calculate
+from config import INTENT_ROUTER_ENABLED, MODEL_NAME, MODEL_PROVIDER, MORTGAGE_TOOLS_ENABLED
 
 
-def _load_prompt(reasoning: bool = False) -> str:
-    """Load English system prompt, instruct output in Simplified Chinese.
-    If input is Chinese, model should internally translate to English for reasoning
-    (do not display translation) and then respond in Simplified Chinese.
-    """
-    base = Path(__file__).resolve().parents[1] / "prompts"
-    path = base / "broker_system.en.md"
-
-    def _strip_structure(txt: str) -> str:
-        lines = txt.splitlines()
-        out = []
-        skip = 0
-        for i, ln in enumerate(lines):
-            if skip:
-                skip -= 1
-                continue
-            if "请严格按以下结构输出" in ln:
-                # 跳过提示与后续两行编号说明
-                skip = 3
-                continue
-            if ln.strip().lower().startswith("output strictly in two"):
-                skip = 3
-                continue
-            out.append(ln)
-        return "\n".join(out)
-
-    if path.exists():
-        txt = path.read_text(encoding="utf-8").strip()
-        # Always append unified language/output rules
-        rules = [
-            "Always produce the final answer in Simplified Chinese.",
-            "If the user input is in Chinese, first internally translate it to English for reasoning and web search; do not display the translation; only output the final answer in Simplified Chinese.",
-            "Currency formatting: always spell out 'AUD' and never use the dollar sign ($). Use thousands separators and consistent precision (e.g., AUD 520,000).",
-            "For mortgage calculations, define terms clearly: deposit (首付), loan amount (贷款额), interest rate (利率), term (年限).",
-            "If deposit is given as a percentage, loan amount = property price − (property price × deposit rate). If deposit is given as an amount, loan amount = property price − deposit. If applicable, deduct eligible government grants from loan amount and explain assumptions.",
-            "Validate consistency: if you compute monthly repayment, cross-check with the standard amortization formula and ensure text and numbers match.",
-            "Prefer clear text formulas and concise steps; if using math notation, keep it simple using block math ($$...$$) and avoid raw LaTeX code fences.",
-        ]
-        if not reasoning:
-            txt = _strip_structure(txt)
-        txt = f"{txt}\n\n" + "\n".join(rules)
+CANCELLED_NOTE = "\n\n（已取消 / Cancelled）"
+
+_PROMPT_PATH = Path(__file__).resolve().parents[1] / "prompts" / "broker_system.en.md"
+
+# Always append unified language/output rules
+_OUTPUT_RULES = (
+    "Always produce the final answer in Simplified Chinese.",
+    "If the user input is in Chinese, first internally translate it to English for reasoning and web search; do not display the translation; only output the final answer in Simplified Chinese.",
+    "Currency formatting: always spell out 'AUD' and never use the dollar sign ($). Use thousands separators and consistent precision (e.g., AUD 520,000).",
+    "For mortgage calculations, define terms clearly: deposit (首付), loan amount (贷款额), interest rate (利率), term (年限).",
+    "If deposit is given as a percentage, loan amount = property price − (property price × deposit rate). If deposit is given as an amount, loan amount = property price − deposit. If applicable, deduct eligible government grants from loan amount and explain assumptions.",
+    (
+        "For loan amount, LVR, repayments (P&I or interest-only), total interest or offset savings, call the mortgage_calculator tool and quote its figures; never compute these by hand."
+        if MORTGAGE_TOOLS_ENABLED
+        else "Validate consistency: if you compute monthly repayment, cross-check with the standard amortization formula and ensure text and numbers match."
+    ),
+    "Prefer clear text formulas and concise steps; if using math notation, keep it simple using block math ($$...$$) and avoid raw LaTeX code fences.",
+)
+
+# reasoning -> (提示文件 mtime, 编译后的提示)；文件未变时复用同一字符串，保证前缀字节稳定
+_PROMPT_CACHE: Dict[bool, Tuple[Optional[int], str]] = {}
+_PROMPT_LOCK = threading.Lock()
+
+
+def _split_structure(txt: str) -> Tuple[str, str]:
+    """拆出“两段式输出结构”说明，返回 (通用提示, 结构说明)。"""
+    lines = txt.splitlines()
+    out = []
+    structure = []
+    skip = 0
+    for i, ln in enumerate(lines):
+        if skip:
+            skip -= 1
+            structure.append(ln)
+            continue
+        if "请严格按以下结构输出" in ln or ln.strip().lower().startswith("output strictly in two"):
+            # 提示与后续两行编号说明
+            skip = 3
+            structure.append(ln)
+            continue
+        out.append(ln)
+    return "\n".join(out), "\n".join(structure).strip()
+
+
+def _compile_prompt(reasoning: bool) -> str:
+    # 两种模式共用同一前缀（提示正文 + 输出规则），推理模式仅在末尾追加结构说明，
+    # 使上游提示缓存能在模式之间复用
+    if _PROMPT_PATH.exists():
+        txt = _PROMPT_PATH.read_text(encoding="utf-8").strip()
+        common, structure = _split_structure(txt)
+        txt = f"{common}\n\n" + "\n".join(_OUTPUT_RULES)
+        if reasoning and structure:
+            txt = f"{txt}\n\n{structure}"
         return txt
 
     # Fallback minimal prompt (Chinese)
@@ -59,6 +78,28 @@ def _load_prompt(reasoning: bool = False) -> str:
     return base
 
 
+def _load_prompt(reasoning: bool = False) -> str:
+    """Load English system prompt, instruct output in Simplified Chinese.
+    If input is Chinese, model should internally translate to English for reasoning
+    (do not display translation) and then respond in Simplified Chinese.
+
+    Compiled variants are cached in process and rebuilt only when the prompt file's mtime changes.
+    """
+    try:
+        mtime: Optional[int] = _PROMPT_PATH.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    cached = _PROMPT_CACHE.get(reasoning)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _PROMPT_LOCK:
+        cached = _PROMPT_CACHE.get(reasoning)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, _compile_prompt(reasoning))
+            _PROMPT_CACHE[reasoning] = cached
+        return cached[1]
+
+
 def _detect_language(text: str) -> str:
     """极简语言检测：含中文字符则判为中文，否则英文。"""
     for ch in text:
@@ -67,34 +108,154 @@ def _detect_language(text: str) -> str:
     return "English"
 
 
+def _aud(value: float) -> str:
+    return f"AUD {value:,.2f}"
+
+
+def _with_reasoning_fallback(content: str, reasoning: bool) -> str:
+    """仅在推理模式下兜底输出“推理过程”；普通模式不展示推理过程。"""
+    if not reasoning or ("推理过程" in content and "结论" in content):
+        return content
+    return (
+        "推理过程（简要要点）：\n"
+        "- 根据提问内容进行政策与流程匹配\n"
+        "- 结合贷款目的、身份、收入与负债等\n"
+        "- 参考各贷方公开政策并提示差异\n"
+        "- 如信息不足，建议补充关键细节\n"
+        f"\n结论：\n{content}"
+    )
+
+
+def _format_calc_answer(result: Dict[str, Any]) -> str:
+    """本地计算结果的中文回答（与模型输出规则一致：AUD、千分位、统一精度）。"""
+    freq = {"monthly": "每月", "fortnightly": "每两周", "weekly": "每周"}[result["frequency"]]
+    lines = ["结论：", f"- 贷款额：{_aud(result['loan_amount'])}"]
+    if "lvr_percent" in result:
+        lines.append(f"- LVR（贷款价值比）：{result['lvr_percent']:.1f}%")
+    if "io_repayment" in result:
+        lines.append(f"- 只还利息期（{result['interest_only_years']:g} 年）{freq}还款：{_aud(result['io_repayment'])}")
+        if "pi_repayment_after_io" in result:
+            lines.append(f"- 转为本息等额后{freq}还款：{_aud(result['pi_repayment_after_io'])}")
+    else:
+        lines.append(f"- 本息等额{freq}还款：{_aud(result['pi_repayment'])}")
+    lines.append(f"- 总利息：{_aud(result['total_interest'])}；总还款：{_aud(result['total_repayments'])}")
+    if "offset_interest_saved" in result:
+        lines.append(
+            f"- 对冲账户 {_aud(result['offset_balance'])} 可节省利息约 {_aud(result['offset_interest_saved'])}，"
+            f"提前约 {result['offset_periods_saved']:.0f} 期还清"
+        )
+    lines.append(
+        f"\n假设：年利率 {result['annual_rate_percent']:g}%，期限 {result['term_years']:g} 年，利率在整个期限内不变；"
+        "未计入费用、LMI 与利率变动。以上由本地计算器得出，如需贷款方案建议请继续提问。"
+    )
+    return "\n".join(lines)
+
+
 class AustralianMortgageBroker:
     """澳大利亚抵押贷款经纪人AI助手（OpenAI/Azure + 可选网络搜索）"""
 
-    def __init__(self):
-        self.api_client = UnifiedAIClient(model=MODEL_NAME, provider=MODEL_PROVIDER)
-        self.conversation_history = []
+    def __init__(self, api_client: Optional[UnifiedAIClient] = None):
+        # 默认复用进程级共享客户端；每个会话仅持有自己的对话历史
+        self.api_client = api_client or get_shared_client(MODEL_NAME, MODEL_PROVIDER)
+        # 会话唯一的对话记录：界面展示、导出与模型上下文共用
+        self.store = ConversationStore()
+        # 最近一次调用的结构化指标（延迟、token 用量、缓存命中等）
+        self.last_metrics = None
+        # 最近一次上下文装配统计（token 数、保留/丢弃的历史条数）
+        self.last_context = None
+        # 被挤出历史窗口的旧轮次在后台折叠为滚动摘要
+        self.summarizer = RollingSummarizer(self.api_client)
+        # 最近一次本地意图路由结果（calc / faq / model / model_search）
+        self.last_route: Optional[RouteDecision] = None
         # 内置网络搜索由模型侧（Responses API tools）处理；无需本地搜索客户端
 
     # 提供商固定为 OpenAI，此处无需名称映射
 
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        """当前历史窗口内的 API 消息（只读视图）。"""
+        return self.store.history
+
+    def clear_history(self) -> None:
+        """清空对话历史与滚动摘要（进行中的后台摘要结果将被丢弃）。"""
+        self.store.clear()
+        self.summarizer.reset()
+
+    def undo_last(self) -> bool:
+        """撤销最后一轮问答（同时移出模型上下文）。"""
+        return self.store.pop_exchange()
+
     def test_provider_connection(self):
         return self.api_client.test_connection()
 
-    def generate_response(self, user_input: str, reasoning: bool = False, use_web_search: bool = False, **kwargs) -> str:
-        """生成AI回复。仅推理模式展示“推理过程”，普通模式仅“结论”。"""
-
+    def _build_messages(self, user_input: str, reasoning: bool) -> List[Dict[str, Any]]:
         # 构建系统提示（英文提示 + 简体中文输出规则）
         system_prompt = _load_prompt(reasoning=reasoning)
 
-        # 构建消息列表
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # 添加历史对话（最近5轮）
-        for msg in self.conversation_history[-10:]:
-            messages.append(msg)
-        
-        # 添加当前用户输入（直接传递给模型；模型侧处理翻译/搜索）
-        messages.append({"role": "user", "content": user_input})
+        # 按输入 token 预算装配：系统提示 + 滚动摘要 + 尽量新的历史 + 当前用户输入
+        # （直接传递给模型；模型侧处理翻译/搜索）。摘要未就绪的已淘汰轮次以原文补在历史前
+        history = self.summarizer.unsummarized() + self.store.history
+        packed = pack_messages(
+            system_prompt,
+            history,
+            user_input,
+            prefix=self.summarizer.prefix_messages(),
+        )
+        self.last_context = packed
+        METRICS.observe("broker_context_input_tokens", packed.input_tokens)
+        return packed.messages
+
+    def build_request_messages(
+        self, user_input: str, reasoning: bool, decision: Optional[RouteDecision] = None
+    ) -> List[Dict[str, Any]]:
+        """本轮发送给模型的消息（术语问答用规范问题，其余按预算装配上下文）；批处理也使用。"""
+        if decision is not None and decision.route == "faq":
+            # 术语定义与对话上下文无关：使用规范问题，跨会话共享同一缓存回答
+            return [
+                {"role": "system", "content": _load_prompt(reasoning=reasoning)},
+                {"role": "user", "content": decision.faq_question},
+            ]
+        return self._build_messages(user_input, reasoning)
+
+    def _remember(self, user_input: str, response: str, in_context: bool = True) -> None:
+        """记录一轮问答；in_context=False 的轮次（如错误信息）只用于展示。"""
+        self.store.append("user", user_input, in_context)
+        self.store.append("assistant", response, in_context)
+
+        # 保持历史长度在合理范围内；超出部分交给后台折叠进摘要
+        self.summarizer.evict(self.store.evict_overflow(20))
+
+    def generate_response(
+        self,
+        user_input: str,
+        reasoning: bool = False,
+        use_web_search: bool = False,
+        stream: bool = False,
+        **kwargs,
+    ) -> Union[str, Iterator[str]]:
+        """生成AI回复。仅推理模式展示“推理过程”，普通模式仅“结论”。
+
+        stream=True 时返回文本增量生成器；流结束后才写入对话历史。
+        开启意图路由时：纯计算本地作答，术语问答改写为规范问题以命中共享缓存，
+        不需要时效信息的问题即使开启搜索也不使用搜索工具。
+        """
+        decision = None
+        if INTENT_ROUTER_ENABLED:
+            has_history = bool(self.store.history or self.summarizer.summary or self.summarizer.unsummarized())
+            decision = route_query(user_input, use_web_search, has_history=has_history)
+        self.last_route = decision
+        if decision is not None:
+            METRICS.inc("broker_route_total", (("route", decision.route),))
+            if decision.route == "calc":
+                answer = self.answer_locally(user_input, decision)
+                if answer is not None:
+                    return iter([answer]) if stream else answer
+                decision.route, decision.reason = "model", "calc fallback"
+            use_web_search = decision.route == "model_search"
+
+        messages = self.build_request_messages(user_input, reasoning, decision)
+        if stream:
+            return self._stream_reply(messages, user_input, reasoning, use_web_search)
         
         try:
             # 生成回复
@@ -102,33 +263,93 @@ class AustralianMortgageBroker:
                 messages=messages,
                 max_tokens=1500,
                 use_web_search=use_web_search,
+                reasoning=reasoning,
+                use_tools=MORTGAGE_TOOLS_ENABLED,
             )
-            
-            # 更新对话历史（带时间戳）
-            ts = _dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.conversation_history.append({"role": "user", "content": user_input, "ts": ts})
-            self.conversation_history.append({"role": "assistant", "content": response, "ts": ts})
-            
-            # 保持历史长度在合理范围内
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
-            
-            content = response.strip()
-            # 仅在推理模式下兜底输出“推理过程”；普通模式不展示推理过程
-            if reasoning:
-                if "推理过程" not in content or "结论" not in content:
-                    content = (
-                        "推理过程（简要要点）：\n"
-                        "- 根据提问内容进行政策与流程匹配\n"
-                        "- 结合贷款目的、身份、收入与负债等\n"
-                        "- 参考各贷方公开政策并提示差异\n"
-                        "- 如信息不足，建议补充关键细节\n"
-                        f"\n结论：\n{content}"
-                    )
+            self.last_metrics = getattr(self.api_client, "last_metrics", None)
+            self._observe_route()
+
+            # 记录与返回同一文本（含推理兜底段落），流式与非流式、换出恢复后保持一致
+            content = _with_reasoning_fallback(response.strip(), reasoning)
+            self._remember(user_input, content)
             # 参考来源由模型在开启搜索时自行在正文中引用（例如“参考资料/References”）
             return content
             
         except Exception as e:
-            return f"生成回复时出现错误: {str(e)}"
+            return self.record_failed_turn(user_input, error=e)
+
+    def _stream_reply(
+        self,
+        messages: List[Dict[str, Any]],
+        user_input: str,
+        reasoning: bool,
+        use_web_search: bool,
+    ) -> Iterator[str]:
+        """流式回复。
+
+        - 上游错误：已生成部分连同错误信息只作展示记录，随后重新抛出，由调用方提示错误；
+        - 推理模式兜底段落无法插到已输出的增量之前：流结束后在写入历史的回答中补上，
+          与非流式返回的内容一致（只在流式预览中不出现）。
+        """
+        chunks: List[str] = []
+        try:
+            for delta in self.api_client.generate_response(
+                messages=messages,
+                max_tokens=1500,
+                use_web_search=use_web_search,
+                reasoning=reasoning,
+                stream=True,
+                use_tools=MORTGAGE_TOOLS_ENABLED,
+            ):
+                chunks.append(delta)
+                yield delta
+        except GenerationCancelled:
+            self.last_metrics = getattr(self.api_client, "last_metrics", None)
+            self.record_failed_turn(user_input, "".join(chunks))
+            raise
+        except Exception as e:
+            self.last_metrics = getattr(self.api_client, "last_metrics", None)
+            self.record_failed_turn(user_input, "".join(chunks), error=e)
+            raise
+        self.last_metrics = getattr(self.api_client, "last_metrics", None)
+        self._observe_route()
+        self._remember(user_input, _with_reasoning_fallback("".join(chunks).strip(), reasoning))
+
+    def record_failed_turn(self, user_input: str, partial: str = "", error: Optional[BaseException] = None) -> str:
+        """记录未正常完成的一轮并返回记录的回答：已生成部分 + 错误信息（error 为 None 表示用户取消）。
+
+        这类轮次只用于展示，不进入模型上下文。
+        """
+        partial = partial.strip()
+        if error is None:
+            content = partial + CANCELLED_NOTE
+        else:
+            content = "\n\n".join(p for p in (partial, f"生成回复时出现错误: {error}") if p)
+        self._remember(user_input, content, in_context=False)
+        return content
+
+    def answer_locally(self, user_input: str, decision: RouteDecision) -> Optional[str]:
+        """纯计算问题：本地计算器作答并记入历史，不调用模型；参数异常时返回 None 交回模型。"""
+        metrics = RequestMetrics(provider="local", model="mortgage_calculator")
+        metrics.endpoint = "calc"
+        try:
+            answer = _format_calc_answer(calculate(**(decision.calc_args or {})))
+        except (TypeError, ValueError):
+            return None
+        metrics.mark_first_token()
+        METRICS.record(metrics.finish())
+        self.last_metrics = metrics
+        self._observe_route()
+        self._remember(user_input, answer)
+        return answer
+
+    def _observe_route(self) -> None:
+        """按路由统计端到端延迟，便于对比本地作答/跳过搜索节省的时间。"""
+        if self.last_route is not None and self.last_metrics is not None:
+            METRICS.observe(
+                "broker_route_latency_ms",
+                self.last_metrics.total_ms,
+                (("route", self.last_route.route),),
+            )
 
     # 内置搜索由模型处理；此处不再提供翻译或外部搜索辅助
@@ -0,0 +1,124 @@
+"""生成取消：后台生成任务持有 CancelToken，客户端在同一线程内登记当前的 HTTP 响应。
+
+取消时关闭该响应的套接字，阻塞中的读取立即返回；客户端随后抛出
+GenerationCancelled，不再重试或切换后端。等待响应头期间（非流式请求的大部分时间）
+由连接层通过 socket_scope 临时登记套接字。
+"""
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+
+class GenerationCancelled(BaseException):
+    """与 asyncio.CancelledError 一样继承 BaseException，不会被 except Exception 的重试、
+    故障转移与错误兜底逻辑吞掉。"""
+
+
+def _abort(resource: Any) -> None:
+    """尽力中断进行中的读取：先 shutdown 底层套接字（close 不会唤醒其他线程中阻塞的 recv），再关闭。"""
+    if isinstance(resource, socket.socket):
+        # 连接层登记的裸套接字：只 shutdown，由连接池丢弃该连接
+        try:
+            resource.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return
+    raw = getattr(resource, "raw", None)
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        # urllib3 2.x 流式响应：套接字挂在 http.client 响应的读缓冲之下
+        sock = getattr(getattr(getattr(getattr(raw, "_fp", None), "fp", None), "raw", None), "_sock", None)
+    if isinstance(sock, socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    close = getattr(resource, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class CancelToken:
+    """单个生成任务的取消标记；bind() 登记当前响应，cancel() 可从任意线程调用。"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._resource: Any = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._event.set()
+            resource, self._resource = self._resource, None
+        if resource is not None:
+            _abort(resource)
+
+    def bind(self, resource: Any) -> None:
+        with self._lock:
+            if not self._event.is_set():
+                self._resource = resource
+                return
+        _abort(resource)
+        raise GenerationCancelled()
+
+    def release(self, resource: Any) -> None:
+        """撤销登记（仅当仍是该资源时），避免取消误伤已归还连接池的连接。"""
+        with self._lock:
+            if self._resource is resource:
+                self._resource = None
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise GenerationCancelled()
+
+
+_local = threading.local()
+
+
+def current_token() -> Optional[CancelToken]:
+    return getattr(_local, "token", None)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken) -> Iterator[CancelToken]:
+    """在当前线程内启用取消标记（客户端通过 check_cancelled/bind_response 使用）。"""
+    previous = current_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def check_cancelled() -> None:
+    token = current_token()
+    if token is not None:
+        token.check()
+
+
+def bind_response(resource: Any) -> None:
+    token = current_token()
+    if token is not None:
+        token.bind(resource)
+
+
+@contextmanager
+def socket_scope(sock: Any) -> Iterator[None]:
+    """在等待响应期间登记套接字（无取消标记时不做任何事）。"""
+    token = current_token()
+    if token is None or sock is None:
+        yield
+        return
+    token.bind(sock)
+    try:
+        yield
+    finally:
+        token.release(sock)
@@ -0,0 +1,131 @@
+"""按 token 预算装配对话上下文。
+
+系统提示与本轮输入始终保留；历史消息从最新往最旧装入，超出预算时
+最旧的消息先被丢弃，处于边界的那条消息会被截断以用满剩余预算。
+计数优先使用 tiktoken（requirements.txt 已包含）；未安装或编码文件无法加载时
+退回针对中英混排的保守估算（宁可多算），此时预算只是近似值。
+"""
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config import CONTEXT_INPUT_TOKEN_BUDGET, CONTEXT_MIN_TRIM_TOKENS
+
+try:  # 可选依赖：安装后计数与 OpenAI 服务端一致
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # pragma: no cover - 取决于运行环境
+    _ENCODING = None
+
+# 每条消息的结构开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_TRIM_MARK = "…（早前内容已截断）"
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """估算文本 token 数（结果按内容缓存，历史消息重复计数几乎零成本）。"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    # 保守估算：中日韩字符按 1 token/字（o200k 实际多在 0.7～1 之间）；其余按 3 字符/token，
+    # 英文正文约 4 字符/token，数字与标点较密，取 3 以免混排文本超出预算
+    return cjk + math.ceil((len(text) - cjk) / 3)
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(str(message.get("content") or ""))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "tail") -> str:
+    """截断到不超过 max_tokens；keep="tail" 保留结尾（离当前问题最近的部分）。"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max(0, max_tokens - count_tokens(_TRIM_MARK))
+    lo, hi = 0, len(text)
+    # 二分查找能放下的最长片段
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        piece = text[-mid:] if keep == "tail" else text[:mid]
+        if count_tokens(piece) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    if lo == 0:
+        return ""
+    return _TRIM_MARK + text[-lo:] if keep == "tail" else text[:lo] + _TRIM_MARK
+
+
+class PackedContext:
+    """装配结果：API 消息列表与装配统计。"""
+
+    __slots__ = ("messages", "input_tokens", "budget", "history_kept", "history_dropped", "trimmed")
+
+    def __init__(self, messages, input_tokens, budget, history_kept, history_dropped, trimmed):
+        self.messages: List[Dict[str, Any]] = messages
+        self.input_tokens: int = input_tokens
+        self.budget: int = budget
+        self.history_kept: int = history_kept
+        self.history_dropped: int = history_dropped
+        self.trimmed: bool = trimmed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "input_tokens": self.input_tokens,
+            "budget": self.budget,
+            "history_kept": self.history_kept,
+            "history_dropped": self.history_dropped,
+            "trimmed": self.trimmed,
+        }
+
+
+def pack_messages(
+    system_prompt: str,
+    history: List[Dict[str, Any]],
+    user_input: str,
+    budget: Optional[int] = None,
+    min_trim_tokens: int = CONTEXT_MIN_TRIM_TOKENS,
+    prefix: Optional[List[Dict[str, Any]]] = None,
+) -> PackedContext:
+    """在 budget 内装配 [system, *prefix, *history(尽量新), user]。
+
+    prefix 为紧随系统提示、始终保留的附加消息（如会话摘要）。
+    """
+    budget = CONTEXT_INPUT_TOKEN_BUDGET if budget is None else budget
+    head = [{"role": "system", "content": system_prompt}] + list(prefix or [])
+    tail = {"role": "user", "content": user_input}
+    used = sum(count_message_tokens(m) for m in head) + count_message_tokens(tail)
+
+    kept: List[Dict[str, Any]] = []
+    trimmed = False
+    for msg in reversed(history):
+        cost = count_message_tokens(msg)
+        remaining = budget - used
+        if cost <= remaining:
+            kept.append(msg)
+            used += cost
+            continue
+        # 边界消息：剩余预算足够时截断保留，否则停止（更旧的全部丢弃）
+        room = remaining - MESSAGE_OVERHEAD_TOKENS
+        if room >= min_trim_tokens:
+            content = truncate_to_tokens(str(msg.get("content") or ""), room)
+            if content:
+                kept.append({"role": msg.get("role") or "user", "content": content})
+                used += count_message_tokens(kept[-1])
+                trimmed = True
+        break
+    kept.reverse()
+    dropped = len(history) - len(kept)
+    return PackedContext(
+        messages=head + kept + [tail],
+        input_tokens=used,
+        budget=budget,
+        history_kept=len(kept),
+        history_dropped=dropped,
+        trimmed=trimmed,
+    )
@@ -0,0 +1,101 @@
+"""会话对话存储：每个会话只保存一份对话记录，供界面展示、导出与模型上下文共用。
+
+- Turn 使用 __slots__，时间戳存为浮点秒，展示/导出时再格式化；
+- 参与模型上下文的轮次在追加时即生成仅含 role/content 的 API 消息（与 Turn 共用同一
+  内容字符串），增量维护；被挤出历史窗口的消息移交滚动摘要后从该视图中移除；
+- 失败的回答只用于展示，不进入模型上下文。
+"""
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Turn:
+    """单条消息。"""
+
+    __slots__ = ("role", "content", "ts", "in_context", "meta")
+
+    def __init__(self, role: str, content: str, ts: Optional[float] = None, in_context: bool = True):
+        self.role = role
+        self.content = content
+        self.ts = time.time() if ts is None else ts
+        self.in_context = in_context
+        # 仅供展示的附加信息（如耗时/模型/路由），不导出、不落盘
+        self.meta: Optional[str] = None
+
+    @property
+    def ts_text(self) -> str:
+        return datetime.fromtimestamp(self.ts).strftime(TS_FORMAT)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "ts": self.ts_text}
+
+
+class ConversationStore:
+    """单个会话的全部消息 + 增量维护的 API 消息视图。"""
+
+    def __init__(self):
+        self.turns: List[Turn] = []
+        # 当前历史窗口内、可直接放入请求的 {"role", "content"} 消息（按时间顺序）
+        self.history: List[Dict[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(self.turns)
+
+    def append(self, role: str, content: str, in_context: bool = True, ts: Optional[float] = None) -> Turn:
+        turn = Turn(role, content, ts, in_context)
+        self.turns.append(turn)
+        if in_context:
+            self.history.append({"role": role, "content": content})
+        return turn
+
+    def evict_overflow(self, keep: int) -> List[Dict[str, str]]:
+        """历史窗口只保留最近 keep 条，返回被挤出的消息（交给滚动摘要）。"""
+        overflow = len(self.history) - keep
+        if overflow <= 0:
+            return []
+        evicted = self.history[:overflow]
+        del self.history[:overflow]
+        return evicted
+
+    def pop_exchange(self) -> bool:
+        """撤销最后一轮（最后一条用户消息及其后的回答）。"""
+        for i in range(len(self.turns) - 1, -1, -1):
+            if self.turns[i].role == "user":
+                break
+        else:
+            return False
+        for turn in self.turns[i:]:
+            if turn.in_context and self.history:
+                self.history.pop()
+        del self.turns[i:]
+        return True
+
+    def clear(self) -> None:
+        self.turns = []
+        self.history = []
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """导出格式（与旧版 session_state.messages 相同）。"""
+        return [turn.to_dict() for turn in self.turns]
+
+    def memory_report(self) -> Dict[str, Any]:
+        """估算本会话对话记录占用的内存（内容字符串只计一次）。"""
+        size = sys.getsizeof(self.turns) + sys.getsizeof(self.history)
+        content_bytes = 0
+        for turn in self.turns:
+            content_bytes += sys.getsizeof(turn.content)
+            size += sys.getsizeof(turn) + sys.getsizeof(turn.ts)
+        size += sum(sys.getsizeof(m) for m in self.history)
+        return {
+            "turns": len(self.turns),
+            "context_messages": len(self.history),
+            "content_bytes": content_bytes,
+            "approx_bytes": size + content_bytes,
+        }
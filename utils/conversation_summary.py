@@ -0,0 +1,151 @@
+"""会话滚动摘要：把被挤出历史窗口的旧轮次增量折叠进一条摘要消息。
+
+- 每个会话（broker 实例）持有一个 RollingSummarizer；
+- 只有新被淘汰的轮次参与摘要（旧摘要 + 新轮次 -> 新摘要），摘要长度固定可控；
+- 摘要在共享线程池中生成，不阻塞当前回答；尚未折叠的轮次仍以原文参与
+  上下文装配，因此摘要未就绪时不会丢失信息。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from config import SUMMARY_ENABLED, SUMMARY_MAX_PENDING, SUMMARY_MAX_TOKENS
+from utils.metrics import METRICS
+
+_SUMMARY_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="summary")
+
+_SUMMARY_INSTRUCTIONS = (
+    "You maintain a running memory of an Australian mortgage consultation.",
+    "Merge the previous summary with the new conversation turns into one updated summary.",
+    "Keep every concrete fact the user stated (income, deposit, property price, state/city, "
+    "residency, first-home-buyer status, loan purpose, debts, preferences) and key numbers or "
+    "conclusions already given; drop greetings and repeated explanations.",
+    "Write concise bullet points in Simplified Chinese, at most 12 bullets. Output the summary only.",
+)
+SUMMARY_PREFIX = "Summary of earlier conversation (facts stated by the user and conclusions so far):\n"
+
+
+def _format_turns(turns: List[Dict[str, Any]]) -> str:
+    lines = []
+    for msg in turns:
+        role = "User" if msg.get("role") == "user" else "Assistant"
+        lines.append(f"{role}: {str(msg.get('content') or '').strip()}")
+    return "\n".join(lines)
+
+
+class RollingSummarizer:
+    """单个会话的增量摘要器。"""
+
+    def __init__(self, api_client, enabled: bool = SUMMARY_ENABLED, max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.api_client = api_client
+        self.enabled = enabled
+        self.max_tokens = max_tokens
+        self.summary = ""
+        # 已淘汰、尚未折叠进摘要的消息（按时间顺序）
+        self.pending: List[Dict[str, Any]] = []
+        # 正在后台摘要的那一批消息
+        self._folding: List[Dict[str, Any]] = []
+        self.folded_messages = 0
+        self._lock = threading.Lock()
+        self._running = False
+        # reset() 时递增，丢弃清空前启动的后台摘要结果
+        self._epoch = 0
+
+    def evict(self, messages: List[Dict[str, Any]]) -> None:
+        """登记被挤出历史窗口的消息，并在后台触发摘要。"""
+        if not messages or not self.enabled:
+            return
+        with self._lock:
+            self.pending.extend(messages)
+            if len(self.pending) > SUMMARY_MAX_PENDING:
+                # 摘要持续失败时防止无限增长：丢弃最旧的原文
+                self.pending = self.pending[-SUMMARY_MAX_PENDING:]
+            if self._running:
+                # 正在摘要的任务结束后会继续处理新登记的消息
+                return
+            self._running = True
+        _SUMMARY_POOL.submit(self._run)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self._running = False
+                    return
+                batch, self.pending = self.pending, []
+                self._folding = batch
+                previous = self.summary
+                epoch = self._epoch
+            try:
+                updated = self._summarize(previous, batch)
+            except Exception:
+                METRICS.inc("summary_updates_total", (("status", "error"),))
+                with self._lock:
+                    if epoch == self._epoch:
+                        # 保留原文，待下次淘汰时重试
+                        self.pending = (batch + self.pending)[-SUMMARY_MAX_PENDING:]
+                    self._folding = []
+                    self._running = False
+                return
+            METRICS.inc("summary_updates_total", (("status", "ok"),))
+            with self._lock:
+                self._folding = []
+                if epoch == self._epoch:
+                    self.summary = updated
+                    self.folded_messages += len(batch)
+
+    def _summarize(self, previous: str, turns: List[Dict[str, Any]]) -> str:
+        body = f"Previous summary:\n{previous or '(none)'}\n\nNew turns:\n{_format_turns(turns)}"
+        messages = [
+            {"role": "system", "content": "\n".join(_SUMMARY_INSTRUCTIONS)},
+            {"role": "user", "content": body},
+        ]
+        # 摘要请求不写入回答缓存，并以独立的 purpose 标签计入指标，避免混入用户请求统计
+        text = self.api_client.generate_response(
+            messages=messages, max_tokens=self.max_tokens, use_cache=False, purpose="summary"
+        )
+        text = (text or "").strip()
+        if not text:
+            raise ValueError("empty summary")
+        return text
+
+    def prefix_messages(self) -> List[Dict[str, Any]]:
+        """摘要消息（紧随系统提示，始终保留）。"""
+        with self._lock:
+            summary = self.summary
+        if not summary:
+            return []
+        return [{"role": "system", "content": SUMMARY_PREFIX + summary}]
+
+    def unsummarized(self) -> List[Dict[str, Any]]:
+        """尚未折叠的已淘汰消息；装配上下文时排在历史之前。"""
+        with self._lock:
+            return self._folding + self.pending
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        """等待后台摘要完成（测试与离线脚本使用）。"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if not self._running:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.summary = ""
+            self.pending = []
+            self._folding = []
+            self.folded_messages = 0
+            self._epoch += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "summary_chars": len(self.summary),
+                "pending_messages": len(self._folding) + len(self.pending),
+                "folded_messages": self.folded_messages,
+            }
+
@@ -0,0 +1,176 @@
+"""对话导出：JSON（缩进 / 紧凑）/ JSONL / Markdown / PDF。
+
+导出只在用户点击下载时生成（st.download_button 的 data 回调），页面重跑时不再
+序列化对话、也不随每次交互下发文件内容。注意 Streamlit 会把回调结果整体读入
+内存后再发送，因此生成时完整文档仍会在内存中存在一次；各写出器逐条消息产出
+字节块，只是省去按格式拼接的中间字符串。
+PDF 使用阅读器内置的 STSong-Light 中文字体（UniGB-UCS2-H 编码，不嵌入字体），
+无需额外依赖。
+"""
+import json
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.conversation_store import Turn
+
+Chunks = Iterator[bytes]
+
+_ROLE_LABELS = {"user": "用户 / User", "assistant": "助手 / Assistant"}
+
+
+def iter_json(turns: Iterable[Turn]) -> Chunks:
+    """缩进 JSON 数组，与旧版导出（json.dumps(indent=2)）逐字节相同。"""
+    yield json.dumps([turn.to_dict() for turn in turns], ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def iter_json_compact(turns: Iterable[Turn]) -> Chunks:
+    """紧凑 JSON 数组（无缩进），字段与旧版导出相同。"""
+    yield b"["
+    for i, turn in enumerate(turns):
+        item = json.dumps(turn.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        yield (("," if i else "") + item).encode("utf-8")
+    yield b"]"
+
+
+def iter_jsonl(turns: Iterable[Turn]) -> Chunks:
+    for turn in turns:
+        yield (json.dumps(turn.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def iter_markdown(turns: Iterable[Turn], title: str = "对话记录 / Chat Export") -> Chunks:
+    yield f"# {title}\n\n".encode("utf-8")
+    for turn in turns:
+        label = _ROLE_LABELS.get(turn.role, turn.role)
+        yield f"### {label} · {turn.ts_text}\n\n{turn.content.strip()}\n\n".encode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# PDF
+# ---------------------------------------------------------------------------
+
+_PAGE_W, _PAGE_H = 595, 842  # A4（pt）
+_MARGIN = 50
+_FONT_SIZE = 10.5
+_LEADING = 15
+_LINES_PER_PAGE = int((_PAGE_H - 2 * _MARGIN) // _LEADING)
+# 行宽（字体单位，1000 = 1 个全角字）：ASCII 半角 500，其余按全角计
+_LINE_UNITS = int((_PAGE_W - 2 * _MARGIN) / _FONT_SIZE * 1000)
+
+# 固定对象号：1 目录、2 页树、3-5 字体；页面与内容流从 6 起顺序分配
+_FONT_OBJECTS = (
+    b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H /DescendantFonts [4 0 R] >>",
+    b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light"
+    b" /CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >>"
+    b" /FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+    b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880]"
+    b" /ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+)
+
+
+def _char_units(ch: str) -> int:
+    return 500 if " " <= ch <= "~" else 1000
+
+
+def _wrap(text: str) -> Iterator[str]:
+    """按行宽逐字折行（ASCII 按半角、其余按全角计宽）。"""
+    for paragraph in text.split("\n"):
+        line: List[str] = []
+        units = 0
+        for ch in paragraph:
+            w = _char_units(ch)
+            if units + w > _LINE_UNITS and line:
+                yield "".join(line)
+                line, units = [], 0
+            line.append(ch)
+            units += w
+        yield "".join(line)
+
+
+def _ucs2_hex(text: str) -> bytes:
+    # UniGB-UCS2-H 仅覆盖 BMP：表情等补充平面字符以 '?' 代替
+    return "".join(f"{ord(ch):04X}" if ord(ch) <= 0xFFFF else "003F" for ch in text).encode("ascii")
+
+
+def _pdf_lines(turns: Iterable[Turn]) -> Iterator[str]:
+    for turn in turns:
+        yield f"[{_ROLE_LABELS.get(turn.role, turn.role)} · {turn.ts_text}]"
+        yield from _wrap(turn.content.strip().replace("\t", "    "))
+        yield ""
+
+
+def iter_pdf(turns: Iterable[Turn]) -> Chunks:
+    """逐页写出 PDF：每页的内容流写完即释放，只保留对象偏移量。"""
+    offsets: Dict[int, int] = {}
+    pos = 0
+
+    def emit(data: bytes) -> bytes:
+        nonlocal pos
+        pos += len(data)
+        return data
+
+    def obj(num: int, body: bytes) -> bytes:
+        offsets[num] = pos
+        return emit(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    yield emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    for i, body in enumerate(_FONT_OBJECTS):
+        yield obj(3 + i, body)
+
+    page_ids: List[int] = []
+    next_id = 6
+
+    def page(lines: List[str]) -> Iterator[bytes]:
+        nonlocal next_id
+        ops = [b"BT /F1 %.1f Tf %d TL %d %d Td" % (_FONT_SIZE, _LEADING, _MARGIN, _PAGE_H - _MARGIN)]
+        ops.extend(b"<" + _ucs2_hex(line) + b"> Tj T*" for line in lines)
+        ops.append(b"ET")
+        stream = b"\n".join(ops)
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        yield obj(content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        yield obj(
+            page_id,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (_PAGE_W, _PAGE_H, content_id),
+        )
+
+    lines: List[str] = []
+    for line in _pdf_lines(turns):
+        lines.append(line)
+        if len(lines) == _LINES_PER_PAGE:
+            yield from page(lines)
+            lines = []
+    if lines or not page_ids:
+        yield from page(lines)
+
+    kids = b" ".join(b"%d 0 R" % pid for pid in page_ids)
+    yield obj(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids))
+    yield obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    xref_pos = pos
+    xref = [b"xref\n0 %d\n" % next_id, b"0000000000 65535 f \n"]
+    xref.extend(b"%010d 00000 n \n" % offsets[n] for n in range(1, next_id))
+    yield emit(b"".join(xref))
+    yield emit(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_id, xref_pos))
+
+
+# ---------------------------------------------------------------------------
+
+# 格式 -> (写出器, MIME, 扩展名)
+EXPORT_FORMATS: Dict[str, Tuple[Callable[[Iterable[Turn]], Chunks], str, str]] = {
+    "json": (iter_json, "application/json", "json"),
+    "json_compact": (iter_json_compact, "application/json", "json"),
+    "jsonl": (iter_jsonl, "application/jsonl", "jsonl"),
+    "markdown": (iter_markdown, "text/markdown", "md"),
+    "pdf": (iter_pdf, "application/pdf", "pdf"),
+}
+
+
+def render_export(turns: Iterable[Turn], fmt: str) -> bytes:
+    """生成完整的导出文件内容（点击下载时调用）。"""
+    writer = EXPORT_FORMATS[fmt][0]
+    return b"".join(writer(turns))
+
+
+def export_filename(fmt: str, now: Optional[datetime] = None) -> str:
+    return f"chat_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt][2]}"
@@ -0,0 +1,276 @@
+"""多提供商客户端：OpenAI / Azure 故障转移与对冲请求（hedged requests）。
+
+- 连续失败或 p95 延迟超过阈值的后端会被降级，冷却期内排到队尾；
+- 未开启对冲时在调用方线程内依次尝试各后端（保留调用方的取消标记与线程局部指标）；
+- 开启对冲时，首选后端在“近期 p95 延迟”内未返回，则向下一个后端并发
+  发送同一请求，先成功者胜出，落后的请求随即取消（关闭其连接）；调用方被取消时
+  所有进行中的请求一并取消；
+- 流式调用只在首个增量到达前做故障转移，不做对冲。
+- 只对传输错误、429 与 5xx 故障转移；其余 4xx（请求错误、鉴权失败）直接抛给调用方，
+  也不计入后端错误数。
+- 首个增量延迟与完整响应延迟分窗口统计，对冲延迟与降级判断只看完整响应延迟。
+- 进程共享的客户端不保存“最近使用的后端”，需要时用 generate_with_backend() 随结果返回。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from config import (
+    FAILOVER_COOLDOWN,
+    FAILOVER_ERROR_THRESHOLD,
+    FAILOVER_LATENCY_MS,
+    HEDGE_ENABLED,
+    HEDGE_MIN_DELAY_MS,
+)
+from utils.cancellation import CancelToken, GenerationCancelled, cancel_scope, check_cancelled
+from utils.unified_client import UnifiedAIClient, UpstreamHTTPError
+
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+# 对冲等待的轮询间隔：期间检查调用方的取消标记
+_HEDGE_POLL_SECONDS = 0.1
+
+
+def _should_failover(exc: BaseException) -> bool:
+    """请求本身有误（非 429 的 4xx）时换后端也无济于事，不做故障转移。"""
+    return not (isinstance(exc, UpstreamHTTPError) and not exc.retryable)
+
+
+class _BackendHealth:
+    """单个后端的健康度：连续错误数、近期延迟与熔断截止时间。
+
+    latencies 为完整响应耗时，first_token_latencies 为流式首个增量耗时，两者分开统计。
+    """
+
+    def __init__(self, window: int = 50):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.first_token_latencies: Deque[float] = deque(maxlen=window)
+        self.consecutive_errors = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency_ms: float) -> None:
+        with self._lock:
+            self.latencies.append(latency_ms)
+            self.consecutive_errors = 0
+            if self.p95_locked() > FAILOVER_LATENCY_MS:
+                self.open_until = time.time() + FAILOVER_COOLDOWN
+
+    def record_first_token(self, latency_ms: float) -> None:
+        with self._lock:
+            self.first_token_latencies.append(latency_ms)
+            self.consecutive_errors = 0
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= FAILOVER_ERROR_THRESHOLD:
+                self.open_until = time.time() + FAILOVER_COOLDOWN
+
+    def p95_locked(self, samples: Optional[Deque[float]] = None) -> float:
+        samples = self.latencies if samples is None else samples
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+    def p95(self) -> float:
+        with self._lock:
+            return self.p95_locked()
+
+    def p95_first_token(self) -> float:
+        with self._lock:
+            return self.p95_locked(self.first_token_latencies)
+
+    def healthy(self) -> bool:
+        return time.time() >= self.open_until
+
+
+class MultiProviderClient:
+    """与 UnifiedAIClient 接口一致的多后端客户端（首个后端为主）。"""
+
+    def __init__(self, backends: List[UnifiedAIClient], hedge: bool = HEDGE_ENABLED):
+        if not backends:
+            raise ValueError("MultiProviderClient requires at least one backend")
+        self.backends = backends
+        self.hedge = hedge
+        self._health: Dict[int, _BackendHealth] = {id(b): _BackendHealth() for b in backends}
+        self._local = threading.local()
+
+    # 兼容 UnifiedAIClient 的只读属性（app.py 依据 provider 决定界面）
+    @property
+    def primary(self) -> UnifiedAIClient:
+        return self.backends[0]
+
+    @property
+    def provider(self) -> str:
+        return self.primary.provider
+
+    @property
+    def model(self) -> str:
+        return self.primary.model
+
+    @property
+    def last_metrics(self):
+        """当前线程最近一次调用的指标（对冲时取自胜出的后端）。"""
+        return getattr(self._local, "last", None)
+
+    def _ordered(self) -> List[UnifiedAIClient]:
+        healthy = [b for b in self.backends if self._health[id(b)].healthy()]
+        degraded = [b for b in self.backends if b not in healthy]
+        return healthy + degraded
+
+    def _call(self, backend: UnifiedAIClient, messages: List[dict], kwargs: Dict[str, Any], token: Optional[CancelToken] = None):
+        """执行一次后端调用，返回 (结果, 指标)。
+
+        对冲时在线程池中执行：token 为该请求自己的取消标记（线程局部，需显式带入），
+        后端指标同样是线程局部的，需随结果一并带回调用方线程。
+        """
+        start = time.time()
+        try:
+            if token is None:
+                result = backend.generate_response(messages, **kwargs)
+            else:
+                with cancel_scope(token):
+                    result = backend.generate_response(messages, **kwargs)
+        except Exception as exc:
+            if _should_failover(exc):
+                self._health[id(backend)].record_error()
+            raise
+        self._health[id(backend)].record_success((time.time() - start) * 1000)
+        return result, backend.last_metrics
+
+    def _hedge_delay(self, backend: UnifiedAIClient) -> float:
+        return max(HEDGE_MIN_DELAY_MS, self._health[id(backend)].p95()) / 1000.0
+
+    def generate_response(
+        self,
+        messages: List[dict],
+        max_tokens: int = 1500,
+        use_web_search: bool = False,
+        stream: bool = False,
+        **kwargs,
+    ) -> Union[str, Iterator[str]]:
+        kwargs.update(max_tokens=max_tokens, use_web_search=use_web_search)
+        if stream:
+            return self._stream(messages, kwargs)
+        return self.generate_with_backend(messages, **kwargs)[0]
+
+    def generate_with_backend(self, messages: List[dict], **kwargs) -> Tuple[str, UnifiedAIClient]:
+        """非流式调用，返回 (回答, 实际作答的后端)。"""
+        order = self._ordered()
+        if not self.hedge or len(order) == 1:
+            return self._failover(order, messages, kwargs)
+        return self._hedged(order, messages, kwargs)
+
+    def _failover(self, order: List[UnifiedAIClient], messages: List[dict], kwargs: Dict[str, Any]) -> Tuple[str, UnifiedAIClient]:
+        """不对冲：在调用方线程内依次尝试，失败才切换到下一个后端。"""
+        errors: List[str] = []
+        for backend in order:
+            try:
+                result, metrics = self._call(backend, messages, dict(kwargs))
+            except Exception as exc:
+                if not _should_failover(exc):
+                    raise
+                errors.append(f"{backend.provider}: {exc}")
+                continue
+            self._local.last = metrics
+            return result, backend
+        raise Exception("All providers failed: " + " | ".join(errors))
+
+    def _hedged(self, order: List[UnifiedAIClient], messages: List[dict], kwargs: Dict[str, Any]) -> Tuple[str, UnifiedAIClient]:
+        """对冲：请求在线程池中执行，各自持有取消标记；胜出后取消其余请求。"""
+        pending: Dict[Future, Tuple[UnifiedAIClient, CancelToken]] = {}
+        errors: List[str] = []
+        next_idx = 0
+        hedge_at: Optional[float] = None
+
+        def _launch() -> None:
+            nonlocal next_idx, hedge_at
+            backend = order[next_idx]
+            next_idx += 1
+            token = CancelToken()
+            pending[_HEDGE_POOL.submit(self._call, backend, messages, dict(kwargs), token)] = (backend, token)
+            hedge_at = time.monotonic() + self._hedge_delay(backend) if next_idx < len(order) else None
+
+        def _cancel_pending() -> None:
+            for _, token in pending.values():
+                token.cancel()
+
+        _launch()
+        try:
+            while pending:
+                check_cancelled()
+                timeout = _HEDGE_POLL_SECONDS
+                if hedge_at is not None:
+                    timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        # 首选后端在 p95 延迟内未返回：对冲到下一个后端
+                        _launch()
+                    continue
+                for fut in done:
+                    backend, _ = pending.pop(fut)
+                    try:
+                        result, metrics = fut.result()
+                    except (Exception, GenerationCancelled) as exc:
+                        if not _should_failover(exc):
+                            _cancel_pending()
+                            raise
+                        errors.append(f"{backend.provider}: {exc}")
+                        continue
+                    _cancel_pending()
+                    self._local.last = metrics
+                    return result, backend
+                if not pending and next_idx < len(order):
+                    # 全部失败：故障转移到下一个后端
+                    _launch()
+        except GenerationCancelled:
+            _cancel_pending()
+            raise
+        raise Exception("All providers failed: " + " | ".join(errors))
+
+    def _stream(self, messages: List[dict], kwargs: Dict[str, Any]) -> Iterator[str]:
+        errors: List[str] = []
+        for backend in self._ordered():
+            health = self._health[id(backend)]
+            start = time.time()
+            chunks = backend.generate_response(messages, stream=True, **kwargs)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                first = ""
+            except Exception as exc:
+                if not _should_failover(exc):
+                    raise
+                health.record_error()
+                errors.append(f"{backend.provider}: {exc}")
+                continue
+            # 首个增量已送达：此后不再切换后端，错误直接抛给调用方
+            health.record_first_token((time.time() - start) * 1000)
+            if first:
+                yield first
+            yield from chunks
+            # 流结束后记录完整耗时，与非流式调用的延迟口径一致
+            health.record_success((time.time() - start) * 1000)
+            self._local.last = backend.last_metrics
+            return
+        raise Exception("All providers failed: " + " | ".join(errors))
+
+    def test_connection(self) -> bool:
+        return any(b.test_connection() for b in self.backends)
+
+    def health_report(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "provider": b.provider,
+                "model": b.model,
+                "healthy": self._health[id(b)].healthy(),
+                "p95_ms": round(self._health[id(b)].p95(), 1),
+                "p95_first_token_ms": round(self._health[id(b)].p95_first_token(), 1),
+                "consecutive_errors": self._health[id(b)].consecutive_errors,
+            }
+            for b in self.backends
+        ]
@@ -0,0 +1,106 @@
+"""后台生成：回答在共享线程池中生成，Streamlit 脚本只轮询进度。
+
+- 每个会话同一时间最多一个 GenerationJob（保存在 session_state 中，跨重跑存活）；
+- 工作线程在整个生成期间持有会话（不会被换出），增量追加到 job.chunks；
+- cancel() 关闭进行中的 HTTP 响应，已生成的部分以“已取消”记录，不进入模型上下文；
+- 无论用户期间点击了什么，完成的回答都已由 broker 写入会话存储，下次渲染即可看到。
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from config import GENERATION_WORKERS
+from utils.cancellation import CancelToken, GenerationCancelled, cancel_scope
+from utils.metrics import METRICS
+from utils.rich_text import IncrementalRichText
+from utils.session_store import get_session_manager
+
+_GENERATION_POOL = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generate")
+
+
+class GenerationJob:
+    """单次回答生成。chunks 只在工作线程追加，界面线程读取快照。"""
+
+    def __init__(self, session_id: str, prompt: str, reasoning: bool, use_web_search: bool):
+        self.session_id = session_id
+        self.prompt = prompt
+        self.reasoning = reasoning
+        self.use_web_search = use_web_search
+        self.started = time.time()
+        self.chunks: List[str] = []
+        self.token = CancelToken()
+        self.future: Optional[Future] = None
+        self.status = "running"  # running / done / cancelled / error
+        self.error: Optional[str] = None
+        # 完成后的指标与路由（写入回答消息的 meta 供展示）
+        self.metrics: Any = None
+        self.route: Any = None
+        # 界面线程增量解析已到达的部分（_fed 为已喂入的增量数）
+        self.rich = IncrementalRichText()
+        self._fed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self.chunks)
+
+    def rich_text(self) -> IncrementalRichText:
+        """把上次轮询之后到达的增量喂给解析器（只扫描新内容），供界面渲染。"""
+        with self._lock:
+            pending = self.chunks[self._fed :]
+            self._fed = len(self.chunks)
+        if pending:
+            self.rich.feed("".join(pending))
+        return self.rich
+
+    @property
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def cancel(self) -> None:
+        self.token.cancel()
+
+    def _run(self) -> None:
+        with get_session_manager().lease(self.session_id) as broker:
+            turns_before = len(broker.store)
+            try:
+                with cancel_scope(self.token):
+                    for delta in broker.generate_response(
+                        self.prompt,
+                        reasoning=self.reasoning,
+                        use_web_search=self.use_web_search,
+                        stream=True,
+                    ):
+                        with self._lock:
+                            self.chunks.append(delta)
+                self.status = "done"
+            except GenerationCancelled:
+                self.status = "cancelled"
+                METRICS.inc("broker_generation_cancelled_total")
+            except Exception as exc:  # 上游错误：broker 已记录仅展示的错误回答，界面据 error 提示
+                self.status, self.error = "error", str(exc)
+                if len(broker.store) == turns_before:
+                    broker.record_failed_turn(self.prompt, error=exc)
+            self.metrics = getattr(broker, "last_metrics", None)
+            self.route = getattr(broker, "last_route", None)
+            if len(broker.store) > turns_before:
+                broker.store.turns[-1].meta = self.meta_text()
+
+    def meta_text(self) -> str:
+        """回答下方的附加信息：耗时、模型、缓存命中与路由。"""
+        parts = []
+        if self.metrics is not None:
+            parts.append(f"{self.metrics.total_ms:.0f}ms · {self.metrics.model}")
+            if self.metrics.cache_hit:
+                parts.append("cache")
+        if self.route is not None:
+            parts.append(self.route.route)
+        return " · ".join(parts)
+
+
+def submit_generation(session_id: str, prompt: str, reasoning: bool = False, use_web_search: bool = False) -> GenerationJob:
+    job = GenerationJob(session_id, prompt, reasoning, use_web_search)
+    job.future = _GENERATION_POOL.submit(job._run)
+    return job
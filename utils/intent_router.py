@@ -0,0 +1,333 @@
+"""本地意图路由：在调用模型前判断问题是否需要模型、是否需要联网搜索。
+
+路由结果：
+- calc：参数齐全的纯计算问题，由本地房贷计算器直接作答，不调用模型；
+- faq：常见术语定义，改写为规范问题后走回答缓存（跨会话共享，不联网）；仅限不含
+  数字、附加从句且没有先前对话的独立提问，其余交给模型（带历史）；
+- model：仅模型（即使开启了联网搜索也不使用搜索工具）；
+- model_search：模型 + 联网搜索（仅在用户开启搜索时才可能选中）。
+
+判定顺序为正则规则优先，其余交给字符 n-gram 逻辑回归（纯 NumPy，首次使用时
+用内置样本训练，耗时约数十毫秒）。
+"""
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import ROUTER_SEARCH_THRESHOLD
+
+ROUTES = ("calc", "faq", "model", "model_search")
+
+# 规范问题：同一术语的不同问法共享一条缓存回答
+FAQ_TERMS: Tuple[Tuple[str, str, str], ...] = (
+    ("lvr", r"(?<![a-z])lvr(?![a-z])|loan[- ]to[- ]value|贷款价值比", "What is LVR (loan-to-value ratio) in an Australian home loan and why does it matter?"),
+    ("lmi", r"(?<![a-z])lmi(?![a-z])|lenders? mortgage insurance|贷款人按揭保险|房贷保险", "What is Lenders Mortgage Insurance (LMI) in Australia and when is it required?"),
+    ("offset", r"offset|对冲账户|抵消账户", "How does an offset account work on an Australian home loan?"),
+    ("redraw", r"redraw|重提|提取额外还款", "What is a redraw facility on an Australian home loan?"),
+    ("comparison_rate", r"comparison rate|比较利率", "What is a comparison rate for Australian home loans?"),
+    ("interest_only", r"interest[- ]only|只还利息", "What is an interest-only home loan and how does it differ from principal and interest?"),
+    ("pre_approval", r"pre-?approval|预批", "What is home loan pre-approval in Australia and how long does it last?"),
+    ("break_cost", r"break (?:cost|fee)|提前还款罚金|违约金", "What are break costs on a fixed-rate home loan in Australia?"),
+)
+_DEFINITION = re.compile(r"什么是|是什么|是啥|含义|意思|解释|what(?:'s| is| are)|meaning|define|explain", re.I)
+# 需要判断/建议的措辞：即使参数齐全也交给模型（计算 + 建议的混合问题）
+_OPINION = re.compile(
+    r"应该|建议|比较|哪个|划算|承受|合适|适合|should|better|recommend|compare|afford|suitable|vs\.?|versus",
+    re.I,
+)
+# 术语问题中的附加从句/个人情况（“…，对我合适吗”“… and …”）
+_EXTRA_CLAUSE = re.compile(r"[,，;；:：。.?？!！]|\b(?:and|my|me|i)\b|我|以及|还有|另外|并且", re.I)
+_RECENCY = re.compile(
+    r"最新|目前|现在|当前|今年|本月|最近|近期|新政|(?<!\d)20[2-3]\d(?!\d)|latest|current(?:ly)?|today|this (?:year|month|week)|recent|now\b|cash rate",
+    re.I,
+)
+_CALC_INTENT = re.compile(r"月供|还款额|每月还|总利息|利息多少|多少钱|计算|算一下|repayments?|how much|calculate|total interest", re.I)
+
+_NUM = r"(\d[\d,]*(?:\.\d+)?)\s*(k|m|万)?"
+# 金额：不能是百分比，也不能截断在数字中间
+_AMOUNT = _NUM + r"(?![\d.,]|\s*%)"
+_PRICE = re.compile(r"(?:房价|价格|总价|买|购入|property|price|house|home)[^\d%]{0,12}" + _AMOUNT, re.I)
+_LOAN = re.compile(r"(?:贷款额|贷款|借|loan(?: amount)?|borrow(?:ing)?)[^\d%]{0,12}" + _AMOUNT, re.I)
+# “650k loan”“60万贷款”：金额在前
+_LOAN_AFTER = re.compile(_NUM + r"\s*(?:的)?\s*(?:home |mortgage )?(?:loan|mortgage|贷款)", re.I)
+_DEPOSIT_PCT = re.compile(r"(?:首付|deposit)[^\d%]{0,12}(\d+(?:\.\d+)?)\s*%", re.I)
+_DEPOSIT_AMT = re.compile(r"(?:首付|deposit)[^\d%]{0,12}" + _AMOUNT, re.I)
+_RATE_PATTERNS = (
+    re.compile(r"(?:利率|interest rate|rate)[^\d%]{0,12}(\d+(?:\.\d+)?)\s*%", re.I),
+    re.compile(r"(\d+(?:\.\d+)?)\s*%\s*(?:的)?\s*(?:年)?(?:利率|interest|rate|p\.?a\.?)", re.I),
+)
+_PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+# 期限：数字前不能紧跟数字（避免把“2025年”识别为 25 年）
+_TERM = re.compile(r"(?<!\d)(\d{1,2})\s*(?:年|[- ]?years?|[- ]?yrs?)(?![a-z])", re.I)
+_OFFSET_AMT = re.compile(r"(?:对冲|offset)[^\d%]{0,16}" + _AMOUNT, re.I)
+_IO = re.compile(r"只还利息|interest[- ]only", re.I)
+# 只还利息期：“只还利息5年”“前5年只还利息”“interest-only for 5 years”“5-year interest-only”
+_IO_YEARS = (
+    re.compile(r"(?:只还利息|interest[- ]only)[^\d%]{0,10}?(?<!\d)(\d{1,2})\s*(?:年|[- ]?years?|[- ]?yrs?)(?![a-z])", re.I),
+    re.compile(r"(?<!\d)(\d{1,2})\s*(?:年|[- ]?years?|[- ]?yrs?)(?![a-z])[^\d%]{0,6}?(?:只还利息|interest[- ]only)", re.I),
+)
+
+# 内置训练样本（中英混合）；规则覆盖不到的问题由分类器兜底
+_SEED: Dict[str, Tuple[str, ...]] = {
+    "calc": (
+        "房价80万首付20%利率6%三十年月供多少",
+        "贷款50万利率5.9% 25年每月还多少",
+        "帮我算一下月供",
+        "计算总利息",
+        "monthly repayment on a 600k loan at 6.1% over 30 years",
+        "how much are repayments for 700000 at 6 percent",
+        "calculate repayments 30 years 6.2%",
+        "借60万30年利率6.4%月供",
+        "fortnightly repayment for 450k loan",
+        "total interest on 500k over 25 years",
+    ),
+    "faq": (
+        "什么是LVR",
+        "LMI是什么意思",
+        "对冲账户是什么",
+        "what is an offset account",
+        "what does comparison rate mean",
+        "explain redraw facility",
+        "什么是只还利息贷款",
+        "define lenders mortgage insurance",
+        "pre-approval是什么",
+        "what is a break cost",
+    ),
+    "model": (
+        "我是自雇人士能贷多少",
+        "固定利率和浮动利率怎么选",
+        "首次购房需要准备哪些材料",
+        "how do lenders assess my income as a contractor",
+        "should I use my super for a deposit",
+        "再融资有哪些步骤",
+        "投资房负扣税怎么理解",
+        "what documents do I need for a home loan application",
+        "我有信用卡欠款会影响贷款吗",
+        "can I get a loan on a temporary visa",
+        "how does negative gearing work",
+        "贷款被拒后怎么办",
+    ),
+    "model_search": (
+        "现在RBA的现金利率是多少",
+        "最新的首次购房补助政策",
+        "今年新州印花税减免有什么变化",
+        "各大银行目前的固定利率是多少",
+        "what is the current RBA cash rate",
+        "latest first home guarantee changes",
+        "which bank has the lowest variable rate today",
+        "2025年维州首次购房补助",
+        "最近有哪些银行降息",
+        "recent changes to APRA serviceability buffer",
+        "this month's best refinance cashback offers",
+        "近期房价走势",
+    ),
+}
+
+_DIM = 1 << 12
+_NGRAMS = (1, 2, 3)
+
+
+def _features(text: str) -> np.ndarray:
+    """字符 1~3-gram 哈希特征（crc32，跨进程稳定），L2 归一化。"""
+    norm = re.sub(r"\s+", " ", text.lower()).strip()
+    padded = f" {norm} "
+    idx = [
+        zlib.crc32(f"{n}:{padded[i:i + n]}".encode("utf-8")) % _DIM
+        for n in _NGRAMS
+        for i in range(len(padded) - n + 1)
+    ]
+    vec = np.bincount(np.asarray(idx, dtype=np.int64), minlength=_DIM).astype(np.float64)
+    norm2 = np.linalg.norm(vec)
+    return vec / norm2 if norm2 else vec
+
+
+class NgramLogReg:
+    """多分类 softmax 逻辑回归（全批量梯度下降 + L2）。"""
+
+    def __init__(self, classes: Tuple[str, ...]):
+        self.classes = classes
+        self.W = np.zeros((_DIM, len(classes)))
+        self.b = np.zeros(len(classes))
+
+    def fit(self, texts: List[str], labels: List[str], epochs: int = 300, lr: float = 2.0, l2: float = 1e-4) -> "NgramLogReg":
+        X = np.stack([_features(t) for t in texts])
+        Y = np.eye(len(self.classes))[[self.classes.index(y) for y in labels]]
+        for _ in range(epochs):
+            P = self._softmax(X @ self.W + self.b)
+            grad = (P - Y) / len(texts)
+            self.W -= lr * (X.T @ grad + l2 * self.W)
+            self.b -= lr * grad.sum(axis=0)
+        return self
+
+    @staticmethod
+    def _softmax(z: np.ndarray) -> np.ndarray:
+        z = z - z.max(axis=-1, keepdims=True)
+        e = np.exp(z)
+        return e / e.sum(axis=-1, keepdims=True)
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        p = self._softmax(_features(text) @ self.W + self.b)
+        return {c: float(v) for c, v in zip(self.classes, p)}
+
+
+_MODEL: Optional[NgramLogReg] = None
+_MODEL_LOCK = threading.Lock()
+
+
+def _classifier() -> NgramLogReg:
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                texts = [t for label in ROUTES for t in _SEED[label]]
+                labels = [label for label in ROUTES for _ in _SEED[label]]
+                _MODEL = NgramLogReg(ROUTES).fit(texts, labels)
+    return _MODEL
+
+
+def _amount(value: str, unit: Optional[str]) -> float:
+    amount = float(value.replace(",", ""))
+    unit = (unit or "").lower()
+    if unit == "k":
+        amount *= 1_000
+    elif unit == "m":
+        amount *= 1_000_000
+    elif unit == "万":
+        amount *= 10_000
+    return amount
+
+
+def _extract_rate(text: str) -> Optional[float]:
+    """利率：依次取“利率 x%”“x% 利率”，最后取首个非首付的合理百分比。"""
+    deposit = _DEPOSIT_PCT.search(text)
+    skip = deposit.start(1) if deposit else -1
+    for pattern in _RATE_PATTERNS + (_PERCENT,):
+        for match in pattern.finditer(text):
+            value = float(match.group(1))
+            if match.start(1) != skip and 0.5 <= value <= 20:
+                return value
+    return None
+
+
+def _extract_io_years(text: str) -> Optional[Tuple[float, Tuple[int, int]]]:
+    """只还利息期（年）及其在文本中的位置（抽取期限时跳过该段）。"""
+    for pattern in _IO_YEARS:
+        match = pattern.search(text)
+        if match:
+            return float(match.group(1)), match.span()
+    return None
+
+
+def extract_calc_args(text: str) -> Optional[Dict[str, Any]]:
+    """从问题中抽取计算参数；缺少利率、期限或贷款额（房价 + 首付）时返回 None。
+
+    提到只还利息但抽不出只还利息期（或不短于总期限）时同样返回 None，交给模型而不是猜测。
+    """
+    io = _extract_io_years(text) if _IO.search(text) else None
+    if _IO.search(text) and io is None:
+        return None
+    term_text = text
+    if io is not None:
+        start, end = io[1]
+        term_text = text[:start] + " " * (end - start) + text[end:]
+    term_match = _TERM.search(term_text)
+    rate = _extract_rate(text)
+    if rate is None or not term_match:
+        return None
+    args: Dict[str, Any] = {"annual_rate_percent": rate, "term_years": float(term_match.group(1))}
+    if io is not None:
+        if io[0] >= args["term_years"]:
+            return None
+        args["repayment_type"] = "interest_only"
+        args["interest_only_years"] = io[0]
+    loan = _LOAN.search(text) or _LOAN_AFTER.search(text)
+    price = _PRICE.search(text)
+    if loan and not price:
+        args["loan_amount"] = _amount(loan.group(1), loan.group(2))
+    elif price:
+        args["property_price"] = _amount(price.group(1), price.group(2))
+        pct = _DEPOSIT_PCT.search(text)
+        amt = _DEPOSIT_AMT.search(text)
+        if pct:
+            args["deposit_percent"] = float(pct.group(1))
+        elif amt:
+            args["deposit_amount"] = _amount(amt.group(1), amt.group(2))
+        else:
+            return None
+    else:
+        return None
+    offset = _OFFSET_AMT.search(text)
+    if offset:
+        args["offset_balance"] = _amount(offset.group(1), offset.group(2))
+    return args
+
+
+class RouteDecision:
+    """一次路由判定（供界面展示与指标统计）。"""
+
+    __slots__ = ("route", "reason", "confidence", "elapsed_ms", "calc_args", "faq_id", "faq_question")
+
+    def __init__(self, route: str, reason: str, confidence: float = 1.0):
+        self.route = route
+        self.reason = reason
+        self.confidence = confidence
+        self.elapsed_ms = 0.0
+        self.calc_args: Optional[Dict[str, Any]] = None
+        self.faq_id: Optional[str] = None
+        self.faq_question: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def _match_faq(text: str) -> Optional[Tuple[str, str]]:
+    """独立的术语定义提问才改写为规范问题：含数字或附加从句的问题需要模型结合具体情况回答。"""
+    if len(text) > 80 or not _DEFINITION.search(text) or _OPINION.search(text):
+        return None
+    if any(ch.isdigit() for ch in text) or _EXTRA_CLAUSE.search(text.rstrip(" ?？!！。.")):
+        return None
+    for faq_id, pattern, question in FAQ_TERMS:
+        if re.search(pattern, text, re.I):
+            return faq_id, question
+    return None
+
+
+def route_query(text: str, use_web_search: bool = False, has_history: bool = False) -> RouteDecision:
+    """判定问题走向；use_web_search 为用户开关，路由只会关闭搜索、不会擅自开启。
+
+    has_history 表示会话已有先前轮次：此时术语问题可能是追问，不走 faq 改写。
+    """
+    start = time.perf_counter()
+    decision = _route(text.strip(), use_web_search, has_history)
+    decision.elapsed_ms = (time.perf_counter() - start) * 1000
+    return decision
+
+
+def _route(text: str, use_web_search: bool, has_history: bool) -> RouteDecision:
+    if _CALC_INTENT.search(text) and not _OPINION.search(text) and not _RECENCY.search(text):
+        args = extract_calc_args(text)
+        if args is not None:
+            decision = RouteDecision("calc", "rule: calculation with complete parameters")
+            decision.calc_args = args
+            return decision
+
+    faq = None if has_history else _match_faq(text)
+    if faq is not None:
+        decision = RouteDecision("faq", f"rule: definition of {faq[0]}")
+        decision.faq_id, decision.faq_question = faq
+        return decision
+
+    if not use_web_search:
+        return RouteDecision("model", "web search disabled")
+    if _RECENCY.search(text):
+        return RouteDecision("model_search", "rule: time-sensitive wording")
+
+    proba = _classifier().predict_proba(text)
+    p_search = proba["model_search"]
+    if p_search >= ROUTER_SEARCH_THRESHOLD:
+        return RouteDecision("model_search", "classifier: time-sensitive", p_search)
+    return RouteDecision("model", "classifier: stable knowledge", 1.0 - p_search)
@@ -0,0 +1,398 @@
+"""请求级延迟与用量指标。
+
+每次模型调用生成一条 RequestMetrics（连接耗时、TTFB、首个增量、总延迟、重试、
+token 用量、缓存命中、提供商/模型及功能开关），汇总为直方图与计数器：
+- render_prometheus(): Prometheus 文本格式（可选 METRICS_PORT 起一个 /metrics 端点）
+- METRICS_JSONL_PATH: 每条记录追加写入 JSONL
+- summary(): 按功能标签给出 p50/p95/p99 与 token 消耗
+- prompt_cache_report(): 上游提示缓存命中率（cached_tokens / input_tokens）及命中与否的 TTFB 对比
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import METRICS_JSONL_PATH, METRICS_PORT
+from utils.cancellation import socket_scope
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000, 120000)
+TOKEN_KINDS = ("input", "output", "cached", "reasoning")
+
+# 当前线程内建立新连接（TCP + TLS）的累计耗时；复用长连接时为 0
+_connect_local = threading.local()
+
+
+def reset_connect_timer() -> None:
+    _connect_local.ms = 0.0
+
+
+def take_connect_ms() -> float:
+    ms = getattr(_connect_local, "ms", 0.0)
+    _connect_local.ms = 0.0
+    return ms
+
+
+class _CancellableResponseMixin:
+    """等待响应头期间把套接字登记到当前线程的取消标记，取消时可立即中断阻塞的读取。"""
+
+    def getresponse(self, *args, **kwargs):
+        with socket_scope(getattr(self, "sock", None)):
+            return super().getresponse(*args, **kwargs)
+
+
+class _TimedHTTPConnection(_CancellableResponseMixin, HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_local.ms = getattr(_connect_local, "ms", 0.0) + (time.perf_counter() - start) * 1000
+
+
+class _TimedHTTPSConnection(_CancellableResponseMixin, HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_local.ms = getattr(_connect_local, "ms", 0.0) + (time.perf_counter() - start) * 1000
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """记录新建连接耗时的 HTTPAdapter（连接池参数与 HTTPAdapter 相同）。"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class RequestMetrics:
+    """单次调用的指标记录。"""
+
+    __slots__ = (
+        "ts", "provider", "model", "endpoint", "stream", "web_search", "reasoning",
+        "connect_ms", "ttfb_ms", "first_token_ms", "total_ms", "retries",
+        "input_tokens", "output_tokens", "cached_tokens", "reasoning_tokens",
+        "tool_calls", "cache_hit", "coalesced", "purpose", "status", "error", "_start",
+    )
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        stream: bool = False,
+        web_search: bool = False,
+        reasoning: bool = False,
+        purpose: str = "chat",
+    ):
+        self.ts = time.time()
+        self.provider = provider
+        self.model = model
+        self.endpoint = ""
+        self.stream = stream
+        self.web_search = web_search
+        self.reasoning = reasoning
+        self.connect_ms = 0.0
+        self.ttfb_ms: Optional[float] = None
+        self.first_token_ms: Optional[float] = None
+        self.total_ms = 0.0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.reasoning_tokens = 0
+        # 本地执行的函数工具调用次数（如房贷计算器）
+        self.tool_calls = 0
+        self.cache_hit = False
+        self.coalesced = False
+        # 调用用途：chat 为用户对话，summary 等为后台辅助调用，分开统计
+        self.purpose = purpose
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._start = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def mark_first_token(self) -> None:
+        if self.first_token_ms is None:
+            self.first_token_ms = self.elapsed_ms()
+
+    def add_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """兼容 Responses（input/output_tokens）与 Chat Completions（prompt/completion_tokens）两种 usage。"""
+        if not usage:
+            return
+        if not isinstance(usage, dict):
+            usage = usage.model_dump() if hasattr(usage, "model_dump") else dict(getattr(usage, "__dict__", {}))
+        self.input_tokens += int(usage.get("input_tokens") or usage.get("prompt_tokens") or 0)
+        self.output_tokens += int(usage.get("output_tokens") or usage.get("completion_tokens") or 0)
+        in_details = usage.get("input_tokens_details") or usage.get("prompt_tokens_details") or {}
+        out_details = usage.get("output_tokens_details") or usage.get("completion_tokens_details") or {}
+        self.cached_tokens += int((in_details or {}).get("cached_tokens") or 0)
+        self.reasoning_tokens += int((out_details or {}).get("reasoning_tokens") or 0)
+
+    def finish(self, status: str = "ok", error: Optional[str] = None) -> "RequestMetrics":
+        self.total_ms = self.elapsed_ms()
+        self.status = status
+        self.error = error
+        return self
+
+    @property
+    def prompt_cache_hit(self) -> bool:
+        return self.cached_tokens > 0
+
+    def labels(self) -> Tuple[Tuple[str, str], ...]:
+        return (
+            ("provider", self.provider),
+            ("model", self.model),
+            ("web_search", "on" if self.web_search else "off"),
+            ("reasoning", "on" if self.reasoning else "off"),
+            ("cache", "hit" if self.cache_hit else "miss"),
+            ("purpose", self.purpose),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__ if not k.startswith("_")}
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, window: int = 2048):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        # 近期原始样本，用于本地计算分位数
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _fmt_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    """进程级指标汇总（线程安全）。"""
+
+    HISTOGRAMS = {
+        "broker_request_latency_ms": "Total model call latency in milliseconds",
+        "broker_request_ttfb_ms": "Time to first byte (response headers) in milliseconds",
+        "broker_request_first_token_ms": "Time to first streamed token in milliseconds",
+        "broker_request_connect_ms": "New connection (TCP+TLS) setup time in milliseconds",
+    }
+
+    def __init__(self, jsonl_path: Optional[str] = METRICS_JSONL_PATH):
+        self._lock = threading.Lock()
+        self._hist: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.jsonl_path = jsonl_path
+
+    def _inc(self, name: str, labels, value: float = 1.0) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def _observe(self, name: str, labels, value: Optional[float]) -> None:
+        if value is None:
+            return
+        hist = self._hist.get((name, labels))
+        if hist is None:
+            hist = self._hist[(name, labels)] = _Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, labels: Tuple[Tuple[str, str], ...] = (), value: float = 1.0) -> None:
+        """供其他模块记录自定义计数器（如路由决策、缓存统计）。"""
+        with self._lock:
+            self._inc(name, labels, value)
+
+    def observe(self, name: str, value: float, labels: Tuple[Tuple[str, str], ...] = ()) -> None:
+        with self._lock:
+            self._observe(name, labels, value)
+
+    def record(self, m: RequestMetrics) -> None:
+        labels = m.labels()
+        with self._lock:
+            self._inc("broker_requests_total", labels + (("status", m.status),))
+            if m.status == "ok":
+                self._observe("broker_request_latency_ms", labels, m.total_ms)
+                self._observe("broker_request_ttfb_ms", labels, m.ttfb_ms)
+                self._observe("broker_request_first_token_ms", labels, m.first_token_ms)
+                if m.connect_ms:
+                    self._observe("broker_request_connect_ms", labels, m.connect_ms)
+            if m.retries:
+                self._inc("broker_retries_total", labels, m.retries)
+            for kind in TOKEN_KINDS:
+                value = getattr(m, f"{kind}_tokens")
+                if value:
+                    self._inc("broker_tokens_total", labels + (("kind", kind),), value)
+            if m.status == "ok" and m.input_tokens:
+                # 上游提示缓存：按是否命中分别统计请求数与 TTFB，用于估算节省的延迟
+                pc = (("prompt_cache", "hit" if m.prompt_cache_hit else "miss"),)
+                self._inc("broker_prompt_cache_requests_total", pc)
+                self._observe("broker_prompt_cache_ttfb_ms", pc, m.ttfb_ms)
+        if self.jsonl_path:
+            self._write_jsonl(m)
+
+    def _write_jsonl(self, m: RequestMetrics) -> None:
+        line = json.dumps(m.to_dict(), ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+            with self._lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as exc:
+            print(f"⚠️ 指标写入失败: {exc}")
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, help_text in self.HISTOGRAMS.items():
+                series = [(labels, h) for (n, labels), h in self._hist.items() if n == name]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in series:
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{_fmt_labels(labels)} {h.sum:.3f}")
+                    lines.append(f"{name}_count{_fmt_labels(labels)} {h.count}")
+            observed = sorted({n for (n, _) in self._hist} - set(self.HISTOGRAMS))
+            for name in observed:
+                lines.append(f"# TYPE {name} summary")
+                for (n, labels), h in self._hist.items():
+                    if n != name:
+                        continue
+                    for q in (0.5, 0.95, 0.99):
+                        lines.append(f"{name}{_fmt_labels(labels, (('quantile', str(q)),))} {h.percentile(q):.3f}")
+                    lines.append(f"{name}_sum{_fmt_labels(labels)} {h.sum:.3f}")
+                    lines.append(f"{name}_count{_fmt_labels(labels)} {h.count}")
+            for name in sorted({n for (n, _) in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in self._counters.items():
+                    if n == name:
+                        lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name: str = "broker_request_latency_ms") -> List[Dict[str, Any]]:
+        """每组功能标签的 p50/p95/p99（毫秒）与调用次数。"""
+        out = []
+        with self._lock:
+            for (n, labels), h in self._hist.items():
+                if n != name:
+                    continue
+                row: Dict[str, Any] = dict(labels)
+                row.update(
+                    count=h.count,
+                    p50=round(h.percentile(0.5), 1),
+                    p95=round(h.percentile(0.95), 1),
+                    p99=round(h.percentile(0.99), 1),
+                )
+                out.append(row)
+        return out
+
+    def prompt_cache_report(self) -> Dict[str, Any]:
+        """上游提示缓存命中率与命中/未命中请求的 TTFB p50 对比。"""
+        with self._lock:
+            tokens = {kind: 0.0 for kind in ("input", "cached")}
+            for (n, labels), value in self._counters.items():
+                if n == "broker_tokens_total":
+                    kind = dict(labels).get("kind")
+                    if kind in tokens:
+                        tokens[kind] += value
+            requests = {
+                dict(labels)["prompt_cache"]: value
+                for (n, labels), value in self._counters.items()
+                if n == "broker_prompt_cache_requests_total"
+            }
+            ttfb = {
+                dict(labels)["prompt_cache"]: h.percentile(0.5)
+                for (n, labels), h in self._hist.items()
+                if n == "broker_prompt_cache_ttfb_ms"
+            }
+        report: Dict[str, Any] = {
+            "input_tokens": int(tokens["input"]),
+            "cached_tokens": int(tokens["cached"]),
+            "token_hit_rate": round(tokens["cached"] / tokens["input"], 4) if tokens["input"] else 0.0,
+            "hit_requests": int(requests.get("hit", 0)),
+            "miss_requests": int(requests.get("miss", 0)),
+            "ttfb_p50_hit_ms": round(ttfb["hit"], 1) if "hit" in ttfb else None,
+            "ttfb_p50_miss_ms": round(ttfb["miss"], 1) if "miss" in ttfb else None,
+        }
+        if "hit" in ttfb and "miss" in ttfb:
+            report["ttfb_saved_ms"] = round(ttfb["miss"] - ttfb["hit"], 1)
+        return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+
+METRICS = MetricsRegistry()
+_server_started = False
+_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = METRICS.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = METRICS_PORT) -> bool:
+    """在后台线程启动 /metrics 端点（进程内只启动一次）；port 为空时不启动。"""
+    global _server_started
+    if not port:
+        return False
+    with _server_lock:
+        if _server_started:
+            return True
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+        except OSError as exc:
+            print(f"⚠️ 指标端点启动失败: {exc}")
+            return False
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        _server_started = True
+        return True
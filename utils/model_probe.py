@@ -0,0 +1,62 @@
+"""模型能力探测结果的磁盘缓存。
+
+探测结果（模型是否存在、是否走 Responses API）按 provider+model 写入
+CACHE_DIR/model_probe.json，TTL 内直接复用，过期由调用方在后台刷新。
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import CACHE_DIR, MODEL_PROBE_TTL
+
+_PROBE_FILE = os.path.join(CACHE_DIR, "model_probe.json")
+_LOCK = threading.Lock()
+
+
+def _key(provider: str, model: str) -> str:
+    return f"{provider}:{model}"
+
+
+def _read_all() -> Dict[str, Any]:
+    try:
+        with open(_PROBE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def load_probe(provider: str, model: str) -> Optional[Dict[str, Any]]:
+    """读取缓存记录：{"available", "use_responses", "checked_at"}；不存在返回 None。"""
+    with _LOCK:
+        record = _read_all().get(_key(provider, model))
+    return record if isinstance(record, dict) else None
+
+
+def is_fresh(record: Optional[Dict[str, Any]], ttl: int = MODEL_PROBE_TTL) -> bool:
+    if not record:
+        return False
+    return (time.time() - float(record.get("checked_at", 0))) < ttl
+
+
+def save_probe(provider: str, model: str, available: bool, use_responses: bool) -> Dict[str, Any]:
+    """写入探测结果（临时文件 + 原子替换，避免并发进程读到半截 JSON）。"""
+    record = {
+        "available": bool(available),
+        "use_responses": bool(use_responses),
+        "checked_at": time.time(),
+    }
+    with _LOCK:
+        data = _read_all()
+        data[_key(provider, model)] = record
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = f"{_PROBE_FILE}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, _PROBE_FILE)
+        except OSError as exc:
+            print(f"⚠️ 模型探测缓存写入失败: {exc}")
+    return record
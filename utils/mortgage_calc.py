@@ -0,0 +1,338 @@
+"""本地房贷计算引擎（NumPy 向量化），并作为函数工具提供给模型调用。
+
+所有计算函数均接受标量或数组（按 NumPy 规则广播），利率以年化百分比表示
+（如 6.2 表示 6.2%），期限以年为单位。模型通过 mortgage_calculator 工具
+传入参数，由本地在微秒级完成计算，避免在推理中手算。
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 还款频率 -> 每年期数
+FREQUENCIES = {"monthly": 12, "fortnightly": 26, "weekly": 52}
+
+TOOL_NAME = "mortgage_calculator"
+TOOL_DESCRIPTION = (
+    "Exact Australian mortgage arithmetic. Computes loan amount from price and deposit (minus grants), "
+    "LVR, principal-and-interest or interest-only repayments, total interest and total repayments, "
+    "and savings from an offset account. Use it for every number in the answer instead of computing by hand."
+)
+TOOL_PARAMETERS: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "property_price": {"type": "number", "description": "Property price / valuation in AUD"},
+        "deposit_amount": {"type": "number", "description": "Deposit in AUD (alternative to deposit_percent)"},
+        "deposit_percent": {"type": "number", "description": "Deposit as % of price, e.g. 20"},
+        "grants": {"type": "number", "description": "Government grants deducted from the loan, AUD"},
+        "loan_amount": {"type": "number", "description": "Loan amount in AUD if already known"},
+        "annual_rate_percent": {"type": "number", "description": "Annual interest rate in %, e.g. 6.2"},
+        "term_years": {"type": "number", "description": "Loan term in years"},
+        "repayment_type": {
+            "type": "string",
+            "enum": ["principal_and_interest", "interest_only"],
+            "description": "Repayment type for the quoted repayment",
+        },
+        "interest_only_years": {"type": "number", "description": "Interest-only period in years before P&I"},
+        "frequency": {"type": "string", "enum": list(FREQUENCIES), "description": "Repayment frequency"},
+        "offset_balance": {"type": "number", "description": "Offset account balance in AUD"},
+    },
+    "required": ["annual_rate_percent", "term_years"],
+}
+
+
+def _arr(x) -> np.ndarray:
+    return np.asarray(x, dtype=float)
+
+
+def _require(ok: bool, message: str) -> None:
+    # 以“not 条件”判断，NaN 也会被拒绝
+    if not ok:
+        raise ValueError(message)
+
+
+def loan_amount(price, deposit=None, deposit_percent=None, grants=0.0) -> np.ndarray:
+    """贷款额 = 房价 − 首付（金额或比例）− 可抵扣补助，不低于 0。"""
+    price = _arr(price)
+    if deposit is None:
+        deposit = price * _arr(0.0 if deposit_percent is None else deposit_percent) / 100.0
+    return np.maximum(price - _arr(deposit) - _arr(grants), 0.0)
+
+
+def lvr(loan, valuation) -> np.ndarray:
+    """贷款价值比（%）。"""
+    valuation = _arr(valuation)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(valuation > 0, _arr(loan) / valuation * 100.0, np.nan)
+
+
+def pi_repayment(principal, annual_rate_percent, years, periods_per_year=12) -> np.ndarray:
+    """本息等额还款每期金额：P·r / (1 − (1+r)^−n)；零利率时为 P/n。"""
+    principal = _arr(principal)
+    r = _arr(annual_rate_percent) / 100.0 / periods_per_year
+    n = np.maximum(np.rint(_arr(years) * periods_per_year), 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = principal * r / -np.expm1(-n * np.log1p(r))
+    return np.where(r > 0, annuity, principal / n)
+
+
+def io_repayment(principal, annual_rate_percent, periods_per_year=12) -> np.ndarray:
+    """只还利息每期金额。"""
+    return _arr(principal) * _arr(annual_rate_percent) / 100.0 / periods_per_year
+
+
+def total_interest(principal, annual_rate_percent, years, periods_per_year=12, interest_only_years=0.0) -> np.ndarray:
+    """整个期限内的总利息（可含前置只还利息期）。"""
+    principal = _arr(principal)
+    io_years = np.minimum(_arr(interest_only_years), _arr(years))
+    io_part = io_repayment(principal, annual_rate_percent, periods_per_year) * np.rint(io_years * periods_per_year)
+    pi_years = _arr(years) - io_years
+    pi_periods = np.rint(pi_years * periods_per_year)
+    pi_part = pi_repayment(principal, annual_rate_percent, pi_years, periods_per_year) * pi_periods - principal
+    return io_part + np.where(pi_periods > 0, pi_part, 0.0)
+
+
+def offset_savings(principal, annual_rate_percent, years, offset_balance, periods_per_year=12) -> Dict[str, np.ndarray]:
+    """对冲账户节省：还款额不变，利息按（余额 − 对冲）计，因而提前还清。
+
+    余额降到对冲额之前满足 B_k − C = (B_0 − C)(1+r)^k，其中 C = P/r + O，
+    由此解出期数 k*；此后不再计息，剩余 O 需 O/P 期。返回 interest_saved（AUD）
+    与 periods_saved（期数）。
+    """
+    principal = _arr(principal)
+    offset = np.minimum(np.maximum(_arr(offset_balance), 0.0), principal)
+    r = _arr(annual_rate_percent) / 100.0 / periods_per_year
+    n = np.rint(_arr(years) * periods_per_year)
+    payment = pi_repayment(principal, annual_rate_percent, years, periods_per_year)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = payment / r + offset
+        k = np.log((offset - c) / (principal - c)) / np.log1p(r)
+    n_offset = np.where(r > 0, np.minimum(k + offset / payment, n), n)
+    base_interest = payment * n - principal
+    offset_interest = np.maximum(payment * n_offset - principal, 0.0)
+    return {
+        "interest_saved": base_interest - offset_interest,
+        "periods_saved": n - n_offset,
+    }
+
+
+REPAYMENT_TYPES = ("principal_and_interest", "interest_only")
+
+
+def parse_values(text: str, default_step: float = 0.1) -> List[float]:
+    """解析“5.8, 6.2”或区间“5.8-6.6”（可带步长“5.8-6.6:0.2”）为数值列表。"""
+    values: List[float] = []
+    for part in str(text).replace("，", ",").split(","):
+        part = part.strip().replace("%", "")
+        if not part:
+            continue
+        if "-" in part.lstrip("-"):
+            span, _, step_text = part.partition(":")
+            lo_text, hi_text = span.split("-", 1)
+            lo, hi = float(lo_text), float(hi_text)
+            step = abs(float(step_text)) if step_text else default_step
+            if step <= 0:
+                raise ValueError(f"invalid step in {part!r}")
+            # 以整数步数生成，避免浮点累加误差
+            count = int(np.floor((hi - lo) / step + 1e-9)) + 1
+            values.extend(np.round(lo + step * np.arange(max(count, 1)), 6).tolist())
+        else:
+            values.append(float(part))
+    if not all(np.isfinite(values)):
+        raise ValueError(f"invalid number in {text!r}")
+    return sorted(set(values))
+
+
+def scenario_grid(
+    prices,
+    deposit_percents,
+    rates,
+    terms,
+    repayment_types=("principal_and_interest",),
+    interest_only_years: float = 5.0,
+    frequency: str = "monthly",
+    max_cells: int = 5000,
+) -> Dict[str, np.ndarray]:
+    """一次性计算 房价 × 首付比例 × 利率 × 期限 × 还款方式 的笛卡尔积。
+
+    返回按列组织的扁平数组（每个单元格一行），可直接构造表格。
+    只还利息方案按前 interest_only_years 年只还利息、之后本息等额计算。
+    """
+    ppy = FREQUENCIES[frequency]
+    axes = [_arr(prices).ravel(), _arr(deposit_percents).ravel(), _arr(rates).ravel(), _arr(terms).ravel()]
+    types = [t for t in REPAYMENT_TYPES if t in set(repayment_types)]
+    if not types or any(a.size == 0 for a in axes):
+        raise ValueError("every scenario axis needs at least one value")
+    _require(bool(np.all(axes[0] > 0)), "property prices must be positive")
+    _require(bool(np.all((axes[1] >= 0) & (axes[1] < 100))), "deposit percentages must be in [0, 100)")
+    _require(bool(np.all(axes[2] >= 0)), "interest rates must not be negative")
+    _require(bool(np.all(np.rint(axes[3] * ppy) >= 1)), "loan terms must be positive")
+    cells = int(np.prod([a.size for a in axes])) * len(types)
+    if cells > max_cells:
+        raise ValueError(f"scenario grid too large: {cells} cells (max {max_cells})")
+
+    is_io = np.array([t == "interest_only" for t in types])
+    price, dep, rate, term, io_flag = (g.ravel() for g in np.meshgrid(*axes, is_io, indexing="ij"))
+    io_years = np.where(io_flag, np.minimum(interest_only_years, term), 0.0)
+    principal = loan_amount(price, deposit_percent=dep)
+    pi_now = pi_repayment(principal, rate, term, ppy)
+    pi_after = pi_repayment(principal, rate, term - io_years, ppy)
+    interest = total_interest(principal, rate, term, ppy, io_years)
+    return {
+        "property_price": price,
+        "deposit_percent": dep,
+        "loan_amount": principal,
+        "lvr_percent": lvr(principal, price),
+        "annual_rate_percent": rate,
+        "term_years": term,
+        "repayment_type": np.where(io_flag, "interest_only", "principal_and_interest"),
+        "repayment": np.where(io_flag, io_repayment(principal, rate, ppy), pi_now),
+        "repayment_after_io": np.where(io_flag, pi_after, pi_now),
+        "total_interest": interest,
+        "total_repayments": principal + interest,
+    }
+
+
+def amortisation_schedule(
+    principal: float,
+    annual_rate_percent: float,
+    years: float,
+    periods_per_year: int = 12,
+    interest_only_years: float = 0.0,
+    yearly: bool = False,
+) -> Dict[str, np.ndarray]:
+    """完整还款计划（闭式余额公式，按期向量化计算，无逐期循环）。
+
+    yearly=True 时按年汇总还款、利息与本金，余额取年末值。
+    """
+    _require(principal > 0, "principal must be positive")
+    _require(annual_rate_percent >= 0, "annual_rate_percent must not be negative")
+    _require(round(years * periods_per_year) >= 1, "years must be positive")
+    _require(interest_only_years >= 0, "interest_only_years must not be negative")
+    r = annual_rate_percent / 100.0 / periods_per_year
+    n = int(round(years * periods_per_year))
+    m = min(int(round(interest_only_years * periods_per_year)), n)
+    k = np.arange(1, n + 1, dtype=float)
+    # 只还利息期内余额不变；之后按剩余期数本息等额
+    payment_pi = float(pi_repayment(principal, annual_rate_percent, (n - m) / periods_per_year, periods_per_year)) if n > m else 0.0
+    j = np.maximum(k - m, 0.0)
+    if r > 0:
+        growth = np.power(1.0 + r, j)
+        balance = principal * growth - payment_pi * np.expm1(j * np.log1p(r)) / r
+    else:
+        balance = principal - payment_pi * j
+    balance = np.maximum(balance, 0.0)
+    balance[-1] = 0.0
+    opening = np.concatenate(([principal], balance[:-1]))
+    interest = opening * r
+    payment = np.where(k <= m, interest, opening + interest - balance)
+    schedule = {
+        "period": k.astype(int),
+        "payment": payment,
+        "interest": interest,
+        "principal": payment - interest,
+        "balance": balance,
+    }
+    if not yearly:
+        return schedule
+    starts = np.arange(0, n, periods_per_year)
+    return {
+        "year": np.arange(1, len(starts) + 1),
+        "payment": np.add.reduceat(payment, starts),
+        "interest": np.add.reduceat(interest, starts),
+        "principal": np.add.reduceat(payment - interest, starts),
+        "balance": balance[np.minimum(starts + periods_per_year, n) - 1],
+    }
+
+
+def _num(args: Dict[str, Any], key: str) -> Optional[float]:
+    value = args.get(key)
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def calculate(**args: Any) -> Dict[str, Any]:
+    """mortgage_calculator 工具实现：按给定参数输出所有可计算的指标（四舍五入到分）。
+
+    参数越界（期限或房价非正、利率为负、首付不在 [0, 100%) 等）时抛出 ValueError，
+    不把无意义的数字当作事实返回。
+    """
+    rate = _num(args, "annual_rate_percent")
+    years = _num(args, "term_years")
+    if rate is None or years is None:
+        raise ValueError("annual_rate_percent and term_years are required")
+    _require(rate >= 0, "annual_rate_percent must not be negative")
+    _require(years > 0, "term_years must be positive")
+    frequency = args.get("frequency") or "monthly"
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"unsupported frequency: {frequency}")
+    ppy = FREQUENCIES[frequency]
+    price = _num(args, "property_price")
+    _require(price is None or price > 0, "property_price must be positive")
+    principal = _num(args, "loan_amount")
+    if principal is None:
+        if price is None:
+            raise ValueError("either loan_amount or property_price is required")
+        deposit = _num(args, "deposit_amount")
+        deposit_percent = _num(args, "deposit_percent")
+        grants = _num(args, "grants") or 0.0
+        _require(deposit is None or 0 <= deposit < price, "deposit_amount must be in [0, property_price)")
+        _require(deposit_percent is None or 0 <= deposit_percent < 100, "deposit_percent must be in [0, 100)")
+        _require(grants >= 0, "grants must not be negative")
+        principal = float(loan_amount(price, deposit, deposit_percent, grants))
+    _require(principal > 0, "loan_amount must be positive")
+    io_years = _num(args, "interest_only_years") or 0.0
+    _require(0 <= io_years <= years, "interest_only_years must be in [0, term_years]")
+    if args.get("repayment_type") == "interest_only" and not io_years:
+        io_years = years
+
+    result: Dict[str, Any] = {
+        "loan_amount": principal,
+        "annual_rate_percent": rate,
+        "term_years": years,
+        "frequency": frequency,
+        "pi_repayment": float(pi_repayment(principal, rate, years, ppy)),
+        "total_interest": float(total_interest(principal, rate, years, ppy, io_years)),
+    }
+    if price:
+        result["property_price"] = price
+        result["lvr_percent"] = float(lvr(principal, price))
+    if io_years:
+        result["interest_only_years"] = io_years
+        result["io_repayment"] = float(io_repayment(principal, rate, ppy))
+        if io_years < years:
+            result["pi_repayment_after_io"] = float(pi_repayment(principal, rate, years - io_years, ppy))
+    result["total_repayments"] = principal + result["total_interest"]
+    offset = _num(args, "offset_balance")
+    _require(offset is None or offset >= 0, "offset_balance must not be negative")
+    if offset:
+        saved = offset_savings(principal, rate, years, offset, ppy)
+        result["offset_balance"] = offset
+        result["offset_interest_saved"] = float(saved["interest_saved"])
+        result["offset_periods_saved"] = float(saved["periods_saved"])
+    return {k: round(v, 2) if isinstance(v, float) else v for k, v in result.items()}
+
+
+def responses_tool_spec() -> Dict[str, Any]:
+    """Responses API 函数工具定义。"""
+    return {"type": "function", "name": TOOL_NAME, "description": TOOL_DESCRIPTION, "parameters": TOOL_PARAMETERS}
+
+
+def chat_tool_spec() -> Dict[str, Any]:
+    """Chat Completions（含 Azure）函数工具定义。"""
+    return {
+        "type": "function",
+        "function": {"name": TOOL_NAME, "description": TOOL_DESCRIPTION, "parameters": TOOL_PARAMETERS},
+    }
+
+
+def run_tool_call(name: str, arguments: Any) -> str:
+    """执行一次工具调用，返回 JSON 字符串；参数错误以 {"error": ...} 回传给模型。"""
+    if name != TOOL_NAME:
+        return json.dumps({"error": f"unknown tool: {name}"})
+    try:
+        args = json.loads(arguments or "{}") if isinstance(arguments, str) else dict(arguments or {})
+        return json.dumps(calculate(**args), ensure_ascii=False)
+    except (TypeError, ValueError) as exc:
+        return json.dumps({"error": str(exc)}, ensure_ascii=False)
@@ -0,0 +1,161 @@
+"""重试退避策略与进程级限流器。
+
+- retry_delay: 指数退避 + full jitter，优先遵循服务端 Retry-After / retry-after-ms /
+  x-ratelimit-reset-* 提示。
+- TokenBucketLimiter: 根据 x-ratelimit-remaining-* / x-ratelimit-reset-* 响应头学习
+  剩余配额，把剩余请求均匀摊到重置窗口内，在被 429 拒绝之前主动放慢节奏。
+"""
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+from config import RETRY_BASE_DELAY, RETRY_MAX_DELAY, RATE_LIMIT_BURST
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """解析 OpenAI 重置时长（如 "1s"、"6m0s"、"20ms"、"1h2m3.5s"），返回秒数。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for num, unit in _DURATION_PART.findall(value):
+        matched = True
+        n = float(num)
+        total += {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}[unit] * n
+    return total if matched else None
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """从响应头读取服务端建议的等待时间（秒）；没有提示返回 None。"""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000.0)
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    if ra:
+        try:
+            return max(0.0, float(ra))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if headers.get("x-ratelimit-remaining-requests") == "0":
+        return parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+    if headers.get("x-ratelimit-remaining-tokens") == "0":
+        return parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+    return None
+
+
+def retry_delay(
+    attempt: int,
+    headers: Optional[Mapping[str, str]] = None,
+    base: float = RETRY_BASE_DELAY,
+    cap: float = RETRY_MAX_DELAY,
+) -> float:
+    """第 attempt 次（从 1 开始）失败后的等待时间。
+
+    有服务端提示时以提示为下限并叠加少量抖动，避免所有会话同一时刻重试；
+    否则使用 full jitter：uniform(0, min(cap, base * 2 ** attempt))。
+    """
+    hint = retry_after_seconds(headers)
+    if hint is not None:
+        return min(cap, hint) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucketLimiter:
+    """进程级令牌桶：acquire() 在配额紧张时阻塞，observe() 从响应头学习速率。"""
+
+    def __init__(self, burst: int = RATE_LIMIT_BURST):
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        # 每秒补充的请求数；None 表示尚未从响应头学到配额，不做节流
+        self.rate: Optional[float] = None
+        self.paused_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.tokens = min(float(self.burst), self.tokens + (now - self._last) * self.rate)
+        else:
+            self.tokens = float(self.burst)
+        self._last = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """取一个令牌；超时返回 False（调用方可继续发送，由服务端裁决）。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate if self.rate else 0.05
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def observe(self, headers: Optional[Mapping[str, str]]) -> None:
+        """根据 x-ratelimit-* 响应头更新补充速率：剩余请求数 / 距离重置的秒数。"""
+        if not headers:
+            return
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        reset = parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+        tokens_left = headers.get("x-ratelimit-remaining-tokens")
+        tokens_reset = parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining is not None and reset:
+                try:
+                    left = max(0, int(remaining))
+                except ValueError:
+                    left = None
+                if left is not None:
+                    self.rate = max(left / reset, 0.1)
+                    self.tokens = min(self.tokens, float(left))
+                    if left == 0:
+                        self.paused_until = max(self.paused_until, now + reset)
+            if tokens_left == "0" and tokens_reset:
+                self.paused_until = max(self.paused_until, now + tokens_reset)
+
+    def penalize(self, delay: float) -> None:
+        """收到 429 后暂停整个进程的发送，并清空令牌。"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = 0.0
+            self._last = now
+            self.paused_until = max(self.paused_until, now + max(0.0, delay))
+
+
+_LIMITERS: Dict[str, TokenBucketLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(key: str) -> TokenBucketLimiter:
+    """按提供商返回进程内共享的限流器。"""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            limiter = TokenBucketLimiter()
+            _LIMITERS[key] = limiter
+        return limiter
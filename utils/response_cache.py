@@ -0,0 +1,185 @@
+"""精确匹配的回答缓存：进程内 LRU + SQLite 持久层。
+
+缓存键为规范化消息列表、模型、提供商、推理开关与搜索开关的哈希；
+开启网络搜索的回答（如现金利率）使用更短的 TTL。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    CACHE_DIR,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ITEMS,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_SEARCH_TTL,
+)
+
+
+def _normalise_text(text: Any) -> str:
+    # 折叠空白，避免仅因换行/多余空格导致缓存未命中
+    return " ".join(str(text or "").split())
+
+
+def make_cache_key(
+    messages: List[Dict[str, Any]],
+    model: str,
+    provider: str,
+    reasoning: bool = False,
+    use_web_search: bool = False,
+    max_tokens: Optional[int] = None,
+    use_tools: bool = False,
+) -> str:
+    """对规范化后的请求内容求 SHA-256，作为缓存键（是否提供函数工具也区分缓存键）。"""
+    normalised = [
+        [str(m.get("role") or "user"), _normalise_text(m.get("content"))]
+        for m in messages
+        if isinstance(m, dict)
+    ]
+    blob = json.dumps(
+        {
+            "messages": normalised,
+            "model": model,
+            "provider": provider,
+            "reasoning": bool(reasoning),
+            "web_search": bool(use_web_search),
+            "max_tokens": max_tokens,
+            "tools": bool(use_tools),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """两级缓存：内存 LRU 命中最快；SQLite 层在进程重启后仍可命中。"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_items: int = RESPONSE_CACHE_MAX_ITEMS,
+        default_ttl: int = RESPONSE_CACHE_TTL,
+        search_ttl: int = RESPONSE_CACHE_SEARCH_TTL,
+    ):
+        self.path = path or os.path.join(CACHE_DIR, "response_cache.sqlite3")
+        self.max_items = max(1, max_items)
+        self.default_ttl = default_ttl
+        self.search_ttl = search_ttl
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._open_db()
+
+    def _open_db(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as exc:
+            print(f"⚠️ 回答缓存持久层不可用，仅使用内存缓存: {exc}")
+            self._conn = None
+
+    def ttl_for(self, use_web_search: bool) -> int:
+        return self.search_ttl if use_web_search else self.default_ttl
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return item[0]
+                del self._memory[key]
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row and row[1] > now:
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0 or not value:
+            return
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at),
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as exc:
+                    print(f"⚠️ 回答缓存写入失败: {exc}")
+
+    def purge_expired(self) -> int:
+        """删除持久层中已过期的条目，返回删除数量。"""
+        with self._lock:
+            if self._conn is None:
+                return 0
+            try:
+                cur = self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                self._conn.commit()
+                return cur.rowcount
+            except sqlite3.Error:
+                return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / total) if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+
+_SHARED_CACHE: Optional[ResponseCache] = None
+_SHARED_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """返回进程级共享缓存；RESPONSE_CACHE_ENABLED=false 时返回 None。"""
+    global _SHARED_CACHE
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _SHARED_CACHE_LOCK:
+        if _SHARED_CACHE is None:
+            _SHARED_CACHE = ResponseCache()
+        return _SHARED_CACHE
@@ -0,0 +1,165 @@
+"""回答文本的 Markdown / LaTeX 分段解析（与 Streamlit 渲染解耦）。
+
+解析结果按内容缓存（进程级 LRU，所有会话共享）：历史消息在每次重跑时
+直接复用已解析的分段，只有新消息需要真正扫描。
+
+流式生成中的回答使用 IncrementalRichText：解析状态跨增量保留，已完成的分段
+只提交一次，每次只重新扫描/渲染未闭合的尾部，总开销与回答长度成线性。
+"""
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from config import RICH_TEXT_CACHE_SIZE
+
+# ("md" | "latex", 文本)；流式尾部另有 "pending"（尚未闭合的公式正文）
+Segment = Tuple[str, str]
+
+_FENCE_PAT = re.compile(r"```latex\n(.*?)\n```", re.DOTALL | re.IGNORECASE)
+
+
+def _split_block_math(chunk: str) -> Tuple[Segment, ...]:
+    """按 $$...$$ 切分；未闭合的 $$ 按普通 Markdown 处理。"""
+    parts = []
+    pos = 0
+    while True:
+        start = chunk.find("$$", pos)
+        if start == -1:
+            parts.append(("md", chunk[pos:]))
+            break
+        end = chunk.find("$$", start + 2)
+        if end == -1:
+            parts.append(("md", chunk[pos:]))
+            break
+        if start > pos:
+            parts.append(("md", chunk[pos:start]))
+        parts.append(("latex", chunk[start + 2 : end].strip()))
+        pos = end + 2
+    return tuple(parts)
+
+
+@lru_cache(maxsize=RICH_TEXT_CACHE_SIZE)
+def parse_rich_text(content: str) -> Tuple[Segment, ...]:
+    """把文本拆成 Markdown 与 LaTeX 分段：```latex``` 围栏与 $$...$$ 块为公式。
+
+    Markdown 分段中的 '$' 已替换为 'AUD'，避免被当作行内公式；空分段已去除。
+    结果为不可变元组，可安全地跨会话共享。
+    """
+    parts = []
+    idx = 0
+    for m in _FENCE_PAT.finditer(content):
+        if m.start() > idx:
+            parts.extend(_split_block_math(content[idx:m.start()]))
+        parts.append(("latex", m.group(1).strip()))
+        idx = m.end()
+    if idx < len(content):
+        parts.extend(_split_block_math(content[idx:]))
+    return tuple(
+        (kind, chunk if kind == "latex" else chunk.replace("$", "AUD"))
+        for kind, chunk in parts
+        if chunk
+    )
+
+
+_LATEX_FENCE = "```latex\n"
+# Markdown 状态下关心的事件：公式/代码围栏定界符与段落边界
+_MD_EVENT = re.compile(r"\$\$|```|\n\n")
+
+
+class IncrementalRichText:
+    """流式回答的增量分段解析。
+
+    - feed() 追加增量，只从上次停下的位置继续扫描；
+    - 闭合的公式与完整的 Markdown 段落（空行结尾，且不在代码块内）提交到 segments，之后不再变化；
+    - tail() 返回未提交的尾部：未闭合的公式以 "pending" 返回（界面按代码显示，不在
+      Markdown 与公式之间来回闪烁），末尾可能是半个定界符的字符暂不显示。
+
+    流结束后回答进入历史区，按完整消息用 parse_rich_text 渲染（未闭合的定界符按
+    Markdown 处理），因此这里不需要收尾步骤。
+    """
+
+    def __init__(self):
+        self.segments: List[Segment] = []
+        self._buf = ""  # 未提交的文本（已提交部分即时丢弃）
+        self._open: Optional[str] = None  # 未闭合的公式定界符："$$" 或 "```latex"
+        self._scan = 0  # _buf 中下次查找的起点
+        self._hold: Optional[int] = None  # 可能是不完整 ```latex 围栏的位置，之后的内容暂不显示
+        self._in_code = False  # 是否处于普通 ``` 代码块内（代码块内不按段落切分）
+
+    @property
+    def pending_chars(self) -> int:
+        """未提交部分的长度：每次轮询重新扫描与渲染的量只与它有关，与回答总长无关。"""
+        return len(self._buf)
+
+    def feed(self, delta: str) -> int:
+        """追加一段增量，返回新提交的分段数。"""
+        if not delta:
+            return 0
+        before = len(self.segments)
+        self._buf += delta
+        while self._step():
+            pass
+        return len(self.segments) - before
+
+    def _commit(self, kind: str, text: str, consumed: int) -> None:
+        if kind == "md":
+            text = text.replace("$", "AUD")
+        if text:
+            self.segments.append((kind, text))
+        self._buf = self._buf[consumed:]
+        self._scan = 0
+
+    def _step(self) -> bool:
+        buf = self._buf
+        self._hold = None
+        if self._open is not None:
+            opener, closer = ("$$", "$$") if self._open == "$$" else (_LATEX_FENCE, "\n```")
+            end = buf.find(closer, max(self._scan, len(opener)))
+            if end == -1:
+                # 定界符可能跨增量到达：下次从末尾往回 len(closer)-1 处继续
+                self._scan = max(len(opener), len(buf) - len(closer) + 1)
+                return False
+            self._open = None
+            self._commit("latex", buf[len(opener) : end].strip(), end + len(closer))
+            return True
+
+        m = _MD_EVENT.search(buf, self._scan)
+        if m is None:
+            # 事件标记最长 3 个字符，末尾 2 个字符可能是其前半
+            self._scan = max(0, len(buf) - 2)
+            return False
+        pos, token = m.start(), m.group()
+        if token == "$$":
+            self._commit("md", buf[:pos], pos)
+            self._open = "$$"
+            return True
+        if token == "```":
+            head = buf[pos : pos + len(_LATEX_FENCE)].lower()
+            if not self._in_code and head == _LATEX_FENCE:
+                self._commit("md", buf[:pos], pos)
+                self._open = "```latex"
+                return True
+            if not self._in_code and len(head) < len(_LATEX_FENCE) and _LATEX_FENCE.startswith(head):
+                self._scan = self._hold = pos
+                return False
+            self._in_code = not self._in_code
+            self._scan = pos + 3
+            return True
+        # 空行：在代码块外提交到此为止的段落
+        if self._in_code:
+            self._scan = pos + 1
+            return True
+        self._commit("md", buf[: pos + 2], pos + 2)
+        return True
+
+    def tail(self) -> Tuple[Segment, ...]:
+        """未提交的尾部（每次轮询只需重新渲染这一部分）。"""
+        buf = self._buf
+        if self._open is not None:
+            opener = "$$" if self._open == "$$" else _LATEX_FENCE
+            return (("pending", buf[len(opener) :].strip()),)
+        if self._hold is not None:
+            buf = buf[: self._hold]
+        elif buf.endswith("$"):
+            buf = buf[:-1]  # 可能是 $$ 的前半
+        return (("md", buf.replace("$", "AUD")),) if buf else ()
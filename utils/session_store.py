@@ -0,0 +1,284 @@
+"""会话换出：空闲会话的对话记录落盘到 SQLite（WAL），内存中只保留活跃会话。
+
+- SessionManager 按 LRU 顺序持有各会话的 AustralianMortgageBroker；
+- 空闲超过 SESSION_IDLE_SECONDS、或活跃会话数/估算内存超过上限时，最久未用的会话
+  （当前没有脚本运行持有它）被写入 SQLite 并从内存移除；
+- 下次访问时从 SQLite 重建：对话记录、历史窗口、滚动摘要与尚未折叠的旧轮次；
+- 全局锁只保护会话表本身：SQLite 读写与 broker 构建都在锁外进行（加载中的会话先放入
+  占位条目，同一会话的其他访问等待该条目就绪），不会让其他会话等某个会话的磁盘 I/O；
+- 空闲会话由后台线程每 SESSION_SWEEP_SECONDS 秒清扫一次，不依赖其他会话的访问。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import (
+    CACHE_DIR,
+    SESSION_IDLE_SECONDS,
+    SESSION_MAX_BYTES,
+    SESSION_MAX_LIVE,
+    SESSION_RETENTION_DAYS,
+    SESSION_SWEEP_SECONDS,
+)
+from utils.metrics import METRICS
+
+
+class _Entry:
+    # ready：broker 已加载（占位条目在锁外加载完成后置位）
+    # version：每次被持有时递增；换出写盘期间若被再次持有则放弃移除
+    __slots__ = ("broker", "last_used", "leases", "nbytes", "ready", "version", "spilling")
+
+    def __init__(self, broker: Any = None):
+        self.broker = broker
+        self.last_used = time.time()
+        self.leases = 0
+        self.nbytes = 0
+        self.ready = threading.Event()
+        self.version = 0
+        self.spilling = False
+
+
+class SessionManager:
+    """进程级会话表：LRU + 内存上限，超限或空闲的会话换出到 SQLite。"""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        path: Optional[str] = None,
+        max_live: int = SESSION_MAX_LIVE,
+        max_bytes: int = SESSION_MAX_BYTES,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        retention_days: float = SESSION_RETENTION_DAYS,
+        sweep_seconds: float = SESSION_SWEEP_SECONDS,
+    ):
+        self.factory = factory
+        self.path = path or os.path.join(CACHE_DIR, "sessions.sqlite3")
+        self.max_live = max(1, max_live)
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.retention_days = retention_days
+        self._live: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 共享的 SQLite 连接只允许一个线程同时使用（与会话表的锁分开）
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.spilled = 0
+        self.rehydrated = 0
+        self._open_db()
+        if sweep_seconds > 0:
+            self._start_sweeper(sweep_seconds)
+
+    def _start_sweeper(self, interval: float) -> None:
+        """后台定时清扫空闲会话；只持有弱引用，管理器被回收后线程自行退出。"""
+        ref = weakref.ref(self)
+
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                manager = ref()
+                if manager is None:
+                    return
+                manager.spill_idle()
+                del manager
+
+        threading.Thread(target=run, name="session-sweeper", daemon=True).start()
+
+    def _open_db(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, pending TEXT NOT NULL,"
+                " history_len INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,"
+                " content TEXT NOT NULL, ts REAL NOT NULL, in_context INTEGER NOT NULL,"
+                " PRIMARY KEY (session_id, seq))"
+            )
+            if self.retention_days > 0:
+                # 超过保留期未再访问的会话（浏览器已关闭）直接删除
+                cutoff = time.time() - self.retention_days * 86400
+                conn.execute("DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)", (cutoff,))
+                conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as exc:
+            print(f"⚠️ 会话持久层不可用，空闲会话将常驻内存: {exc}")
+            self._conn = None
+
+    @contextmanager
+    def lease(self, session_id: str) -> Iterator[Any]:
+        """在一次脚本运行期间持有会话的 broker；持有期间不会被换出。"""
+        entry = self._acquire(session_id)
+        try:
+            yield entry.broker
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                entry.last_used = time.time()
+                entry.nbytes = entry.broker.store.memory_report()["approx_bytes"]
+                victims = self._select_victims()
+            self._spill_all(victims)
+
+    def _acquire(self, session_id: str) -> _Entry:
+        while True:
+            with self._lock:
+                entry = self._live.get(session_id)
+                loader = entry is None
+                if loader:
+                    # 占位条目：加载在锁外进行，同一会话的其他访问等待 ready
+                    entry = self._live[session_id] = _Entry()
+                self._live.move_to_end(session_id)
+                entry.leases += 1
+                entry.version += 1
+            if loader:
+                try:
+                    entry.broker = self._load(session_id)
+                except BaseException:
+                    with self._lock:
+                        entry.leases -= 1
+                        if self._live.get(session_id) is entry:
+                            del self._live[session_id]
+                    entry.ready.set()
+                    raise
+                entry.ready.set()
+                return entry
+            entry.ready.wait()
+            if entry.broker is not None:
+                return entry
+            # 加载失败的占位条目已移除：重新登记
+            with self._lock:
+                entry.leases -= 1
+
+    def _select_victims(self) -> List[Tuple[str, _Entry, int]]:
+        """（持锁调用）从最久未用的会话开始挑选需换出的会话，直到满足空闲时间、会话数与内存上限。"""
+        if self._conn is None:
+            return []
+        now = time.time()
+        live = len(self._live)
+        total = sum(e.nbytes for e in self._live.values())
+        victims = []
+        for session_id, entry in self._live.items():
+            over = live > self.max_live or (self.max_bytes > 0 and total > self.max_bytes)
+            idle = now - entry.last_used > self.idle_seconds
+            if not over and not idle:
+                # 其余会话更新，不会更空闲
+                break
+            if entry.leases or entry.spilling or not entry.ready.is_set():
+                continue
+            entry.spilling = True
+            victims.append((session_id, entry, entry.version))
+            live -= 1
+            total -= entry.nbytes
+        return victims
+
+    def _spill_all(self, victims: List[Tuple[str, _Entry, int]]) -> None:
+        """（不持锁）写盘；写盘期间会话被再次持有则保留在内存中。"""
+        for session_id, entry, version in victims:
+            written = self._spill(session_id, entry)
+            with self._lock:
+                entry.spilling = False
+                if written and entry.leases == 0 and entry.version == version and self._live.get(session_id) is entry:
+                    del self._live[session_id]
+                    self.spilled += 1
+                    METRICS.inc("broker_sessions_spilled_total")
+
+    def _spill(self, session_id: str, entry: _Entry) -> bool:
+        broker = entry.broker
+        store = broker.store
+        summarizer = broker.summarizer
+        rows = [(session_id, i, t.role, t.content, t.ts, int(t.in_context)) for i, t in enumerate(store.turns)]
+        meta = (
+            session_id,
+            summarizer.summary,
+            json.dumps(summarizer.unsummarized(), ensure_ascii=False),
+            len(store.history),
+            time.time(),
+        )
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._conn.executemany(
+                    "INSERT INTO turns (session_id, seq, role, content, ts, in_context) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, summary, pending, history_len, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    meta,
+                )
+        except sqlite3.Error as exc:
+            print(f"⚠️ 会话换出失败: {exc}")
+            return False
+        return True
+
+    def _load(self, session_id: str) -> Any:
+        """新建 broker；若该会话曾被换出则从 SQLite 恢复（不持会话表的锁）。"""
+        broker = self.factory()
+        if self._conn is None:
+            return broker
+        try:
+            with self._db_lock:
+                meta = self._conn.execute(
+                    "SELECT summary, pending, history_len FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if meta is None:
+                    return broker
+                rows = self._conn.execute(
+                    "SELECT role, content, ts, in_context FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+                ).fetchall()
+        except sqlite3.Error as exc:
+            print(f"⚠️ 会话恢复失败，将以空会话继续: {exc}")
+            return broker
+        store = broker.store
+        for role, content, ts, in_context in rows:
+            store.append(role, content, bool(in_context), ts)
+        # 窗口之外的消息已在摘要或待折叠列表中
+        store.evict_overflow(meta[2])
+        broker.summarizer.summary = meta[0]
+        broker.summarizer.evict(json.loads(meta[1]))
+        with self._lock:
+            self.rehydrated += 1
+        METRICS.inc("broker_sessions_rehydrated_total")
+        return broker
+
+    def spill_idle(self) -> None:
+        """立即按当前策略换出（lease 结束时与后台清扫线程自动执行）。"""
+        with self._lock:
+            victims = self._select_victims()
+        self._spill_all(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "live_sessions": sum(1 for e in self._live.values() if e.ready.is_set()),
+                "live_bytes": sum(e.nbytes for e in self._live.values()),
+                "spilled": self.spilled,
+                "rehydrated": self.rehydrated,
+            }
+
+
+_SHARED_MANAGER: Optional[SessionManager] = None
+_SHARED_MANAGER_LOCK = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """进程内共享的会话表（所有 Streamlit 会话共用）。"""
+    global _SHARED_MANAGER
+    if _SHARED_MANAGER is None:
+        with _SHARED_MANAGER_LOCK:
+            if _SHARED_MANAGER is None:
+                from utils.broker_logic import AustralianMortgageBroker  # 避免循环导入
+
+                _SHARED_MANAGER = SessionManager(AustralianMortgageBroker)
+    return _SHARED_MANAGER
@@ -0,0 +1,101 @@
+"""Single-flight：相同指纹的并发请求只打一次上游，其余调用等待并共享结果。
+
+leader 被取消或中途关闭（非上游错误）时，follower 收到 LeaderAborted，应自行重新
+登记并发起请求；只有真实的上游错误才会传给 follower。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.cancellation import check_cancelled
+
+# follower 分段等待的间隔：期间检查本线程的取消标记
+_WAIT_SLICE = 0.1
+
+
+class LeaderAborted(Exception):
+    """leader 未完成即被取消/关闭：follower 需要自己请求上游。"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """按 key 合并进行中的调用。
+
+    do() 适用于普通函数；流式场景可用 begin()/finish() 手动控制：
+    leader 在流结束（或失败）时调用 finish()，follower 通过 wait() 取结果。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def begin(self, key: str) -> Tuple[_Call, bool]:
+        """登记一次调用；返回 (call, 是否为 leader)。"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.coalesced += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            return call, True
+
+    def finish(self, key: str, call: _Call, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    @staticmethod
+    def wait(call: _Call, timeout: Optional[float] = None) -> Any:
+        """等待 leader 完成并返回其结果；leader 失败时抛出同一异常，被中断时抛出 LeaderAborted。
+
+        分段等待，期间本线程的生成被取消时抛出 GenerationCancelled（不影响 leader）。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            check_cancelled()
+            remaining = _WAIT_SLICE if deadline is None else min(_WAIT_SLICE, deadline - time.monotonic())
+            if remaining <= 0:
+                raise TimeoutError("single-flight leader did not finish in time")
+            if call.done.wait(remaining):
+                break
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """执行 fn 或等待相同 key 的进行中调用；返回 (结果, 是否共享了他人的结果)。
+
+        leader 被取消时 follower 重新登记（可能成为新的 leader 自己执行 fn）。
+        """
+        call, leader = self.begin(key)
+        while not leader:
+            try:
+                return self.wait(call, timeout), True
+            except LeaderAborted:
+                call, leader = self.begin(key)
+        try:
+            result = fn()
+        except Exception as exc:
+            self.finish(key, call, error=exc)
+            raise
+        except BaseException:
+            # 取消（GenerationCancelled 等）只影响 leader 自己
+            self.finish(key, call, error=LeaderAborted())
+            raise
+        self.finish(key, call, result=result)
+        return result, False
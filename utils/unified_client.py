@@ -1,23 +1,107 @@
 import os
 import json
 import time
+import threading
 import requests
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Union, Tuple
 from openai import OpenAI
 from config import (
     OPENAI_API_KEY_VAR,
-    OPENAI_CHAT_URL,
+    OPENAI_BASE_URL,
+    PROMPT_CACHE_KEY,
     MODEL_NAME,
     MODEL_PROVIDER,
     AZURE_OPENAI_API_KEY_VAR,
     AZURE_OPENAI_ENDPOINT_VAR,
     AZURE_OPENAI_DEPLOYMENT_VAR,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    FAILOVER_PROVIDERS,
+    MAX_TOOL_ROUNDS,
 )
+from utils.model_probe import load_probe, save_probe, is_fresh
+from utils.rate_limit import get_rate_limiter, retry_delay
+from utils.response_cache import get_response_cache, make_cache_key
+from utils.singleflight import LeaderAborted, SingleFlight
+from utils.cancellation import GenerationCancelled, bind_response, check_cancelled
+from utils.metrics import METRICS, RequestMetrics, TimedHTTPAdapter, reset_connect_timer, take_connect_ms
+from utils.mortgage_calc import chat_tool_spec, responses_tool_spec, run_tool_call
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+# 可重试的 HTTP 状态码（另加所有 5xx）：客户端内重试，重试耗尽后也可故障转移到其他后端
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class UpstreamHTTPError(Exception):
+    """上游返回的 HTTP 错误，保留状态码供故障转移区分可重试与请求本身的错误。"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS or self.status_code >= 500
+
+
+def _wrap_error(prefix: str, exc: Exception) -> Exception:
+    """给上游异常加上前缀；带状态码的（含 SDK 的 APIStatusError）保留为 UpstreamHTTPError。"""
+    status = getattr(exc, "status_code", None)
+    message = f"{prefix}: {exc}"
+    return UpstreamHTTPError(status, message) if isinstance(status, int) else Exception(message)
+
+
+def _build_http_session() -> requests.Session:
+    """创建带长连接池的 requests.Session（重试由 _request_with_retry 统一处理）。"""
+    session = requests.Session()
+    # TimedHTTPAdapter 额外记录新建连接（TCP + TLS）耗时
+    adapter = TimedHTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def _field(obj: Any, name: str) -> Any:
+    """同时兼容 dict（REST JSON）与 SDK 对象（Azure）的字段读取。"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _chat_tool_calls(tool_calls: Any) -> List[Dict[str, str]]:
+    """把 Chat Completions 的 tool_calls 归一化为 {id, name, arguments}。"""
+    calls = []
+    for tc in tool_calls or []:
+        fn = _field(tc, "function")
+        calls.append(
+            {
+                "id": _field(tc, "id") or "",
+                "name": _field(fn, "name") or "",
+                "arguments": _field(fn, "arguments") or "{}",
+            }
+        )
+    return calls
+
+
+def _accumulate_tool_deltas(pending: Dict[int, Dict[str, str]], tool_deltas: Any) -> None:
+    """流式 tool_calls 按 index 分片到达：id/name 取首个非空值，arguments 逐段拼接。"""
+    for tc in tool_deltas or []:
+        slot = pending.setdefault(_field(tc, "index") or 0, {"id": "", "name": "", "arguments": ""})
+        slot["id"] = slot["id"] or _field(tc, "id") or ""
+        fn = _field(tc, "function")
+        if fn is not None:
+            slot["name"] = slot["name"] or _field(fn, "name") or ""
+            slot["arguments"] += _field(fn, "arguments") or ""
+
+
 class UnifiedAIClient:
     """统一的AI客户端（支持 OpenAI 与 Azure OpenAI）。"""
 
@@ -27,14 +111,30 @@ class UnifiedAIClient:
         provider: str = MODEL_PROVIDER,
         timeout: int = 60,
         max_retries: int = 3,
+        base_url: Optional[str] = None,
+        prompt_cache_key: Optional[str] = PROMPT_CACHE_KEY,
     ):
         self.model = model or "gpt-4o-mini"
         self.provider = (provider or "openai").strip().lower()
         self.timeout = timeout
         self.max_retries = max_retries
 
-        self.api_url = OPENAI_CHAT_URL
-        self.responses_api_url = "https://api.openai.com/v1/responses"
+        base = (base_url or OPENAI_BASE_URL).rstrip("/")
+        self.base_url = base
+        self.api_url = f"{base}/chat/completions"
+        self.responses_api_url = f"{base}/responses"
+        self.models_api_url = f"{base}/models"
+        self._probe_thread: Optional[threading.Thread] = None
+        # 同一提供商的所有客户端共用一个限流器
+        self.rate_limiter = get_rate_limiter(self.provider)
+        # 进程级精确匹配回答缓存（可通过 RESPONSE_CACHE_ENABLED 关闭）
+        self.response_cache = get_response_cache()
+        # 相同指纹的并发请求合并为一次上游调用
+        self._inflight = SingleFlight()
+        # 每个线程（即每次调用方）独立的当前/最近一次调用指标
+        self._local = threading.local()
+        # 上游提示缓存路由键：让共享同一系统提示前缀的请求落到同一缓存
+        self.prompt_cache_key = prompt_cache_key
 
         if self.provider == "azure":
             self.session = None
@@ -46,6 +146,7 @@ class UnifiedAIClient:
             if not self.azure_endpoint:
                 raise ValueError("Missing AZURE_OPENAI_ENDPOINT")
 
+            # SDK 客户端自带连接池；随共享注册表复用即可保持长连接
             self.azure_client = OpenAI(
                 api_key=self.api_key,
                 base_url=self.azure_endpoint,
@@ -55,15 +156,16 @@ class UnifiedAIClient:
             # Azure Responses API 尚未全面开放，关闭 Responses 模式
             self.use_responses = False
         else:
-            self.session = requests.Session()
+            self.session = _build_http_session()
             self.api_key = os.getenv(OPENAI_API_KEY_VAR)
             if not self.api_key:
                 print("⚠️ OPENAI_API_KEY 未设置")
 
-            # 预探测模型是否存在（忽略失败）
-            self.model_available = self._probe_model(self.model)
-            # 模型能力探测（启用 Responses API & 工具）
-            self.use_responses = str(self.model).lower().startswith("gpt-5")
+            # 能力标志取自磁盘缓存；缺失或过期时在后台刷新，构造过程不等待网络
+            record = load_probe(self.provider, self.model)
+            self._apply_probe(record)
+            if not is_fresh(record):
+                self._refresh_probe_async()
 
     def _headers(self) -> Dict[str, str]:
         if not self.api_key:
@@ -80,46 +182,101 @@ class UnifiedAIClient:
             "Content-Type": "application/json",
         }
 
-    def _probe_model(self, model: str) -> bool:
+    def _probe_model(self, model: str) -> Optional[bool]:
+        """查询单个模型（GET /v1/models/{id}）；网络异常返回 None 表示结果未知。"""
         try:
-            url = "https://api.openai.com/v1/models"
+            url = f"{self.models_api_url}/{model}"
             resp = self.session.get(url, headers=self._headers(), timeout=10)
             if resp.status_code == 200:
-                data = resp.json()
-                ids = {m.get("id") for m in data.get("data", [])}
-                return model in ids
+                return True
+            if resp.status_code == 404:
+                return False
         except Exception:
-            return False
-        return False
+            return None
+        return None
+
+    def _apply_probe(self, record: Optional[Dict[str, Any]]) -> None:
+        if record:
+            self.model_available = bool(record.get("available", True))
+            self.use_responses = bool(record.get("use_responses", False))
+        else:
+            # 尚无探测结果：乐观假定模型可用，按模型名推断能力（启用 Responses API & 工具）
+            self.model_available = True
+            self.use_responses = str(self.model).lower().startswith("gpt-5")
+
+    def _refresh_probe(self) -> None:
+        available = self._probe_model(self.model)
+        if available is None:
+            return
+        use_responses = str(self.model).lower().startswith("gpt-5")
+        self._apply_probe(save_probe(self.provider, self.model, available, use_responses))
 
-    def _request_with_retry(self, payload: Dict[str, Any], *, url: Optional[str] = None) -> requests.Response:
+    def _refresh_probe_async(self) -> None:
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(
+            target=self._refresh_probe,
+            name=f"model-probe-{self.model}",
+            daemon=True,
+        )
+        self._probe_thread.start()
+
+    def _request_with_retry(
+        self,
+        payload: Dict[str, Any],
+        *,
+        url: Optional[str] = None,
+        stream: bool = False,
+    ) -> requests.Response:
         last_error: Optional[str] = None
+        metrics = self._current_metrics()
         for attempt in range(1, self.max_retries + 1):
+            headers = None
+            if metrics is not None:
+                metrics.retries = attempt - 1
+            check_cancelled()
             try:
+                # 进程级限流：配额紧张时在发送前等待，而不是等服务端返回 429
+                self.rate_limiter.acquire(timeout=self.timeout)
+                reset_connect_timer()
                 start = time.time()
+                # 始终以流方式接收：post 返回时仅收到响应头，可单独测得 TTFB
                 resp = self.session.post(
                     url or self.api_url,
                     headers=self._headers(),
                     data=json.dumps(payload),
                     timeout=self.timeout,
+                    stream=True,
                 )
-                latency = (time.time() - start) * 1000
+                # 后台生成任务取消时关闭该响应，中断阻塞的读取
+                bind_response(resp)
+                if metrics is not None:
+                    metrics.ttfb_ms = (time.time() - start) * 1000
+                    metrics.connect_ms += take_connect_ms()
+                headers = resp.headers
+                self.rate_limiter.observe(headers)
                 if resp.status_code == 200:
-                    resp.latency_ms = latency  # type: ignore
+                    if not stream:
+                        _ = resp.content  # 读取完整响应体
+                    resp.latency_ms = (time.time() - start) * 1000  # type: ignore
                     return resp
-                if resp.status_code in (408, 429, 500, 502, 503, 504):
+                if resp.status_code in RETRYABLE_STATUS:
                     last_error = f"HTTP {resp.status_code} {resp.text[:120]}"
-                    time.sleep(1 + attempt * 0.5)
+                    resp.close()
+                    if attempt < self.max_retries:
+                        delay = retry_delay(attempt, headers)
+                        if resp.status_code == 429:
+                            self.rate_limiter.penalize(delay)
+                        time.sleep(delay)
                     continue
-                raise Exception(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                raise UpstreamHTTPError(resp.status_code, f"HTTP {resp.status_code}: {resp.text[:200]}")
             except requests.exceptions.SSLError as e:
                 last_error = f"SSL Error: {str(e)}"
-                time.sleep(1 + attempt * 0.5)
-                continue
             except requests.exceptions.RequestException as e:
+                check_cancelled()
                 last_error = f"Network Error: {str(e)}"
-                time.sleep(1 + attempt * 0.5)
-                continue
+            if attempt < self.max_retries:
+                time.sleep(retry_delay(attempt, headers))
         raise Exception(last_error or "Unknown network error")
 
     def _sanitize_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -129,6 +286,10 @@ class UnifiedAIClient:
         """
         sanitized: List[Dict[str, Any]] = []
         for m in messages:
+            if type(m) is dict and len(m) == 2 and m.get("role") and type(m.get("content")) is str:
+                # 已是 API 形状（如会话存储中的缓存消息）：直接复用，不再复制
+                sanitized.append(m)
+                continue
             if not isinstance(m, dict):
                 # Fallback: convert to user text
                 sanitized.append({"role": "user", "content": str(m)})
@@ -151,97 +312,584 @@ class UnifiedAIClient:
             sanitized.append({"role": role, "content": str(content)})
         return sanitized
 
-    def _generate_via_azure(self, messages: List[Dict[str, Any]], max_tokens: int, use_web_search: bool) -> str:
+    def _generate_via_azure(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        use_web_search: bool,
+        use_tools: bool = False,
+    ) -> str:
         if use_web_search:
             print("ℹ️ Azure OpenAI 当前不支持模型内置 Web Search 工具，已忽略 use_web_search 参数。")
 
         sanitized_messages = self._sanitize_messages(messages)
-        try:
-            completion = self.azure_client.chat.completions.create(  # type: ignore[attr-defined]
-                model=self.azure_deployment,
-                messages=sanitized_messages,
-                max_completion_tokens=max_tokens,
-            )
-        except Exception as exc:
-            raise Exception(f"Azure OpenAI call failed: {exc}")
+        extra: Dict[str, Any] = {"tools": [chat_tool_spec()]} if use_tools else {}
+        metrics = self._current_metrics()
+        rounds = 0
+        while True:
+            self.rate_limiter.acquire(timeout=self.timeout)
+            try:
+                completion = self.azure_client.chat.completions.create(  # type: ignore[attr-defined]
+                    model=self.azure_deployment,
+                    messages=sanitized_messages,
+                    max_completion_tokens=max_tokens,
+                    **extra,
+                )
+            except Exception as exc:
+                raise _wrap_error("Azure OpenAI call failed", exc)
 
-        message = completion.choices[0].message
-        text = getattr(message, "content", None)
-        if isinstance(message, dict):
-            text = message.get("content")
+            if metrics is not None:
+                metrics.endpoint = "azure-chat"
+                if metrics.ttfb_ms is None:
+                    metrics.ttfb_ms = metrics.elapsed_ms()
+                metrics.add_usage(getattr(completion, "usage", None))
+            message = completion.choices[0].message
+            calls = _chat_tool_calls(_field(message, "tool_calls"))
+            if not calls or rounds >= MAX_TOOL_ROUNDS:
+                break
+            rounds += 1
+            self._append_chat_tool_results(sanitized_messages, _field(message, "content"), calls)
+        text = _field(message, "content")
         if not text:
             raise Exception(f"Empty response: {completion}")
         return str(text).strip()
 
-    def generate_response(self, messages: List[dict], max_tokens: int = 1500, use_web_search: bool = False) -> str:
-        if self.provider == "azure":
-            return self._generate_via_azure(messages, max_tokens, use_web_search)
+    def _stream_via_azure(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        use_web_search: bool,
+        use_tools: bool = False,
+    ) -> Iterator[str]:
+        if use_web_search:
+            print("ℹ️ Azure OpenAI 当前不支持模型内置 Web Search 工具，已忽略 use_web_search 参数。")
+
+        sanitized_messages = self._sanitize_messages(messages)
+        extra: Dict[str, Any] = {"tools": [chat_tool_spec()]} if use_tools else {}
+        metrics = self._current_metrics()
+        got_text = False
+        rounds = 0
+        while True:
+            self.rate_limiter.acquire(timeout=self.timeout)
+            try:
+                chunks = self.azure_client.chat.completions.create(  # type: ignore[attr-defined]
+                    model=self.azure_deployment,
+                    messages=sanitized_messages,
+                    max_completion_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **extra,
+                )
+            except Exception as exc:
+                raise _wrap_error("Azure OpenAI call failed", exc)
+            bind_response(chunks)
+
+            if metrics is not None:
+                metrics.endpoint = "azure-chat"
+                if metrics.ttfb_ms is None:
+                    metrics.ttfb_ms = metrics.elapsed_ms()
+            pending: Dict[int, Dict[str, str]] = {}
+            round_text: List[str] = []
+            try:
+                for chunk in chunks:
+                    if metrics is not None and getattr(chunk, "usage", None):
+                        metrics.add_usage(chunk.usage)
+                    # Azure 首个 chunk 可能只携带内容过滤结果，choices 为空
+                    if not getattr(chunk, "choices", None):
+                        continue
+                    delta = getattr(chunk.choices[0], "delta", None)
+                    if delta is None:
+                        continue
+                    _accumulate_tool_deltas(pending, _field(delta, "tool_calls"))
+                    text = _field(delta, "content")
+                    if text:
+                        got_text = True
+                        round_text.append(text)
+                        if metrics is not None:
+                            metrics.mark_first_token()
+                        yield text
+            except Exception as exc:
+                check_cancelled()
+                raise _wrap_error("Azure OpenAI stream failed", exc)
+            finally:
+                close = getattr(chunks, "close", None)
+                if callable(close):
+                    close()
+            calls = [pending[i] for i in sorted(pending)]
+            if not calls or rounds >= MAX_TOOL_ROUNDS:
+                break
+            rounds += 1
+            self._append_chat_tool_results(sanitized_messages, "".join(round_text), calls)
+        if not got_text:
+            raise Exception("Empty response: Azure stream returned no content")
+
+    def _iter_sse_events(self, resp: requests.Response) -> Iterator[Dict[str, Any]]:
+        """逐条解析 SSE（text/event-stream）中的 data 行，遇到 [DONE] 结束。
+
+        任务被取消（响应被另一线程关闭）时抛出 GenerationCancelled，而不是把残缺结果当作完成。
+        """
+        try:
+            for raw in resp.iter_lines():
+                check_cancelled()
+                if not raw:
+                    continue
+                line = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield json.loads(data)
+                except ValueError:
+                    continue
+            check_cancelled()
+        except Exception:
+            check_cancelled()
+            raise
+        finally:
+            resp.close()
+
+    def _build_responses_payload(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        use_web_search: bool,
+        use_tools: bool = False,
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "input": self._sanitize_messages(messages),
+        }
+        # 最大输出（responses API 字段名不同）
+        payload["max_output_tokens"] = max_tokens
+        # 限制推理开销，提升产出速度
+        payload["reasoning"] = {"effort": "low"}
+        tools: List[Dict[str, Any]] = []
+        if use_web_search:
+            tools.append({"type": "web_search"})
+        if use_tools:
+            tools.append(responses_tool_spec())
+        if tools:
+            payload["tools"] = tools
+        if self.prompt_cache_key:
+            payload["prompt_cache_key"] = self.prompt_cache_key
+        return payload
+
+    def _build_chat_payload(self, messages: List[dict], max_tokens: int, use_tools: bool = False) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "messages": self._sanitize_messages(messages),
+        }
+        if self.model.startswith("gpt-4") or self.model.startswith("gpt-5"):
+            payload["max_completion_tokens"] = max_tokens
+        else:
+            payload["max_tokens"] = max_tokens
+        if use_tools:
+            payload["tools"] = [chat_tool_spec()]
+        if self.prompt_cache_key:
+            payload["prompt_cache_key"] = self.prompt_cache_key
+        return payload
 
+    def _stream_via_openai(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        use_web_search: bool,
+        use_tools: bool = False,
+    ) -> Iterator[str]:
+        got_text = False
+        metrics = self._current_metrics()
+        rounds = 0
+        if self.use_responses:
+            payload = self._build_responses_payload(messages, max_tokens, use_web_search, use_tools)
+            payload["stream"] = True
+            if metrics is not None:
+                metrics.endpoint = "responses"
+            while True:
+                resp = self._request_with_retry(payload, url=self.responses_api_url, stream=True)
+                calls: List[Dict[str, Any]] = []
+                output_items: List[Dict[str, Any]] = []
+                for event in self._iter_sse_events(resp):
+                    etype = event.get("type")
+                    if etype == "response.output_text.delta":
+                        delta = event.get("delta") or ""
+                        if delta:
+                            got_text = True
+                            if metrics is not None:
+                                metrics.mark_first_token()
+                            yield delta
+                    elif etype == "response.output_item.done":
+                        item = event.get("item") or {}
+                        if item.get("type") == "function_call":
+                            calls.append(item)
+                    elif etype == "response.completed":
+                        completed = event.get("response") or {}
+                        output_items = completed.get("output") or []
+                        if metrics is not None:
+                            metrics.add_usage(completed.get("usage"))
+                    elif etype in ("response.failed", "error"):
+                        detail = event.get("error") or (event.get("response") or {}).get("error") or event
+                        raise Exception(f"Stream error: {detail}")
+                if not calls or rounds >= MAX_TOOL_ROUNDS:
+                    break
+                rounds += 1
+                self._append_responses_tool_results(payload, output_items or calls, calls)
+        else:
+            payload = self._build_chat_payload(messages, max_tokens, use_tools)
+            payload["stream"] = True
+            # 最后一个 chunk 携带 usage
+            payload["stream_options"] = {"include_usage": True}
+            if metrics is not None:
+                metrics.endpoint = "chat"
+            while True:
+                resp = self._request_with_retry(payload, stream=True)
+                pending: Dict[int, Dict[str, str]] = {}
+                round_text: List[str] = []
+                for event in self._iter_sse_events(resp):
+                    if event.get("error"):
+                        raise Exception(f"Stream error: {event['error']}")
+                    if metrics is not None and event.get("usage"):
+                        metrics.add_usage(event["usage"])
+                    for choice in event.get("choices") or []:
+                        _accumulate_tool_deltas(pending, (choice.get("delta") or {}).get("tool_calls"))
+                        delta = (choice.get("delta") or {}).get("content") or ""
+                        if delta:
+                            got_text = True
+                            round_text.append(delta)
+                            if metrics is not None:
+                                metrics.mark_first_token()
+                            yield delta
+                calls = [pending[i] for i in sorted(pending)]
+                if not calls or rounds >= MAX_TOOL_ROUNDS:
+                    break
+                rounds += 1
+                self._append_chat_tool_results(payload["messages"], "".join(round_text), calls)
+        if not got_text:
+            raise Exception("Empty response: stream returned no content")
+
+    def _run_tool_calls(self, calls: List[Dict[str, Any]]) -> List[str]:
+        """在本地执行模型请求的函数工具，返回与 calls 一一对应的 JSON 结果。"""
+        outputs = []
+        for call in calls:
+            name = str(call.get("name") or "")
+            outputs.append(run_tool_call(name, call.get("arguments")))
+            METRICS.inc("broker_tool_calls_total", (("tool", name),))
+        metrics = self._current_metrics()
+        if metrics is not None:
+            metrics.tool_calls += len(calls)
+        return outputs
+
+    def _append_responses_tool_results(
+        self,
+        payload: Dict[str, Any],
+        output_items: List[Dict[str, Any]],
+        calls: List[Dict[str, Any]],
+    ) -> None:
+        """Responses API：回传本轮输出项（含 function_call）及对应的 function_call_output。"""
+        outputs = self._run_tool_calls(calls)
+        payload["input"] = (
+            list(payload["input"])
+            + list(output_items)
+            + [
+                {"type": "function_call_output", "call_id": call.get("call_id"), "output": out}
+                for call, out in zip(calls, outputs)
+            ]
+        )
+
+    def _append_chat_tool_results(
+        self,
+        messages: List[Dict[str, Any]],
+        content: Optional[str],
+        calls: List[Dict[str, Any]],
+    ) -> None:
+        """Chat Completions：追加带 tool_calls 的 assistant 消息及各 tool 结果消息。"""
+        outputs = self._run_tool_calls(calls)
+        messages.append(
+            {
+                "role": "assistant",
+                "content": content or None,
+                "tool_calls": [
+                    {
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {"name": call["name"], "arguments": call["arguments"]},
+                    }
+                    for call in calls
+                ],
+            }
+        )
+        for call, out in zip(calls, outputs):
+            messages.append({"role": "tool", "tool_call_id": call["id"], "content": out})
+
+    def _warn_if_unavailable(self) -> None:
         if not self.model_available:
             print(
                 f"⚠️ 模型 {self.model} 未在 /v1/models 列表中发现，仍尝试直接调用；请确认名称是否正确。"
             )
 
+    def _fingerprint(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        use_web_search: bool,
+        reasoning: bool,
+        use_tools: bool = False,
+    ) -> str:
+        """请求指纹：同时用作回答缓存键与 single-flight 合并键。"""
+        return make_cache_key(
+            self._sanitize_messages(messages),
+            model=self.model,
+            provider=self.provider,
+            reasoning=reasoning,
+            use_web_search=use_web_search,
+            max_tokens=max_tokens,
+            use_tools=use_tools,
+        )
+
+    def _lookup_cached(self, key: Optional[str]) -> Optional[str]:
+        if key and self.response_cache is not None:
+            return self.response_cache.get(key)
+        return None
+
+    def _store_cached(self, key: Optional[str], text: str, use_web_search: bool) -> None:
+        if key and text and self.response_cache is not None:
+            self.response_cache.set(key, text, ttl=self.response_cache.ttl_for(use_web_search))
+
+    def _current_metrics(self) -> Optional[RequestMetrics]:
+        return getattr(self._local, "current", None)
+
+    @property
+    def last_metrics(self) -> Optional[RequestMetrics]:
+        """当前线程最近一次调用的指标（共享客户端下各会话线程互不干扰）。"""
+        return getattr(self._local, "last", None)
+
+    def _begin_metrics(self, stream: bool, use_web_search: bool, reasoning: bool, purpose: str = "chat") -> RequestMetrics:
+        metrics = RequestMetrics(
+            provider=self.provider,
+            model=self.model,
+            stream=stream,
+            web_search=use_web_search,
+            reasoning=reasoning,
+            purpose=purpose,
+        )
+        self._local.current = metrics
+        return metrics
+
+    def _end_metrics(self, metrics: RequestMetrics, status: str = "ok", error: Optional[str] = None) -> None:
+        METRICS.record(metrics.finish(status, error))
+        self._local.current = None
+        self._local.last = metrics
+
+    def _record_usage(self, endpoint: str, data: Dict[str, Any]) -> None:
+        metrics = self._current_metrics()
+        if metrics is not None:
+            metrics.endpoint = endpoint
+            metrics.add_usage(data.get("usage"))
+
+    def stream_response(
+        self,
+        messages: List[dict],
+        max_tokens: int = 1500,
+        use_web_search: bool = False,
+        reasoning: bool = False,
+        use_cache: bool = True,
+        use_tools: bool = False,
+        purpose: str = "chat",
+    ) -> Iterator[str]:
+        """流式生成：逐段产出文本增量（OpenAI 走 SSE，Azure 走 SDK stream=True）。"""
+        metrics = self._begin_metrics(True, use_web_search, reasoning, purpose)
+        key = self._fingerprint(messages, max_tokens, use_web_search, reasoning, use_tools) if use_cache else None
+        cached = self._lookup_cached(key)
+        if cached is not None:
+            metrics.cache_hit = True
+            metrics.mark_first_token()
+            self._end_metrics(metrics)
+            yield cached
+            return
+
+        call, leader = self._inflight.begin(key) if key else (None, True)
+        while not leader:
+            # 相同问题正在生成：等待 leader 的完整结果后一次性输出
+            metrics.coalesced = True
+            try:
+                text = SingleFlight.wait(call, timeout=self.timeout * self.max_retries)
+            except LeaderAborted:
+                # leader 被取消/关闭：重新登记，可能由本调用成为新的 leader 自行请求
+                metrics.coalesced = False
+                call, leader = self._inflight.begin(key)
+                continue
+            except GenerationCancelled:
+                self._end_metrics(metrics, "cancelled")
+                raise
+            except Exception as exc:
+                self._end_metrics(metrics, "error", str(exc))
+                raise
+            metrics.mark_first_token()
+            self._end_metrics(metrics)
+            yield text
+            return
+
+        chunks: List[str] = []
         try:
-            if self.use_responses:
-                # Responses API 路径，支持工具（web_search）
-                payload: Dict[str, Any] = {
-                    "model": self.model,
-                    "input": self._sanitize_messages(messages),
-                }
-                # 最大输出（responses API 字段名不同）
-                payload["max_output_tokens"] = max_tokens
-                # 限制推理开销，提升产出速度
-                payload["reasoning"] = {"effort": "low"}
-                if use_web_search:
-                    payload["tools"] = [{"type": "web_search"}]
-                resp = self._request_with_retry(payload, url=self.responses_api_url)
-                data = resp.json()
-                # Responses API：优先从 message 输出中收集文本
-                content = None
-                if isinstance(data.get("output"), list):
-                    texts: list[str] = []
-                    for item in data["output"]:
-                        if not isinstance(item, dict):
-                            continue
-                        if item.get("type") == "message" and item.get("role") in (None, "assistant"):
-                            for seg in item.get("content", []) or []:
-                                if isinstance(seg, dict):
-                                    t = seg.get("text") or ""
-                                    if t:
-                                        texts.append(t)
-                        elif item.get("type") in ("output_text",):
-                            t = item.get("text") or ""
+            if self.provider == "azure":
+                for delta in self._stream_via_azure(messages, max_tokens, use_web_search, use_tools):
+                    chunks.append(delta)
+                    yield delta
+            else:
+                self._warn_if_unavailable()
+                try:
+                    for delta in self._stream_via_openai(messages, max_tokens, use_web_search, use_tools):
+                        chunks.append(delta)
+                        yield delta
+                except Exception as e:
+                    raise _wrap_error("API call failed", e)
+        except BaseException as exc:
+            # 包括消费方提前关闭生成器（GeneratorExit），避免 follower 永久等待
+            aborted = not isinstance(exc, Exception)
+            if call is not None:
+                self._inflight.finish(key, call, error=LeaderAborted() if aborted else exc)
+            self._end_metrics(metrics, "cancelled" if aborted else "error", None if aborted else str(exc))
+            raise
+        text = "".join(chunks).strip()
+        self._store_cached(key, text, use_web_search)
+        if call is not None:
+            self._inflight.finish(key, call, result=text)
+        self._end_metrics(metrics)
+
+    @staticmethod
+    def _responses_text(data: Dict[str, Any]) -> Optional[str]:
+        """Responses API：优先从 message 输出中收集文本。"""
+        content = None
+        if isinstance(data.get("output"), list):
+            texts: list[str] = []
+            for item in data["output"]:
+                if not isinstance(item, dict):
+                    continue
+                if item.get("type") == "message" and item.get("role") in (None, "assistant"):
+                    for seg in item.get("content", []) or []:
+                        if isinstance(seg, dict):
+                            t = seg.get("text") or ""
                             if t:
                                 texts.append(t)
-                    if texts:
-                        content = "\n".join(texts).strip()
-                if not content:
-                    # 次优：尝试聚合 output_text 或兼容 Chat Completions 字段
-                    content = data.get("output_text") or data.get("choices", [{}])[0].get("message", {}).get("content")
-                if not content:
-                    raise Exception(f"Empty response: {data}")
-                latency = getattr(resp, "latency_ms", 0)
-                return content.strip() + f"\n\n(延迟 {latency:.0f}ms | OpenAI {self.model})"
-            else:
-                # 兼容 Chat Completions 路径
-                payload: Dict[str, Any] = {
-                    "model": self.model,
-                    "messages": self._sanitize_messages(messages),
-                }
-                if self.model.startswith("gpt-4") or self.model.startswith("gpt-5"):
-                    payload["max_completion_tokens"] = max_tokens
-                else:
-                    payload["max_tokens"] = max_tokens
-                resp = self._request_with_retry(payload)
+                elif item.get("type") in ("output_text",):
+                    t = item.get("text") or ""
+                    if t:
+                        texts.append(t)
+            if texts:
+                content = "\n".join(texts).strip()
+        if not content:
+            # 次优：尝试聚合 output_text 或兼容 Chat Completions 字段
+            content = data.get("output_text") or ((data.get("choices") or [{}])[0].get("message") or {}).get("content")
+        return content
+
+    def _generate_via_openai(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        use_web_search: bool,
+        use_tools: bool = False,
+    ) -> Tuple[str, float]:
+        """非流式调用 OpenAI，返回（正文, 延迟毫秒）；模型请求工具时在本地执行并继续。"""
+        rounds = 0
+        if self.use_responses:
+            # Responses API 路径，支持工具（web_search / 房贷计算器）
+            payload = self._build_responses_payload(messages, max_tokens, use_web_search, use_tools)
+            while True:
+                resp = self._request_with_retry(payload, url=self.responses_api_url)
                 data = resp.json()
-                content = data.get("choices", [{}])[0].get("message", {}).get("content")
-                if not content:
-                    raise Exception(f"Empty response: {data}")
-                latency = getattr(resp, "latency_ms", 0)
-                return content.strip() + f"\n\n(延迟 {latency:.0f}ms | OpenAI {self.model})"
-        except Exception as e:
-            raise Exception(f"API call failed: {str(e)}")
+                self._record_usage("responses", data)
+                output = data.get("output") if isinstance(data.get("output"), list) else []
+                calls = [item for item in output if isinstance(item, dict) and item.get("type") == "function_call"]
+                if not calls or rounds >= MAX_TOOL_ROUNDS:
+                    break
+                rounds += 1
+                self._append_responses_tool_results(payload, output, calls)
+            content = self._responses_text(data)
+            if not content:
+                raise Exception(f"Empty response: {data}")
+            return content.strip(), getattr(resp, "latency_ms", 0)
+
+        # 兼容 Chat Completions 路径
+        payload = self._build_chat_payload(messages, max_tokens, use_tools)
+        while True:
+            resp = self._request_with_retry(payload)
+            data = resp.json()
+            self._record_usage("chat", data)
+            message = data.get("choices", [{}])[0].get("message", {})
+            calls = _chat_tool_calls(message.get("tool_calls"))
+            if not calls or rounds >= MAX_TOOL_ROUNDS:
+                break
+            rounds += 1
+            self._append_chat_tool_results(payload["messages"], message.get("content"), calls)
+        content = message.get("content")
+        if not content:
+            raise Exception(f"Empty response: {data}")
+        return content.strip(), getattr(resp, "latency_ms", 0)
+
+    def generate_response(
+        self,
+        messages: List[dict],
+        max_tokens: int = 1500,
+        use_web_search: bool = False,
+        stream: bool = False,
+        reasoning: bool = False,
+        use_cache: bool = True,
+        use_tools: bool = False,
+        purpose: str = "chat",
+    ) -> Union[str, Iterator[str]]:
+        """生成回复；stream=True 时返回文本增量生成器（见 stream_response）。
+
+        reasoning 仅参与缓存键区分；use_cache=False 时绕过回答缓存；
+        use_tools=True 时向模型提供本地房贷计算器函数工具；
+        purpose 作为指标标签区分用户对话（chat）与后台辅助调用（如 summary）。
+        """
+        if stream:
+            return self.stream_response(
+                messages,
+                max_tokens=max_tokens,
+                use_web_search=use_web_search,
+                reasoning=reasoning,
+                use_cache=use_cache,
+                use_tools=use_tools,
+                purpose=purpose,
+            )
+
+        metrics = self._begin_metrics(False, use_web_search, reasoning, purpose)
+        key = self._fingerprint(messages, max_tokens, use_web_search, reasoning, use_tools) if use_cache else None
+        cached = self._lookup_cached(key)
+        if cached is not None:
+            metrics.cache_hit = True
+            self._end_metrics(metrics)
+            return cached
+
+        def _call_upstream() -> str:
+            if self.provider == "azure":
+                return self._generate_via_azure(messages, max_tokens, use_web_search, use_tools)
+            self._warn_if_unavailable()
+            try:
+                text, _ = self._generate_via_openai(messages, max_tokens, use_web_search, use_tools)
+                return text
+            except Exception as e:
+                raise _wrap_error("API call failed", e)
+
+        try:
+            if key is None:
+                text = _call_upstream()
+            else:
+                # 结果统一为正文字符串，流式 leader 与非流式 follower 可互相共享
+                text, shared = self._inflight.do(key, _call_upstream, timeout=self.timeout * self.max_retries)
+                metrics.coalesced = shared
+                if not shared:
+                    self._store_cached(key, text, use_web_search)
+        except GenerationCancelled:
+            self._end_metrics(metrics, "cancelled")
+            raise
+        except Exception as exc:
+            self._end_metrics(metrics, "error", str(exc))
+            raise
+        self._end_metrics(metrics)
+        return text
 
     def test_connection(self) -> bool:
         try:
@@ -262,12 +910,89 @@ class UnifiedAIClient:
                 ],
                 max_tokens=10,
                 use_web_search=False,
+                use_cache=False,
             )
             return True
         except Exception as exc:
             print(f"测试连接失败: {exc}")
             return False
 
+    # 以下为离线批处理（batch_process.py）使用的公开接口：与在线调用共用请求构造与解析逻辑
+
+    def auth_headers(self, json_body: bool = True) -> Dict[str, str]:
+        """带鉴权的请求头；multipart 上传等非 JSON 请求传 json_body=False 去掉 Content-Type。"""
+        headers = self._headers()
+        if not json_body:
+            headers.pop("Content-Type", None)
+        return headers
+
+    @property
+    def request_endpoint(self) -> str:
+        """当前模型使用的接口路径（Responses 或 Chat Completions）。"""
+        return "/v1/responses" if self.use_responses else "/v1/chat/completions"
+
+    def build_request_body(self, messages: List[dict], max_tokens: int = 1500, use_web_search: bool = False) -> Dict[str, Any]:
+        """与在线调用相同的请求体（对应 request_endpoint），不附带本地函数工具。"""
+        if self.use_responses:
+            return self._build_responses_payload(messages, max_tokens, use_web_search)
+        return self._build_chat_payload(messages, max_tokens)
+
+    def extract_text(self, body: Dict[str, Any]) -> Optional[str]:
+        """从 Responses 或 Chat Completions 的完整响应体中取出回答正文。"""
+        return self._responses_text(body)
+
 
 # 别名保持兼容
 OpenAIClient = UnifiedAIClient
+
+
+# 进程级客户端注册表：所有 Streamlit 会话共享同一客户端（及其连接池/探测结果），
+# 会话私有状态（对话历史、开关）仍保存在各自的 AustralianMortgageBroker 中。
+_SHARED_CLIENTS: Dict[Tuple[str, str], Any] = {}
+_SHARED_CLIENTS_LOCK = threading.Lock()
+
+
+def _shared_backend(model: str, provider: str) -> UnifiedAIClient:
+    key = ((provider or "openai").strip().lower(), model or "gpt-4o-mini")
+    client = _SHARED_CLIENTS.get(key)
+    if client is None:
+        client = UnifiedAIClient(model=model, provider=provider)
+        _SHARED_CLIENTS[key] = client
+    return client
+
+
+def get_shared_client(model: str = MODEL_NAME, provider: str = MODEL_PROVIDER):
+    """按 (provider, model) 返回进程内共享的客户端，首次调用时创建。
+
+    配置了 FAILOVER_PROVIDERS 时返回包装多个后端的 MultiProviderClient。
+    """
+    primary = (provider or "openai").strip().lower()
+    providers = [primary] + [p for p in FAILOVER_PROVIDERS if p != primary] if FAILOVER_PROVIDERS else [primary]
+    key = ("+".join(providers), model or "gpt-4o-mini")
+    client = _SHARED_CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _SHARED_CLIENTS_LOCK:
+        client = _SHARED_CLIENTS.get(key)
+        if client is not None:
+            return client
+        if len(providers) == 1:
+            return _shared_backend(model, primary)
+        from utils.failover import MultiProviderClient  # 避免循环导入
+
+        backends = [_shared_backend(model, primary)]
+        for name in providers[1:]:
+            try:
+                backends.append(_shared_backend(model, name))
+            except ValueError as exc:
+                # 备用后端凭据缺失时跳过，不影响主后端
+                print(f"⚠️ 故障转移后端 {name} 不可用: {exc}")
+        client = MultiProviderClient(backends) if len(backends) > 1 else backends[0]
+        _SHARED_CLIENTS[key] = client
+        return client
+
+
+def reset_shared_clients() -> None:
+    """清空注册表（例如凭据变更后需重建客户端）。"""
+    with _SHARED_CLIENTS_LOCK:
+        _SHARED_CLIENTS.clear()